@@ -0,0 +1,62 @@
+"""Add full text search
+
+Revision ID: 5a6b7c8d9e0f
+Revises: c3d8e5f1a2b4
+Create Date: 2026-10-18 15:21:09.431877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a6b7c8d9e0f'
+down_revision: Union[str, None] = 'c3d8e5f1a2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCHED = (('tasks', 'title'), ('lists', 'name'))
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCHED:
+        if dialect == 'postgresql':
+            # generated, so Postgres keeps it in sync on every write
+            op.execute(
+                f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+                f"(to_tsvector('english', coalesce({column}, ''))) STORED")
+            op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], postgresql_using='gin')
+        elif dialect == 'sqlite':
+            # external content FTS5 index, kept in sync by triggers
+            op.execute(
+                f"CREATE VIRTUAL TABLE search_{table} USING fts5({column}, content='{table}', "
+                f"content_rowid='id', tokenize='porter unicode61')")
+            op.execute(
+                f"CREATE TRIGGER search_{table}_insert AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO search_{table}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            op.execute(
+                f"CREATE TRIGGER search_{table}_delete AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO search_{table}(search_{table}, rowid, {column}) "
+                f"VALUES ('delete', old.id, old.{column}); END")
+            op.execute(
+                f"CREATE TRIGGER search_{table}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+                f"INSERT INTO search_{table}(search_{table}, rowid, {column}) "
+                f"VALUES ('delete', old.id, old.{column}); "
+                f"INSERT INTO search_{table}(rowid, {column}) VALUES (new.id, new.{column}); END")
+            # index the rows that already exist
+            op.execute(f"INSERT INTO search_{table}(search_{table}) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCHED:
+        if dialect == 'postgresql':
+            op.drop_index(f'ix_{table}_search_vector', table_name=table)
+            op.drop_column(table, 'search_vector')
+        elif dialect == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f"DROP TRIGGER IF EXISTS search_{table}_{trigger}")
+            op.execute(f"DROP TABLE IF EXISTS search_{table}")
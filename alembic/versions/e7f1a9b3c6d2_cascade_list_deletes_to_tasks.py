@@ -0,0 +1,29 @@
+"""Cascade list deletes to tasks
+
+Revision ID: e7f1a9b3c6d2
+Revises: 5a6b7c8d9e0f
+Create Date: 2026-10-18 16:02:44.903518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7f1a9b3c6d2'
+down_revision: Union[str, None] = '5a6b7c8d9e0f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # tasks_list_id_fkey is the name Postgres gave the unnamed key from ad19bbb67d58
+    op.drop_constraint('tasks_list_id_fkey', 'tasks', type_='foreignkey')
+    op.create_foreign_key('tasks_list_id_fkey', 'tasks', 'lists', ['list_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    op.drop_constraint('tasks_list_id_fkey', 'tasks', type_='foreignkey')
+    op.create_foreign_key('tasks_list_id_fkey', 'tasks', 'lists', ['list_id'], ['id'])
@@ -0,0 +1,172 @@
+#Admission control: shed load early instead of letting requests queue up on the
+#database pool until they time out.
+#- RouteLimit caps how many requests of one route run at once. Up to 'queue' more
+#  wait for a slot, each at most 'timeout' seconds; past either limit the request
+#  gets 503 with Retry-After straight away.
+#- RateLimit is a token bucket per user (per client address when there is no valid
+#  token): 'rate' requests per second on average, bursts of up to 'burst'. Over the
+#  limit the request gets 429 with Retry-After.
+#Limits are set per route in main.py, keyed by "METHOD /path/template". Everything
+#runs on the event loop, so the counters need no locks.
+
+import asyncio
+import math
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+from typing import Dict, Optional
+
+from starlette.routing import Match
+
+from . import metrics
+from .cache import TTLCache
+
+
+@dataclass
+class RouteLimit:
+    concurrency: int  # requests running at once
+    queue: int = 0  # requests waiting for a slot
+    timeout: float = 1.0  # longest wait in the queue, in seconds
+
+
+@dataclass
+class RateLimit:
+    rate: float  # requests per second per user
+    burst: int  # bucket size
+
+
+class Overloaded(Exception):
+    def __init__(self, status: int, retry_after: float, reason: str):
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: RouteLimit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = deque()
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self):
+        if self.active < self.limit.concurrency and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.limit.queue:
+            self.rejected += 1
+            raise Overloaded(503, self.limit.timeout, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            #release() hands its slot straight to the first waiter
+            await asyncio.wait_for(waiter, self.limit.timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # got a slot just as the wait ended
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(exc, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Overloaded(503, self.limit.timeout, "queue_timeout")
+            raise
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # the slot moves on, 'active' stays the same
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {"in_flight": self.active, "queued": len(self.waiters),
+                "rejected": self.rejected, "timed_out": self.timed_out}
+
+
+class TokenBuckets:
+    def __init__(self, limit: RateLimit, maxsize: int = 100_000):
+        self.limit = limit
+        #key -> [tokens, last refill]; an idle bucket is full again after burst / rate
+        #seconds, so it can be dropped then and recreated full
+        self.buckets = TTLCache(maxsize=maxsize, ttl=limit.burst / limit.rate)
+        self.limited = 0
+
+    def take(self, key):
+        now = monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.limit.burst), now]
+        tokens = min(self.limit.burst, bucket[0] + (now - bucket[1]) * self.limit.rate)
+        if tokens < 1:
+            self.buckets.set(key, [tokens, now])
+            self.limited += 1
+            raise Overloaded(429, (1 - tokens) / self.limit.rate, "rate_limited")
+        self.buckets.set(key, [tokens - 1, now])
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, router, limits: Dict[str, RouteLimit], rate_limit: Optional[RateLimit] = None,
+                 user_key=None, exempt=()):
+        self.app = app
+        self.router = router  # to find the route a request is for, as the router will
+        self.limiters = {route: ConcurrencyLimiter(limit) for route, limit in limits.items()}
+        self.buckets = TokenBuckets(rate_limit) if rate_limit else None
+        self.user_key = user_key  # request headers -> user key or None
+        self.exempt = set(exempt)
+        metrics.collectors.append(self.metric_lines)
+
+    def match(self, scope):
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    def client_key(self, scope):
+        headers = dict(scope["headers"])
+        key = self.user_key(headers) if self.user_key else None
+        if key is None:
+            client = scope.get("client")
+            key = "ip:" + (client[0] if client else "unknown")
+        return key
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self.match(scope)
+        name = f"{scope['method']} {route.path}" if route is not None else None
+        if route is not None:
+            scope["route"] = route  # so rejections are labelled with the route in app/metrics.py
+        if name in self.exempt:
+            return await self.app(scope, receive, send)
+
+        limiter = self.limiters.get(name)
+        try:
+            if self.buckets is not None:
+                self.buckets.take(self.client_key(scope))
+            if limiter is not None:
+                await limiter.acquire()
+        except Overloaded as exc:
+            return await self.reject(exc, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    async def reject(self, exc: Overloaded, send):
+        body = b'{"detail":"Server busy, retry later"}' if exc.status == 503 else b'{"detail":"Too many requests"}'
+        await send({"type": "http.response.start", "status": exc.status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(exc.retry_after))).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    def metric_lines(self):
+        lines = metrics.stats_lines("admission", {name: limiter.stats() for name, limiter in self.limiters.items()},
+                                    label="route")
+        if self.buckets is not None:
+            lines.append(f"admission_rate_limited {self.buckets.limited}")
+        return lines
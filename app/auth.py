@@ -4,10 +4,11 @@ import os
 from datetime import datetime, timedelta
 from typing import Union, Any
 from jose import jwt
+from app import env
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # 30 minutes
 ALGORITHM = "HS256"
-JWT_SECRET_KEY = os.environ['JWT_SECRET_KEY']   
+JWT_SECRET_KEY = env.required('JWT_SECRET_KEY')
 
 def create_access_token(subject: Union[str, Any], expires_delta: int = None) -> str:
     if expires_delta is not None:
@@ -0,0 +1,55 @@
+#Consistency check for lists.task_count / lists.completed_count (app/counts.py).
+#Recomputes the counts of every list with one GROUP BY over tasks and reports the
+#lists whose stored counts differ; --fix recounts those lists.
+#   pipenv run python -m app.check_counts
+#   pipenv run python -m app.check_counts --fix
+
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import case, func, select
+
+from app import counts, database
+
+CHUNK = 1000
+
+
+def mismatch_query():
+    lists, tasks = counts.lists_table, counts.tasks_table
+    actual_tasks = func.count(tasks.c.id)
+    actual_completed = func.count(case((tasks.c.completed.is_(True), tasks.c.id)))
+    return select(lists.c.id, lists.c.task_count, lists.c.completed_count,
+                  actual_tasks.label("actual_tasks"), actual_completed.label("actual_completed")).select_from(
+        lists.outerjoin(tasks, tasks.c.list_id == lists.c.id)).group_by(
+        lists.c.id, lists.c.task_count, lists.c.completed_count).having(
+        (lists.c.task_count != actual_tasks) | (lists.c.completed_count != actual_completed)).order_by(lists.c.id)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check the per-list task counts against the tasks table")
+    parser.add_argument("--fix", action="store_true", help="recount the lists whose counts are off")
+    args = parser.parse_args(argv)
+
+    with database.engine.begin() as conn:
+        rows = conn.execute(mismatch_query()).all()
+        for row in rows:
+            print(f"list {row.id}: stored {row.task_count}/{row.completed_count}, "
+                  f"actual {row.actual_tasks}/{row.actual_completed}")
+        if not rows:
+            print("all list counts match")
+            return 0
+        if not args.fix:
+            return 1
+        ids = [row.id for row in rows]
+        for start in range(0, len(ids), CHUNK):
+            conn.execute(counts.recount_statement(ids[start:start + CHUNK]))
+        print(f"recounted {len(ids)} lists")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
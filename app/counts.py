@@ -0,0 +1,62 @@
+#Per-list task counts (lists.task_count / lists.completed_count) for GET /lists/summary.
+#Every write to tasks changes the counts of its lists in the same transaction:
+#every write adds its change with adjust(): "task_count = task_count + n", which is
+#safe against concurrent writers without locking the list first. Bulk changes work
+#theirs out from the rows their statement returns (app/tasks.py).
+#app/check_counts.py compares the stored counts against a GROUP BY over tasks, and
+#recount() sets them from the tasks table.
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models
+
+lists_table = models.List.__table__
+tasks_table = models.Task.__table__
+
+#Core statement run once per list with executemany (the ORM would treat a list of
+#parameters with a WHERE clause as an unsupported bulk update)
+adjust_statement = update(lists_table).where(lists_table.c.id == bindparam("b_list_id")).values(
+    task_count=lists_table.c.task_count + bindparam("b_tasks"),
+    completed_count=lists_table.c.completed_count + bindparam("b_completed"))
+
+
+#deltas: {list_id: (change in tasks, change in completed tasks)}
+def adjust_params(deltas: dict):
+    return [{"b_list_id": list_id, "b_tasks": tasks, "b_completed": completed}
+            for list_id, (tasks, completed) in deltas.items() if tasks or completed]
+
+def adjust(db: Session, deltas: dict):
+    params = adjust_params(deltas)
+    if params:
+        db.execute(adjust_statement, params)
+
+async def adjust_async(db: AsyncSession, deltas: dict):
+    params = adjust_params(deltas)
+    if params:
+        await db.execute(adjust_statement, params)
+
+
+#The counts as computed from the tasks table, as correlated subqueries on lists
+def counted_tasks():
+    return select(func.count(tasks_table.c.id)).where(
+        tasks_table.c.list_id == lists_table.c.id).scalar_subquery()
+
+def counted_completed():
+    return select(func.count(tasks_table.c.id)).where(
+        tasks_table.c.list_id == lists_table.c.id, tasks_table.c.completed.is_(True)).scalar_subquery()
+
+def recount_statement(list_ids=None):
+    statement = update(lists_table).values(task_count=counted_tasks(), completed_count=counted_completed())
+    if list_ids is not None:
+        statement = statement.where(lists_table.c.id.in_(list_ids))
+    return statement
+
+def recount(db: Session, list_ids):
+    if list_ids:
+        db.execute(recount_statement(list_ids))
+
+async def recount_async(db: AsyncSession, list_ids):
+    if list_ids:
+        await db.execute(recount_statement(list_ids))
@@ -1,14 +1,55 @@
 #1. import SQLAlchemy parts
-from sqlalchemy import create_engine
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import itertools
 import os
+from app import env, metrics
 
 #2. Create PostgreSQL database and define a database url
-DATABASE_URL = os.environ["DATABASE_URL"]
+DATABASE_URL = env.required("DATABASE_URL")
+
+#Connection pool settings, shared by every engine below:
+#DB_POOL_SIZE connections are kept open, DB_MAX_OVERFLOW more may be opened under load,
+#a checkout waits at most DB_POOL_TIMEOUT seconds for a free one, connections older
+#than DB_POOL_RECYCLE seconds are replaced (-1 = never), and DB_POOL_PRE_PING=1 tests
+#each connection on checkout so one dropped by the server is not handed out.
+POOL_OPTIONS = {
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "-1")),
+    "pool_pre_ping": env.flag("DB_POOL_PRE_PING"),
+}
 
 #3. Create SQLAlchemy engine (allows us to use the hosted database)
-engine = create_engine(DATABASE_URL)
+#(TimedQueuePool records how long each connection checkout waits, see app/metrics.py)
+engine = create_engine(DATABASE_URL, poolclass=metrics.TimedQueuePool, **POOL_OPTIONS)
+
+#SQLite settings each connection has to ask for. Called for every engine made in
+#this module.
+#- foreign_keys: only then are foreign keys, and so ON DELETE CASCADE, enforced.
+#- busy_timeout: SQLite has one writer at a time, and a write waits this long for the
+#  lock before failing with "database is locked". The driver's default is 5 s. Async
+#  mode holds the lock across event loop turns, so under load writers waited longer
+#  and failed; they now wait as long as a pool checkout may (DB_POOL_TIMEOUT).
+#- journal_mode=WAL: readers do not wait for the writer, nor it for them.
+def configure_sqlite(engine):
+    if engine.dialect.name != "sqlite":
+        return engine
+
+    @event.listens_for(engine.sync_engine if hasattr(engine, "sync_engine") else engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute(f"PRAGMA busy_timeout={int(POOL_OPTIONS['pool_timeout'] * 1000)}")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+    return engine
+
+configure_sqlite(engine)
 
 #4. Create a SessionLocal class (this is the database session, or the instance is)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) #we use engine that we defined in previous step
@@ -17,4 +58,85 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) #we
 Base = declarative_base()
 
 
+#Async mode
+#Set DATABASE_ASYNC=1 to serve requests from an AsyncSession instead of the sync
+#SessionLocal. The sync engine above stays available either way (alembic and
+#scripts use it).
+ASYNC_MODE = env.flag("DATABASE_ASYNC")
+
+#Swap the sync driver in DATABASE_URL for its async counterpart
+#(psycopg2 -> asyncpg, pysqlite -> aiosqlite) unless ASYNC_DATABASE_URL is set.
+def get_async_url(url: str) -> str:
+    scheme, _, rest = url.partition("://")
+    driver = scheme.split("+")[0]
+    if driver in ("postgres", "postgresql"):
+        return "postgresql+asyncpg://" + rest
+    if driver == "sqlite":
+        return "sqlite+aiosqlite://" + rest
+    return url
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", get_async_url(DATABASE_URL))
+
+async_engine = None
+AsyncSessionLocal = None
+
+if ASYNC_MODE:
+    async_engine = configure_sqlite(
+        create_async_engine(ASYNC_DATABASE_URL, poolclass=metrics.TimedAsyncQueuePool, **POOL_OPTIONS))
+    #expire_on_commit=False: the route returns ORM objects after commit and FastAPI
+    #serialises them outside the session, where an async lazy refresh is not possible.
+    AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+
+#Read replicas
+#DATABASE_REPLICA_URLS is a comma separated list of replica database urls (sync driver
+#urls, swapped like DATABASE_URL in async mode). Read-only routes take their session
+#from read_session(), which picks the replicas in turn; writes always use the primary.
+#A replica can lag behind the primary, so a client that must see its own write sends
+#the X-Read-Primary header and is served from the primary.
+READ_PRIMARY_HEADER = "X-Read-Primary"
+
+REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+if ASYNC_MODE:
+    replica_engines = [configure_sqlite(create_async_engine(
+        get_async_url(url), poolclass=metrics.TimedAsyncQueuePool, **POOL_OPTIONS)) for url in REPLICA_URLS]
+else:
+    replica_engines = [configure_sqlite(create_engine(
+        url, poolclass=metrics.TimedQueuePool, **POOL_OPTIONS)) for url in REPLICA_URLS]
+
+_next_replica = itertools.cycle(replica_engines)
+
+#A session for a read-only request, on the next replica (or the primary)
+def read_session(primary: bool = False):
+    session_class = AsyncSessionLocal if ASYNC_MODE else SessionLocal
+    if primary or not replica_engines:
+        return session_class()
+    return session_class(bind=next(_next_replica))
+
+#Pool state of the primary and every replica, for /health and /metrics
+def pool_stats() -> dict:
+    engines = {"primary": async_engine if ASYNC_MODE else engine}
+    for i, replica in enumerate(replica_engines):
+        engines[f"replica-{i}"] = replica
+    return {name: {"size": e.pool.size(), "checked_in": e.pool.checkedin(),
+                   "checked_out": e.pool.checkedout(), "overflow": e.pool.overflow()}
+            for name, e in engines.items()}
+
+metrics.collectors.append(lambda: metrics.stats_lines("db_pool", pool_stats(), label="engine"))
+
+#Dispose of the async engines on shutdown; aiosqlite keeps a non-daemon thread per
+#connection, which otherwise keeps the process alive after the server stops.
+async def dispose_async_engines():
+    if async_engine is not None:
+        await async_engine.dispose()
+    if ASYNC_MODE:
+        for replica in replica_engines:
+            await replica.dispose()
 
+#Call a CRUD function for the configured mode. Async mode awaits the *_async version
+#with the AsyncSession; sync mode runs the plain version in the threadpool, which is
+#what FastAPI did when the routes were plain 'def' functions.
+async def run_crud(sync_fn, async_fn, db, **kwargs):
+    if ASYNC_MODE:
+        return await async_fn(db, **kwargs)
+    return await run_in_threadpool(sync_fn, db, **kwargs)
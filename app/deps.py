@@ -1,15 +1,74 @@
+import os
 from datetime import datetime
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 
 from jose import jwt
 from pydantic import ValidationError
-from app import database, models
+from sqlalchemy import event
+from app import database, metrics, models, users
+from app.database import run_crud
+from app.cache import TTLCache
 from app.schemas import TokenPayload, UserBase
 from app.auth import ALGORITHM, JWT_SECRET_KEY
 #changed the above from this from app.credentials import ALGORITHM, JWT_SECRET_KEY
 
 
+#Dependency
+#Define a function (get_db) to obtain a database session (SessionLocal) using 
+#FastAPI's dependency injection. The session is yielded for use in route functions, 
+#and it's ensured to be closed after use.
+
+def get_db():
+    db = database.SessionLocal()
+    #Begins by creating a new DB session ('db') using 
+    #'SessionLocal' method from the database module. This session represents a connection 
+    #to the database.
+    try:
+        yield db
+    #This try block contains a 'yield' statement. It provides the db session to 
+    #the route function that depends on this get_db function which allows the route function
+    #to use the session for db operations.
+    finally:
+        db.close()
+    #This finally block ensures that the database session is closed.
+        
+#Purpose of 'get_db' function:
+    #Dependency for Route Functions - When a route function depends on get_db, FastAPI will 
+    #automatically provide it with a database session.
+    #Database Session Management - ensure that each route function gets its own isolated 
+    #session. This helps manage transactions and prevent unintended side effects between different 
+    #parts of your application.
+    #Resource Cleanup: finally block ensures that the database session is properly closed, even if an error occurs.       
+
+#Async version of get_db, used when DATABASE_ASYNC=1. The AsyncSession does not pin
+#a worker thread while it waits on the database.
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+#The session dependency every route uses, picked once from the configured mode.
+get_session = get_async_db if database.ASYNC_MODE else get_db
+
+#Same for read-only routes: the session is on a read replica when DATABASE_REPLICA_URLS
+#is set, unless the request asks for the primary (database.READ_PRIMARY_HEADER).
+def wants_primary(request: Request) -> bool:
+    return request.headers.get(database.READ_PRIMARY_HEADER, "0").lower() in ("1", "true", "yes")
+
+def get_read_db(request: Request):
+    db = database.read_session(primary=wants_primary(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request):
+    async with database.read_session(primary=wants_primary(request)) as db:
+        yield db
+
+get_read_session = get_async_read_db if database.ASYNC_MODE else get_read_db
+
+
 # This dependency will make sure get_current_user below will
 # always receive the `token` as a string.
 reuseable_oauth = OAuth2PasswordBearer(
@@ -17,11 +76,44 @@ reuseable_oauth = OAuth2PasswordBearer(
     scheme_name="JWT"
 )
 
-# Here, we receive the `token` as a string from `reusable_auth`
-async def get_current_user(token: str = Depends(reuseable_oauth)) -> UserBase:
-    try:
-        db = database.SessionLocal()
+# Auth caches. Verified tokens are kept until their `exp`, so repeated requests
+# with the same token skip jwt.decode. Users are kept by id for a short TTL so they
+# skip the SELECT; a cache hit never touches the database session at all.
+# The token cache only saves the decoding: whether the user may still log in is the
+# user cache's part. Each worker process has its own caches, and only ORM changes
+# made in the same process drop a cached user at once (_user_changed below). A user
+# disabled or deleted any other way (a Core UPDATE, another worker, another server)
+# keeps being served for up to AUTH_USER_CACHE_TTL seconds. 0 turns the user cache
+# off.
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "1024"))
+AUTH_USER_CACHE_TTL = float(os.environ.get("AUTH_USER_CACHE_TTL", "5"))
+
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE)
+user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_USER_CACHE_TTL)
+
+
+def invalidate_user(user_id: int):
+    user_cache.delete(user_id)
 
+
+def auth_cache_stats() -> dict:
+    return {"token": token_cache.stats(), "user": user_cache.stats()}
+
+metrics.collectors.append(lambda: metrics.stats_lines("auth_cache", auth_cache_stats(), label="cache"))
+
+
+# drop a cached user as soon as the row is changed (e.g. disabled) or deleted
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+def decode_token(token: str) -> TokenPayload:
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
+    try:
         # the injected token here comes from the Authorization header
         # and is always present if we reach this code
         payload = jwt.decode(
@@ -42,14 +134,40 @@ async def get_current_user(token: str = Depends(reuseable_oauth)) -> UserBase:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    token_cache.set(token, token_data, expires_at=token_data.exp)
+    return token_data
+
+
+# Rate limit key for app/admission.py: the user id of a valid bearer token, or None
+# (the client address is used then). Runs before the route, on the raw headers.
+def rate_limit_key(headers: dict):
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return "user:" + decode_token(token).sub.split(":")[0]
+    except HTTPException:
+        return None
+
+
+# Here, we receive the `token` as a string from `reusable_auth`
+async def get_current_user(token: str = Depends(reuseable_oauth), db=Depends(get_session)) -> UserBase:
+    token_data = decode_token(token)
+
     # convert the string "id:username" in the token to [id, username]
     [user_id, _username] = token_data.sub.split(":")
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = user_cache.get(int(user_id))
+    if user is not None:
+        return user
+
+    db_user = await run_crud(users.get_user, users.get_user_async, db, user_id=int(user_id))
 
-    if user is None:
+    if db_user is None or db_user.disabled:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not Authorized",
         )
 
-    return user
\ No newline at end of file
+    user = UserBase(id=db_user.id, username=db_user.username)
+    user_cache.set(user.id, user)
+    return user
@@ -0,0 +1,27 @@
+#Reading settings from the environment.
+#Settings are read when a module is imported, so .env has to be loaded before the
+#first 'from app import ...' (main.py and the command line tools do that first).
+#Required settings fail with a message saying what to set instead of a bare KeyError.
+
+import os
+
+REQUIRED = ("DATABASE_URL", "JWT_SECRET_KEY")
+
+
+class MissingSetting(RuntimeError):
+    pass
+
+
+def required(name: str) -> str:
+    value = os.environ.get(name)
+    if not value:
+        raise MissingSetting(f"{name} is not set. Set it in the environment or in a .env file.")
+    return value
+
+
+def missing(names=REQUIRED) -> list:
+    return [name for name in names if not os.environ.get(name)]
+
+
+def flag(name: str, default: str = "0") -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
@@ -0,0 +1,369 @@
+#Live change feed for GET /events.
+#Every write to lists and tasks records events on its session with add() before it
+#commits, e.g. {"type": "task.created", "version": 42, "data": {...task...}}.
+#'version' is the owner's lists_version after the write (app/versions.py): it goes
+#up by one per write, so clients resume from the last version they saw and a missing
+#number means events were missed.
+#Events leave the session only when it commits (dropped on rollback) and go through
+#a backend to the Broker of every server process, which hands them to the open
+#streams / long-polls of that user and keeps the last few per user for resuming.
+#Backends (EVENTS_BACKEND, default by database):
+#- postgres: the events are sent with NOTIFY inside the write's own transaction, so
+#  Postgres delivers them only if it commits, in commit order, to every process
+#  LISTENing on EVENTS_CHANNEL (including the one that wrote).
+#- memory: delivered to this process after the commit. Enough for one process
+#  (SQLite, tests); with several workers only the writing worker's clients hear it.
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import database, metrics, versions
+from .cache import TTLCache
+
+logger = logging.getLogger("app")
+
+EVENTS_BACKEND = os.environ.get("EVENTS_BACKEND", "postgres" if database.engine.dialect.name == "postgresql" else "memory")
+EVENTS_CHANNEL = os.environ.get("EVENTS_CHANNEL", "todo_events")
+#recent events kept per user, for resuming a stream or the next long-poll
+EVENTS_BUFFER_SIZE = int(os.environ.get("EVENTS_BUFFER_SIZE", "100"))
+EVENTS_BUFFER_TTL = float(os.environ.get("EVENTS_BUFFER_TTL", "300"))
+#events a slow client may fall behind before it is sent a reset
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get("EVENTS_KEEPALIVE_SECONDS", "15"))
+EVENTS_RECONNECT_SECONDS = float(os.environ.get("EVENTS_RECONNECT_SECONDS", "2"))
+
+#Postgres refuses NOTIFY payloads of 8000 bytes or more
+NOTIFY_MAX_BYTES = 7900
+#task ids per tasks.updated / tasks.deleted event of a bulk change
+BULK_EVENT_IDS = 500
+
+
+#Record an event on the write's session; 'owner' is the (id, username, lists_version) row
+#returned by versions.bump(). No database work, so the same call serves both modes.
+def add(db, owner, type: str, data: dict):
+    if owner is None:
+        return
+    db.info.setdefault("events", []).append(
+        [owner.id, {"type": type, "version": owner.lists_version, "data": data}])
+
+
+#SQLAlchemy runs these for every Session, including the one inside an AsyncSession
+@event.listens_for(Session, "before_commit")
+def _before_commit(session):
+    pending = session.info.get("events")
+    if pending:
+        backend.before_commit(session, pending)
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    pending = session.info.pop("events", None)
+    if pending:
+        backend.after_commit(pending)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    session.info.pop("events", None)
+
+
+#Put on a subscriber's queue in place of events it can no longer be sent: it fell
+#too far behind, or the events of a Postgres reconnect were lost
+RESET = {"type": "reset"}
+#Put on every queue when the server stops, ending the streams
+CLOSE = {"type": "close"}
+
+
+class Subscription:
+    def __init__(self, broker, user_id: int):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+    def put(self, item):
+        if self.queue.full():
+            self.broker.dropped += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            item = RESET
+        self.queue.put_nowait(item)
+
+    def __enter__(self):
+        self.broker.subscribers.setdefault(self.user_id, set()).add(self)
+        return self
+
+    def __exit__(self, *exc):
+        subscribers = self.broker.subscribers.get(self.user_id)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.broker.subscribers[self.user_id]
+
+
+#The last EVENTS_BUFFER_SIZE events of one user. One write may record more events
+#than that (a batch create), so once an event has been pushed out the events of its
+#version may be incomplete: 'evicted' is that version, and resuming from before it
+#means starting over.
+class Buffer:
+    def __init__(self):
+        self.events = deque(maxlen=EVENTS_BUFFER_SIZE)
+        self.evicted = 0
+
+    def append(self, item):
+        if len(self.events) == self.events.maxlen:
+            self.evicted = self.events[0]["version"]
+        self.events.append(item)
+
+
+#In-process pub/sub. Everything but deliver_threadsafe() runs on the event loop.
+class Broker:
+    def __init__(self):
+        self.loop = None  # set by start(); events before that have no one to go to
+        self.subscribers = {}  # user id -> set of Subscription
+        self.recent = TTLCache(maxsize=10_000, ttl=EVENTS_BUFFER_TTL)  # user id -> Buffer
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await backend.start()
+
+    async def stop(self):
+        self.close_streams()
+        await backend.stop()
+        self.loop = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        return Subscription(self, user_id)
+
+    def deliver(self, events):
+        for user_id, item in events:
+            buffer = self.recent.get(user_id)
+            if buffer is None:
+                buffer = Buffer()
+            buffer.append(item)
+            self.recent.set(user_id, buffer)
+            for subscription in self.subscribers.get(user_id, ()):
+                subscription.put(item)
+            self.delivered += 1
+
+    #from a threadpool thread (sync mode) as well as from the loop
+    def deliver_threadsafe(self, events):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.deliver, events)
+
+    #Events may have been missed: every client starts over
+    def reset(self):
+        self.recent.clear()
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                subscription.put(RESET)
+
+    def close_streams(self):
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                subscription.put(CLOSE)
+
+    #Buffered events of the user after version 'since', and whether the client has to
+    #start over instead: 'current' (the owner's version in the database) is ahead of
+    #'since' but the buffer does not hold all the events of since + 1 onwards.
+    def since(self, user_id: int, since: int, current: Optional[int]):
+        buffer = self.recent.get(user_id) or Buffer()
+        buffered = sorted((item for item in buffer.events if item["version"] > since),
+                          key=lambda item: item["version"])
+        if current is None or since > current:
+            return [], True
+        if current > since and (not buffered or buffered[0]["version"] > since + 1 or buffer.evicted > since):
+            return [], True
+        return buffered, False
+
+    def stats(self) -> dict:
+        return {"subscribers": sum(len(s) for s in self.subscribers.values()),
+                "delivered": self.delivered, "dropped": self.dropped}
+
+
+broker = Broker()
+
+metrics.collectors.append(lambda: metrics.stats_lines("events", broker.stats()))
+
+
+class MemoryBackend:
+    def before_commit(self, session, events):
+        pass
+
+    def after_commit(self, events):
+        broker.deliver_threadsafe(events)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+#NOTIFY payloads: JSON arrays of [user id, event], each under NOTIFY_MAX_BYTES. An
+#event too big on its own (a very long title) is sent with only its ids.
+def payloads(events):
+    chunks, chunk, size = [], [], 2
+    for user_id, item in events:
+        encoded = json.dumps([user_id, item])
+        if len(encoded.encode()) > NOTIFY_MAX_BYTES:
+            data = {key: value for key, value in item["data"].items() if key in ("id", "list_id")}
+            encoded = json.dumps([user_id, {**item, "data": {**data, "partial": True}}])
+        if chunk and size + len(encoded.encode()) + 1 > NOTIFY_MAX_BYTES:
+            chunks.append("[" + ",".join(chunk) + "]")
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += len(encoded.encode()) + 1
+    if chunk:
+        chunks.append("[" + ",".join(chunk) + "]")
+    return chunks
+
+
+class PostgresBackend:
+    notify = text("SELECT pg_notify(:channel, :payload)")
+
+    def __init__(self):
+        self.task = None
+
+    #Runs inside the commit; in async mode SQLAlchemy runs this through the async driver
+    def before_commit(self, session, events):
+        for payload in payloads(events):
+            session.execute(self.notify, {"channel": EVENTS_CHANNEL, "payload": payload})
+
+    def after_commit(self, events):
+        pass  # Postgres delivers them to listen()
+
+    async def start(self):
+        self.task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def received(self, connection, pid, channel, payload):
+        broker.deliver(json.loads(payload))
+
+    #One LISTEN connection per process (asyncpg, in both modes), reconnected when lost.
+    #Notifications sent while it was down are gone, so clients are told to reset.
+    async def listen(self):
+        import asyncpg
+
+        dsn = make_url(database.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        connected_before = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(EVENTS_CHANNEL, self.received)
+                if connected_before:
+                    logger.warning("events: LISTEN connection back, resetting clients")
+                    broker.reset()
+                connected_before = True
+                await lost.wait()
+                logger.warning("events: LISTEN connection lost")
+            except asyncio.CancelledError:
+                if connection is not None:
+                    await connection.close()
+                raise
+            except Exception:
+                logger.exception("events: LISTEN on %s failed", EVENTS_CHANNEL)
+            await asyncio.sleep(EVENTS_RECONNECT_SECONDS)
+
+
+BACKENDS = {"memory": MemoryBackend, "postgres": PostgresBackend}
+backend = BACKENDS[EVENTS_BACKEND]()
+
+
+#The owner's current version, read on the primary (a replica may lag behind the
+#events). The session is closed afterwards so no pooled connection is held while
+#the request waits for events.
+def get_version(db: Session, user_id: int):
+    try:
+        return versions.get_owner_version(db, user_id)
+    finally:
+        db.close()
+
+async def get_version_async(db: AsyncSession, user_id: int):
+    try:
+        return await versions.get_owner_version_async(db, user_id)
+    finally:
+        await db.close()
+
+
+def client_event(item) -> dict:
+    return {"type": item["type"], "version": item.get("version"), "data": item.get("data")}
+
+
+#Long-poll: the events after 'since', waiting up to 'timeout' seconds for one
+async def poll(user_id: int, since: Optional[int], current: Optional[int], timeout: float) -> dict:
+    if since is None:
+        #first call: nothing to catch up on, just where to start from
+        return {"events": [], "version": current or 0, "reset": False}
+    with broker.subscribe(user_id) as subscription:  # before the buffer check, so nothing slips in between
+        events, reset = broker.since(user_id, since, current)
+        if not events and not reset:
+            try:
+                events = [await asyncio.wait_for(subscription.queue.get(), timeout)]
+            except asyncio.TimeoutError:
+                return {"events": [], "version": since, "reset": False}
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+            if any(item is RESET for item in events):
+                reset = True
+            events = [item for item in events if item is not CLOSE]  # the server stops: answer now
+    if reset:
+        return {"events": [], "version": current or 0, "reset": True}
+    events = [item for item in events if item["version"] > since]
+    return {"events": [client_event(item) for item in events],
+            "version": max([since] + [item["version"] for item in events]), "reset": False}
+
+
+def sse(item) -> str:
+    lines = f"event: {item['type']}\n"
+    if item.get("version") is not None:
+        lines = f"id: {item['version']}\n" + lines
+    return lines + f"data: {json.dumps(client_event(item))}\n\n"
+
+
+#Server-Sent Events: the events after 'since' (the Last-Event-ID of a reconnecting
+#client, else the current version), then every new one as it arrives. A 'reset'
+#event means events were missed: refetch, then carry on with the stream.
+async def stream(user_id: int, since: Optional[int], current: Optional[int]):
+    with broker.subscribe(user_id) as subscription:
+        yield f"retry: {int(EVENTS_RECONNECT_SECONDS * 1000)}\n\n"
+        sent = since if since is not None else (current or 0)
+        events, reset = broker.since(user_id, sent, current)
+        if reset:
+            yield sse({**RESET, "version": current})
+            sent = current or 0
+        for item in events:
+            yield sse(item)
+            sent = item["version"]
+        replayed = {id(item) for item in events}  # they are on the queue as well
+        while True:
+            try:
+                item = await asyncio.wait_for(subscription.queue.get(), EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"  # keeps proxies from closing an idle connection
+                continue
+            if item is CLOSE:
+                return  # the client reconnects to another worker with Last-Event-ID
+            if item is RESET:
+                yield sse(item)
+            elif item["version"] >= sent and id(item) not in replayed:
+                yield sse(item)
@@ -0,0 +1,102 @@
+#EXPLAIN check for the hot queries in app/lists.py, app/tasks.py and app/users.py.
+#Seeds a throwaway dataset inside a transaction, ANALYZEs it, runs EXPLAIN on each
+#query and fails if any of them falls back to a full table scan. Everything is
+#rolled back at the end, so it is safe to point at a dev database:
+#   pipenv run python -m app.explain --users 200 --lists-per-user 20 --tasks-per-list 20
+
+import argparse
+import re
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import insert, select, text
+
+from app import database, lists, models, positions, schemas, tasks
+
+#"Seq Scan on tasks" (Postgres) / "SCAN tasks" or "SCAN TABLE tasks" (SQLite)
+FULL_SCAN = re.compile(r"(Seq Scan on|\bSCAN( TABLE)?) (users|lists|tasks)\b")
+
+
+def seed(conn, users: int, lists_per_user: int, tasks_per_list: int):
+    conn.execute(insert(models.User), [
+        {"username": f"explain-user-{i}", "password": "x", "disabled": False} for i in range(users)])
+    user_ids = conn.scalars(select(models.User.id).filter(models.User.username.like("explain-user-%"))).all()
+    conn.execute(insert(models.List), [
+        {"name": f"list {i}", "owner_id": user_id} for user_id in user_ids for i in range(lists_per_user)])
+    list_ids = conn.scalars(select(models.List.id).filter(models.List.owner_id.in_(user_ids))).all()
+    keys = positions.keys_after(None, tasks_per_list)
+    for start in range(0, len(list_ids), 1000):
+        conn.execute(insert(models.Task), [
+            {"title": f"task {i}", "completed": i % 2 == 0, "list_id": list_id, "position": keys[i]}
+            for list_id in list_ids[start:start + 1000] for i in range(tasks_per_list)])
+    conn.execute(text("ANALYZE"))
+
+
+def hot_queries(user_id: int, list_id: int, task_id: int, position: str):
+    return {
+        "lists.get_lists": lists.lists_query(user_id),
+        "lists.get_lists (cursor)": lists.lists_query(user_id, after_id=list_id),
+        "lists.get_list": select(models.List).filter(models.List.id == list_id).filter(
+            models.List.owner_id == user_id),
+        "lists.get_list_by_name": select(models.List).filter(models.List.name == "list 1").filter(
+            models.List.owner_id == user_id),
+        "lists.get_lists (tasks_limit)": lists.limited_tasks_query([list_id], 5),
+        "tasks.get_tasks": tasks.tasks_query(list_id),
+        "tasks.get_tasks (cursor)": tasks.tasks_query(list_id, after=(position, task_id)),
+        "tasks.get_user_tasks": tasks.user_tasks_query(user_id),
+        "tasks.get_user_tasks (completed, cursor)": tasks.user_tasks_query(
+            user_id, completed=False, after=(task_id,)),
+        "tasks.get_user_tasks (position)": tasks.user_tasks_query(user_id, sort="position"),
+        "tasks.create_task (last position)": positions.last_position_query(list_id),
+        "tasks.move_task (after task)": tasks.after_task_query(list_id, task_id),
+        "tasks.move_task (next position)": tasks.next_position_query(list_id, task_id, (position, task_id)),
+        "tasks.move_task (to the top)": tasks.next_position_query(list_id, task_id),
+        "tasks.bulk_change_tasks (lock)": tasks.bulk_lock_query(
+            user_id, schemas.TaskBulkChange(action="complete", task_ids=[task_id])),
+        "tasks.get_task": select(models.Task).filter(models.Task.id == task_id),
+        "tasks.delete_task": select(models.Task).filter(
+            models.Task.list_id == list_id, models.Task.id == task_id),
+        "users.login_user": select(models.User).filter(models.User.username == "explain-user-1"),
+        "users.get_user": select(models.User).filter(models.User.id == user_id),
+    }
+
+
+def explain(conn, statement) -> str:
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    return "\n".join(" ".join(str(col) for col in row) for row in conn.execute(text(prefix + sql)))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN check for the hot list, task and user queries")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--lists-per-user", type=int, default=20)
+    parser.add_argument("--tasks-per-list", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with database.engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            seed(conn, args.users, args.lists_per_user, args.tasks_per_list)
+            [user_id, list_id] = conn.execute(select(models.List.owner_id, models.List.id).join(
+                models.User).filter(models.User.username == "explain-user-1").limit(1)).one()
+            [position, task_id] = conn.execute(select(models.Task.position, models.Task.id).filter(
+                models.Task.list_id == list_id).limit(1)).one()
+            for name, statement in hot_queries(user_id, list_id, task_id, position).items():
+                plan = explain(conn, statement)
+                ok = FULL_SCAN.search(plan) is None
+                failures += not ok
+                print(f"{'ok  ' if ok else 'SCAN'} {name}")
+                if not ok:
+                    print("     " + plan.replace("\n", "\n     "))
+        finally:
+            transaction.rollback()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
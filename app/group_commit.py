@@ -0,0 +1,120 @@
+#Group commit for POST /lists/{list_id}/tasks, off unless TASK_GROUP_COMMIT_MS > 0.
+#Under many concurrent writes each request otherwise pays for its own transaction:
+#a pooled connection and a commit (a WAL flush on Postgres) per task. With group
+#commit the calls that arrive within TASK_GROUP_COMMIT_MS of the first one (or the
+#first TASK_GROUP_COMMIT_MAX_SIZE of them) are written by a background flusher as one
+#transaction on one connection: tasks.create_tasks_grouped(). Every caller waits until
+#that transaction has committed, so a 200 still means the task is durable.
+#- A call for a list that does not exist gets its 404 without failing the others.
+#- An error of the transaction itself (the database is down) fails every call of
+#  the group, as it would have failed them one by one.
+#- One group is written at a time per server process; calls arriving meanwhile make
+#  up the next group, so the groups grow with the load.
+#The price is up to TASK_GROUP_COMMIT_MS of extra latency per write when it is quiet.
+
+import asyncio
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+from . import database, metrics, tasks
+
+TASK_GROUP_COMMIT_MS = float(os.environ.get("TASK_GROUP_COMMIT_MS", "0"))
+TASK_GROUP_COMMIT_MAX_SIZE = int(os.environ.get("TASK_GROUP_COMMIT_MAX_SIZE", "100"))
+
+
+class GroupCommit:
+    #flush / flush_async: (session, items) -> one result per item, an exception
+    #instance for an item that failed
+    def __init__(self, flush, flush_async, window: float, max_size: int):
+        self.flush_sync = flush
+        self.flush_async = flush_async
+        self.window = window  # seconds
+        self.max_size = max_size
+        self.pending = []  # (item, future)
+        self.full = None  # set when a group reaches max_size before the window ends
+        self.task = None  # the flusher, while there is anything to write
+        self.groups = 0
+        self.items = 0
+        self.largest = 0
+        self.failed = 0
+
+    #Queue one item and wait for its result, i.e. until its group has committed
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if self.full is None:
+            self.full = asyncio.Event()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        elif len(self.pending) >= self.max_size:
+            self.full.set()
+        return await future
+
+    async def run(self):
+        while self.pending:
+            if len(self.pending) < self.max_size:
+                self.full.clear()
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            group = self.pending[:self.max_size]
+            del self.pending[:self.max_size]
+            await self.write(group)
+
+    async def write(self, group):
+        self.groups += 1
+        self.items += len(group)
+        self.largest = max(self.largest, len(group))
+        try:
+            results = await self.flush([item for item, _ in group])
+        except Exception as exc:
+            self.failed += 1
+            results = [exc] * len(group)
+        #a caller that went away (client disconnect) has a cancelled future; its
+        #row is written all the same
+        for (_, future), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    #Each group gets a session of its own: the callers' sessions end with their requests
+    async def flush(self, items: list):
+        if database.ASYNC_MODE:
+            async with database.AsyncSessionLocal() as db:
+                return await self.flush_async(db, items)
+
+        def flush_in_thread():
+            with database.SessionLocal() as db:
+                return self.flush_sync(db, items)
+        return await run_in_threadpool(flush_in_thread)
+
+    #On shutdown: write what is still queued before the server exits
+    async def stop(self):
+        if self.task is not None:
+            if self.full is not None:
+                self.full.set()
+            await self.task
+
+    def stats(self) -> dict:
+        return {"groups": self.groups, "items": self.items, "largest": self.largest,
+                "failed": self.failed, "pending": len(self.pending)}
+
+
+#None when group commit is off
+task_creates = None
+if TASK_GROUP_COMMIT_MS > 0:
+    task_creates = GroupCommit(tasks.create_tasks_grouped, tasks.create_tasks_grouped_async,
+                               window=TASK_GROUP_COMMIT_MS / 1000, max_size=TASK_GROUP_COMMIT_MAX_SIZE)
+    metrics.collectors.append(lambda: metrics.stats_lines("task_group_commit", task_creates.stats()))
+
+
+#create_task, grouped when group commit is on
+async def create_task(db, list_id: int, task):
+    if task_creates is None:
+        return await database.run_crud(tasks.create_task, tasks.create_task_async, db, list_id=list_id, task=task)
+    return await task_creates.submit((list_id, task))
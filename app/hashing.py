@@ -0,0 +1,143 @@
+#File to handle password hashing off the request path.
+#bcrypt is deliberately slow and CPU bound. Run inline it holds a threadpool worker
+#(sync mode) or the event loop (async mode) for the whole hash, so a burst of logins
+#starves every other route. Hashes and verifications run on a dedicated, size-limited
+#process pool instead. Requests wait on it without holding a thread, and once
+#HASH_QUEUE_SIZE operations are waiting new ones get a fast 503.
+#The pool processes run at a lower OS priority (HASH_WORKER_NICE) so that, on cores
+#shared with the server, a storm of logins takes the CPU that CRUD leaves over rather
+#than slowing every request down with it.
+#A pool whose process died (the OOM killer, a crash in bcrypt) fails every call after
+#that, so it is replaced by a new one and the call tried once more.
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from app import metrics
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_QUEUE_SIZE = int(os.environ.get("HASH_QUEUE_SIZE", "64"))
+HASH_WORKER_NICE = int(os.environ.get("HASH_WORKER_NICE", "19"))
+
+#Storing passwords securely - hash them using bcrypt
+#Hashes made with a different cost than BCRYPT_ROUNDS count as outdated, so they are
+#replaced on the next successful login.
+password_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+#These run inside the pool processes. Each process has its own copy of
+#password_context, built from the same environment.
+def _hash(password: str) -> str:
+    return password_context.hash(password)
+
+def _verify_and_update(password: str, hashed_pass: str) -> Tuple[bool, Optional[str]]:
+    return password_context.verify_and_update(password, hashed_pass)
+
+#Runs first in every pool process
+def _lower_priority(increment: int):
+    if increment and hasattr(os, "nice"):
+        os.nice(increment)
+
+#Loads the bcrypt backend in a new pool process, at the lowest cost (see app/warmup.py)
+def _warm() -> bool:
+    return password_context.verify("warm-up", password_context.hash("warm-up", rounds=4))
+
+
+class HashPool:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self.pending = 0  # submitted and not finished yet (running + queued)
+        self.completed = 0
+        self.failed = 0  # raised, also after a retry on a new executor
+        self.rejected = 0
+        self.restarts = 0
+        #seconds from submit to result or error, queue wait included; a long queue takes
+        #longer than the request buckets go
+        self.latency = metrics.Histogram("hash_pool_latency_seconds", "Time from submitting a hash to its result",
+                                         buckets=metrics.LATENCY_BUCKETS + (30.0, 60.0))
+
+    def start(self):
+        if self._executor is None:
+            #spawn, not fork: the server process has threads and open db connections
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_lower_priority, initargs=(HASH_WORKER_NICE,))
+        return self._executor
+
+    #Start every pool process now instead of on the first logins: one cheap hash per
+    #worker, all submitted at once.
+    async def warm(self):
+        executor = self.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, _warm) for _ in range(self.workers)])
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    #Drop a broken executor; start() makes the next one. The calls that were running on
+    #it all fail at once, and only the first one replaces it.
+    def discard(self, executor):
+        if self._executor is executor:
+            self._executor = None
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn, *args):
+        if self.pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, try again",
+                                headers={"Retry-After": "1"})
+        executor = self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                result = await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                self.discard(executor)
+                result = await loop.run_in_executor(self.start(), fn, *args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+            self.latency.observe(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": max(0, self.pending - self.workers),
+            "in_flight": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+        }
+
+
+pool = HashPool(HASH_POOL_SIZE, HASH_QUEUE_SIZE)
+
+
+async def hash_password(password: str) -> str:
+    return await pool.run(_hash, password)
+
+#Returns (matches, new_hash). new_hash is set when the stored hash used another cost
+#and should be saved in place of the old one.
+async def verify_password(password: str, hashed_pass: str) -> Tuple[bool, Optional[str]]:
+    return await pool.run(_verify_and_update, password, hashed_pass)
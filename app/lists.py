@@ -1,9 +1,14 @@
-from sqlalchemy.orm import Session
+import os
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, noload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 #Session: a high-level abstraction that represents a "workspace" for your interactions with 
 #the database. It provides a way to manage database connections, transactions, and the overall 
 #state of your interactions with the database.
 
-from . import models, schemas
+from . import events, log, models, schemas, sync, versions
 
 #Get lists:
 #This function retrieves a list of items from the db taking session as the object, 
@@ -11,12 +16,12 @@ from . import models, schemas
 def get_lists(db: Session, skip: int = 0, limit: int = 20):
     lists = db.query(models.List).offset(skip).limit(limit).all() #the query part here
     #is what selects all rows from from the list model (which corresponds to a db table).
-    print(lists)
+    log.debug_rows("lists.get_lists", lists, skip=skip, limit=limit)
     return lists
 #Use the provided Session (db) to query the database for a 
 #specified number of lists. The offset and limit functions 
 #are used for pagination, and all() fetches all the results.
-#print lists to console for debugging purposes
+#log a sample of the reads for debugging purposes (see app/log.py)
 #Return the retrieved lists from the function
 
 #Querying: 
@@ -35,20 +40,27 @@ def get_lists(db: Session, skip: int = 0, limit: int = 20):
 #Create list:
 #This function adds a new list to the db.
 def create_list(db: Session, user_id: int, list: schemas.ListCreate):
-    db_list = models.List(**list.dict(), owner_id=user_id) #Creates a new instance
-    #of the 'list' model using data provided in the 'list'
-    #parameter. **list.dict() syntax is used to convert the Pydantic 
+    owner = versions.bump(db, user_id=user_id) #new ETag for the owner's GET /lists,
+    #and the revision of the new list for GET /sync (app/sync.py)
+    row = db.execute(create_list_statement(user_id, list, owner.lists_version)).one() #sends the
+    #INSERT, and RETURNING hands back the values the database made (the new id) in
+    #the same round trip. **list.dict() syntax is used to convert the Pydantic
     #model to a dictionary and then unpack it.
-    db.add(db_list) #adds newly created db_list instance to current db
-    #session. The changes are only made within the session and not reflected
-    #in the actual db at this point.
+    events.add(db, owner, "list.created", row._asdict()) #sent on commit (app/events.py)
     db.commit() #This is where actual db transaction is committed. Changes 
     #made within the session are persisted to underlying db.
-    db.refresh(db_list) #After committing the changes this line is used to 
-    #refresh the db_list instance with any changes that might have been 
-    #applied to it on the db side. 
-    return db_list
-    #Return newly created list from the function.
+    return created_list(row, owner)
+    #Return newly created list from the function. Nothing is read back after the
+    #commit: a new list has no tasks yet, and the owner row came from the bump.
+
+#The INSERT for create_list, with RETURNING for the new list's id and name
+def create_list_statement(user_id: int, list: schemas.ListCreate, revision: int):
+    return insert(models.List).values(**list.dict(), owner_id=user_id, revision=revision).returning(
+        models.List.id, models.List.name)
+
+#The new list with the fields of schemas.List
+def created_list(row, owner):
+    return {"id": row.id, "name": row.name, "tasks": [], "owner": {"id": owner.id, "username": owner.username}}
 
 #More on commit:
 #db.commit() statement triggers the actual commit to the database.
@@ -60,37 +72,60 @@ def create_list(db: Session, user_id: int, list: schemas.ListCreate):
 
 
 
-#Delete list
-#This function deletes a list from the database based on its ID.
-def delete_list(db: Session, user_id: int,list_id: int):
-    list = db.query(models.List).filter(models.List.id == list_id).filter(
-        models.List.owner_id == user_id).first()
-    # list = db.query(models.List).filter(models.List.id == list_id).first()
-    #Query the database to retrieve the list with the specified ID.
-    #Line by line - db.query(models.List) initiates a query on the List model 
-    #(representing a database table) within the current database session.
-    #.filter(models.List.name == name): filter method is used to specify a filter 
-    #criteria for the rows to be retrieved.
-    #models.List.name == name is the filter condition. It checks for rows where the 
-    #value in the name column of the List table is equal to the provided name parameter.
-    #first() : method that fetches only the first result that satisfies the conditions 
-    #specified in the query. 
-    #list: Result of the query is assigned to a variable named list.
-    db.delete(list)
-    db.commit()
-    #Delete retrieved list from the db and commit changes.
-    return list
-    #Return the deleted list from the function.
+#Delete lists
+#One DELETE ... RETURNING removes the lists and hands back their id and name; the
+#database deletes their tasks through ON DELETE CASCADE on tasks.list_id. Nothing
+#is loaded first, so it is one round trip however many tasks the lists hold.
+#All or nothing: when any id is not one of the user's lists, nothing is deleted.
+LIST_BATCH_MAX_SIZE = int(os.environ.get("LIST_BATCH_MAX_SIZE", "500"))
+
+def delete_lists_query(user_id: int, list_ids):
+    list_ids = set(list_ids)
+    if len(list_ids) > LIST_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {LIST_BATCH_MAX_SIZE} lists per batch")
+    where = [models.List.owner_id == user_id, models.List.id.in_(list_ids)]
+    statement = delete(models.List).where(*where).returning(
+        models.List.id, models.List.name).execution_options(synchronize_session=False)
+    return versions.lock_lists_query(*where), statement, list_ids
+
+def check_deleted(list_ids: set, deleted: list):
+    missing = list_ids - {list["id"] for list in deleted}
+    if missing:
+        raise HTTPException(status_code=404, detail="List not found: " + ",".join(map(str, sorted(missing))))
+    return sorted(deleted, key=lambda list: list["id"])
+
+def deleted_events(db, owner, deleted: list):
+    for list in deleted:
+        events.add(db, owner, "list.deleted", list)
+
+def delete_lists(db: Session, user_id: int, list_ids):
+    lock, statement, list_ids = delete_lists_query(user_id, list_ids)
+    try:
+        check_deleted(list_ids, [row._asdict() for row in db.execute(lock)]) #the lists' row
+        #locks come first, then the owner's, and the DELETE (which takes the lists'
+        #tasks with it) last: the lock order of every write (app/versions.py)
+        owner = versions.bump(db, user_id=user_id) #new ETag for the owner's GET /lists
+        deleted = check_deleted(list_ids, [row._asdict() for row in db.execute(statement)])
+        sync.add_tombstones(db, owner, "list", deleted) #for GET /sync; their tasks need none
+        deleted_events(db, owner, deleted)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return deleted
+
+def delete_list(db: Session, user_id: int, list_id: int):
+    return delete_lists(db, user_id=user_id, list_ids=[list_id])[0]
 
 #Get one list
 #This function retrieves a specific list from the database based on its ID.
 def get_list(db: Session, user_id: int, list_id: int):
     # list = db.query(models.List).filter(models.List.id == list_id).first()
-    list = db.query(models.List).filter(models.List.id == list_id).filter(
+    list = db.query(models.List).options(*list_load_options()).filter(models.List.id == list_id).filter(
         models.List.owner_id == user_id).first()
     #Query the database to retrieve the list with the specified ID.
-    print(list)
-    #Print list to console for debugging purposes.
+    log.debug_rows("lists.get_list", list, user_id=user_id, list_id=list_id)
+    #Log (sampled) for debugging purposes.
     return list
     #Return the retrieved list from the function.
 
@@ -98,22 +133,209 @@ def get_list(db: Session, user_id: int, list_id: int):
 #This function retrieves a specific list from the database based on its name.
 def get_list_by_name(db: Session, user_id:int, name: str):
     # list = db.query(models.List).filter(models.List.name == name).first()
-    list = db.query(models.List).filter(models.List.name == name).filter(
+    list = db.query(models.List).options(*list_load_options()).filter(models.List.name == name).filter(
         models.List.owner_id == user_id).first()
     #Query the database to retrieve the list with the specified name.
-    print(list)
+    log.debug_rows("lists.get_list_by_name", list, user_id=user_id)
     return list
   
 
+#Access control, check a list belongs to the user without loading it
+def owned_list_query(user_id: int, list_id: int):
+    return select(models.List.id).filter(models.List.id == list_id).filter(
+        models.List.owner_id == user_id)
+
+def owns_list(db: Session, user_id: int, list_id: int) -> bool:
+    return db.scalar(owned_list_query(user_id, list_id)) is not None
+
+
 #Access control, get user's list
-def get_lists(db: Session, user_id: int, skip: int = 0, limit: int = 20): # add the user_id arg
-    lists = db.query(models.List).filter( # and filter the results accordingly
-        models.List.owner_id == user_id).offset(skip).limit(limit).all()
-    print(lists)
+#Pages are ordered by id. Pass after_id (decoded from a cursor, see app/pagination.py)
+#to page by keyset on (owner_id, id) instead of skipping 'skip' rows.
+def lists_query(user_id: int, skip: int = 0, limit: int = 20, after_id: int = None):
+    query = select(models.List).filter( # and filter the results accordingly
+        models.List.owner_id == user_id)
+    if after_id is not None:
+        query = query.filter(models.List.id > after_id)
+    else:
+        query = query.offset(skip)
+    return query.order_by(models.List.id).limit(limit)
+
+#Eager loading
+#schemas.List serialises 'tasks' and 'owner'. Left lazy, that is one SELECT per list for
+#each of them after the page query (N+1). Instead each query says up front what it
+#needs: tasks in one extra "WHERE list_id IN (...)" query (selectin), the owner in
+#the same query through a join, and relations the response leaves out not at all.
+LIST_INCLUDES = ("tasks", "owner")
+
+def list_load_options(include=LIST_INCLUDES, tasks_limit: int = None):
+    options = [joinedload(models.List.owner) if "owner" in include else noload(models.List.owner)]
+    if "tasks" in include and tasks_limit is None:
+        options.append(selectinload(models.List.tasks))
+    else:
+        #tasks_limit pages are attached by attach_limited_tasks below
+        options.append(noload(models.List.tasks))
+    return options
+
+#The first 'tasks_limit' tasks of each list, for all lists of a page in one query.
+def limited_tasks_query(list_ids, tasks_limit: int):
+    ranked = select(models.Task.id, func.row_number().over(
+        partition_by=models.Task.list_id, order_by=(models.Task.position, models.Task.id)).label("row_number")).filter(
+        models.Task.list_id.in_(list_ids)).subquery()
+    return select(models.Task).join(ranked, models.Task.id == ranked.c.id).filter(
+        ranked.c.row_number <= tasks_limit).order_by(models.Task.list_id, models.Task.position, models.Task.id)
+
+def attach_limited_tasks(lists, tasks):
+    by_list = {list.id: [] for list in lists}
+    for task in tasks:
+        by_list[task.list_id].append(task)
+    for list in lists:
+        #set as if loaded from the db, so it is not treated as a pending change
+        set_committed_value(list, "tasks", by_list[list.id])
+
+def get_lists(db: Session, user_id: int, skip: int = 0, limit: int = 20, after_id: int = None,
+              include=LIST_INCLUDES, tasks_limit: int = None): # add the user_id arg
+    lists = db.scalars(lists_query(user_id, skip=skip, limit=limit, after_id=after_id).options(
+        *list_load_options(include, tasks_limit))).unique().all()
+    if "tasks" in include and tasks_limit is not None and lists:
+        attach_limited_tasks(lists, db.scalars(limited_tasks_query([list.id for list in lists], tasks_limit)).all())
+    log.debug_rows("lists.get_lists", lists, user_id=user_id, skip=skip, limit=limit, after_id=after_id)
     return lists
 
+#Build the GET /lists response for the requested 'include' fields. Fields left out
+#stay unset on the schema, so the route's response_model_exclude_unset drops them.
+def shape_lists(lists, include=LIST_INCLUDES):
+    shaped = []
+    for list in lists:
+        data = {"id": list.id, "name": list.name}
+        if "tasks" in include:
+            data["tasks"] = list.tasks
+        if "owner" in include:
+            data["owner"] = list.owner
+        shaped.append(schemas.ListRead.model_validate(data, from_attributes=True))
+    return shaped
+
+#Fast path (FAST_SERIALIZATION=1)
+#The same page as get_lists + shape_lists, but the queries select plain columns and
+#the response is built as dicts: no ORM objects and no Pydantic validation. The
+#dicts have the fields of schemas.ListRead in the same order, so the JSON encoded
+#from them is byte for byte what the schema would give.
+task_columns = (models.Task.id, models.Task.title, models.Task.completed, models.Task.list_id, models.Task.position)
+
+def list_rows_query(user_id: int, skip: int = 0, limit: int = 20, after_id: int = None, include=LIST_INCLUDES):
+    query = lists_query(user_id, skip=skip, limit=limit, after_id=after_id)
+    if "owner" not in include:
+        return query.with_only_columns(models.List.id, models.List.name)
+    return query.with_only_columns(models.List.id, models.List.name, models.User.id, models.User.username).outerjoin(
+        models.User, models.User.id == models.List.owner_id)
+
+def task_rows_query(list_ids, tasks_limit: int = None):
+    if tasks_limit is not None:
+        return limited_tasks_query(list_ids, tasks_limit).with_only_columns(*task_columns)
+    return select(*task_columns).filter(models.Task.list_id.in_(list_ids)).order_by(
+        models.Task.list_id, models.Task.position, models.Task.id)
+
+def list_dicts(rows, task_rows, include=LIST_INCLUDES):
+    tasks_by_list = {}
+    for task in task_rows:
+        tasks_by_list.setdefault(task.list_id, []).append(task._asdict())
+    shaped = []
+    for row in rows:
+        data = {"id": row[0], "name": row[1]}
+        if "tasks" in include:
+            data["tasks"] = tasks_by_list.get(row[0], [])
+        if "owner" in include:
+            data["owner"] = None if row[2] is None else {"id": row[2], "username": row[3]}
+        shaped.append(data)
+    return shaped
+
+def get_list_dicts(db: Session, user_id: int, skip: int = 0, limit: int = 20, after_id: int = None,
+                   include=LIST_INCLUDES, tasks_limit: int = None):
+    rows = db.execute(list_rows_query(user_id, skip, limit, after_id, include)).all()
+    task_rows = []
+    if "tasks" in include and rows:
+        task_rows = db.execute(task_rows_query([row[0] for row in rows], tasks_limit)).all()
+    return list_dicts(rows, task_rows, include)
+
+#Summary: the same pages as get_lists with each list's task counts, which are
+#kept on the list itself (app/counts.py), so no task rows are read
+def summary_query(user_id: int, skip: int = 0, limit: int = 20, after_id: int = None):
+    return lists_query(user_id, skip=skip, limit=limit, after_id=after_id).with_only_columns(
+        models.List.id, models.List.name, models.List.task_count, models.List.completed_count)
+
+def get_list_summaries(db: Session, user_id: int, skip: int = 0, limit: int = 20, after_id: int = None):
+    return [row._asdict() for row in db.execute(summary_query(user_id, skip, limit, after_id))]
+
 #The above code defines several that interact with a database using SQLAlchemy.
 #Session class is used for managing the database sessions, and models and schemas
 #contain the data models and pydantic schemas used in these database operations.
 
 
+#Async versions
+#Same queries as above for an AsyncSession (DATABASE_ASYNC=1). An AsyncSession
+#cannot lazy load at all, so these always use the eager loading options above.
+async def get_lists_async(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 20, after_id: int = None,
+                          include=LIST_INCLUDES, tasks_limit: int = None):
+    result = await db.scalars(lists_query(user_id, skip=skip, limit=limit, after_id=after_id).options(
+        *list_load_options(include, tasks_limit)))
+    lists = result.unique().all()
+    if "tasks" in include and tasks_limit is not None and lists:
+        tasks = await db.scalars(limited_tasks_query([list.id for list in lists], tasks_limit))
+        attach_limited_tasks(lists, tasks.all())
+    return lists
+
+
+async def owns_list_async(db: AsyncSession, user_id: int, list_id: int) -> bool:
+    return await db.scalar(owned_list_query(user_id, list_id)) is not None
+
+
+async def create_list_async(db: AsyncSession, user_id: int, list: schemas.ListCreate):
+    owner = await versions.bump_async(db, user_id=user_id)
+    row = (await db.execute(create_list_statement(user_id, list, owner.lists_version))).one()
+    events.add(db, owner, "list.created", row._asdict())
+    await db.commit()
+    return created_list(row, owner)
+
+
+async def delete_lists_async(db: AsyncSession, user_id: int, list_ids):
+    lock, statement, list_ids = delete_lists_query(user_id, list_ids)
+    try:
+        check_deleted(list_ids, [row._asdict() for row in await db.execute(lock)])
+        owner = await versions.bump_async(db, user_id=user_id)
+        deleted = check_deleted(list_ids, [row._asdict() for row in await db.execute(statement)])
+        await sync.add_tombstones_async(db, owner, "list", deleted)
+        deleted_events(db, owner, deleted)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return deleted
+
+
+async def delete_list_async(db: AsyncSession, user_id: int, list_id: int):
+    return (await delete_lists_async(db, user_id=user_id, list_ids=[list_id]))[0]
+
+
+async def get_list_async(db: AsyncSession, user_id: int, list_id: int):
+    result = await db.scalars(select(models.List).options(*list_load_options()).filter(
+        models.List.id == list_id).filter(models.List.owner_id == user_id))
+    return result.first()
+
+
+async def get_list_by_name_async(db: AsyncSession, user_id: int, name: str):
+    result = await db.scalars(select(models.List).options(*list_load_options()).filter(
+        models.List.name == name).filter(models.List.owner_id == user_id))
+    return result.first()
+
+
+async def get_list_dicts_async(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 20, after_id: int = None,
+                               include=LIST_INCLUDES, tasks_limit: int = None):
+    rows = (await db.execute(list_rows_query(user_id, skip, limit, after_id, include))).all()
+    task_rows = []
+    if "tasks" in include and rows:
+        task_rows = (await db.execute(task_rows_query([row[0] for row in rows], tasks_limit))).all()
+    return list_dicts(rows, task_rows, include)
+
+
+async def get_list_summaries_async(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 20, after_id: int = None):
+    return [row._asdict() for row in await db.execute(summary_query(user_id, skip, limit, after_id))]
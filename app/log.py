@@ -0,0 +1,29 @@
+#Sampled structured debug logging for the CRUD read paths (replaces the old print()s).
+#Off by default: with APP_LOG_LEVEL above DEBUG, debug_rows returns after a single
+#level check and builds nothing. When enabled, only LOG_SAMPLE_RATE of the calls
+#(0.0-1.0) are written, each as one JSON line.
+
+import json
+import logging
+import os
+import random
+
+logger = logging.getLogger("app")
+logger.setLevel(os.environ.get("APP_LOG_LEVEL", "WARNING").upper())
+
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+if logger.isEnabledFor(logging.DEBUG) and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+
+
+def debug_rows(event: str, rows, **fields):
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= LOG_SAMPLE_RATE:
+        return
+    if rows is None:
+        count = 0
+    elif isinstance(rows, list):
+        count = len(rows)
+    else:
+        count = 1
+    logger.debug(json.dumps({"event": event, "rows": count, **fields}, default=str))
@@ -0,0 +1,164 @@
+#In-process metrics served as Prometheus text at GET /metrics.
+#- MetricsMiddleware times every request by route template ("/lists/{list_id}/tasks").
+#- SQLAlchemy cursor events count statements and database time per request. A
+#  contextvar holds the running request's totals, so work done in the threadpool
+#  (sync mode) or inside the async driver still counts towards the right request.
+#- TimedQueuePool / TimedAsyncQueuePool time how long a connection checkout waits.
+
+import time
+from contextvars import ContextVar
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for label_values, series in items:
+            labels = ",".join(f'{key}="{value}"' for key, value in zip(self.labels, label_values))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {series[-2]}')
+            braces = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_count{braces} {series[-2]}")
+            lines.append(f"{self.name}_sum{braces} {series[-1]}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency by route",
+                            labels=("method", "route", "status"))
+REQUEST_STATEMENTS = Histogram("db_statements_per_request", "SQL statements run per request",
+                               buckets=COUNT_BUCKETS, labels=("method", "route"))
+REQUEST_DB_TIME = Histogram("db_time_per_request_seconds", "Time spent in SQL per request",
+                            labels=("method", "route"))
+POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time to check a connection out of the pool")
+
+#Extra sections for /metrics, each a function returning lines of Prometheus text.
+#Modules that keep their own counters (auth caches, hash pool) register one here.
+collectors = []
+
+
+#Flat {"name": value} stats as "prefix_name value" lines, or nested
+#{"label value": {"name": value}} stats with the outer key as 'label'.
+def stats_lines(prefix: str, stats: dict, label: str = None):
+    if label is None:
+        return [f"{prefix}_{key} {value}" for key, value in stats.items()]
+    return [f'{prefix}_{key}{{{label}="{label_value}"}} {value}'
+            for label_value, values in stats.items() for key, value in values.items()]
+
+
+def render() -> str:
+    lines = []
+    for histogram in (REQUEST_LATENCY, REQUEST_STATEMENTS, REQUEST_DB_TIME, POOL_CHECKOUT_WAIT):
+        lines += histogram.render()
+    for collector in collectors:
+        lines += collector()
+    return "\n".join(lines) + "\n"
+
+
+#Per request SQL totals
+class RequestStats:
+    __slots__ = ("statements", "db_time")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+
+
+request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+
+#The start time is kept on the statement's execution context, which goes away with
+#it: a statement that fails gets no after_cursor_execute and leaves nothing behind.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+#Connection pools that time checkouts (the wait for a free connection included)
+class _TimedCheckout:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+            #the router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.observe(elapsed, scope["method"], route, status[0])
+            REQUEST_STATEMENTS.observe(stats.statements, scope["method"], route)
+            REQUEST_DB_TIME.observe(stats.db_time, scope["method"], route)
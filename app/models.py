@@ -1,5 +1,5 @@
 from .database import Base
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from sqlalchemy import DDL, Boolean, Column, ForeignKey, Index, Integer, String, event
 from sqlalchemy.orm import relationship
 
 #Allowing clients to authenticate with a username + password by storing 
@@ -8,35 +8,116 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    username = Column(String, nullable=False)
+    username = Column(String, nullable=False, unique=True, index=True) #login looks users up by name
     password = Column(String, nullable=False)
 
     disabled = Column(Boolean, default=False)
+    #bumped by every change to the user's lists or their tasks (see app/versions.py)
+    lists_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     lists = relationship("List", back_populates="owner") 
           
 
 class List(Base):
     __tablename__ = "lists"
+    #GET /lists filters on owner_id and pages by id; GET /sync reads the owner's
+    #lists changed after a revision
+    __table_args__ = (Index("ix_lists_owner_id_id", "owner_id", "id"),
+                      Index("ix_lists_owner_id_revision", "owner_id", "revision"))
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     name = Column(String, nullable=False)
 
     owner_id = Column(Integer, ForeignKey("users.id"), default=1)
+    #bumped by every change to this list's tasks (see app/versions.py)
+    tasks_version = Column(Integer, nullable=False, default=0, server_default="0")
+    #number of tasks / completed tasks, kept up to date by every task write (see app/counts.py)
+    task_count = Column(Integer, nullable=False, default=0, server_default="0")
+    completed_count = Column(Integer, nullable=False, default=0, server_default="0")
+    #the owner's lists_version of the write that last changed the list (see app/sync.py)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
 
-    tasks = relationship("Task", back_populates="list")
+    #deleting a list deletes its tasks in the database (ON DELETE CASCADE below), so
+    #the ORM does not load them first (passive_deletes)
+    tasks = relationship("Task", back_populates="list", order_by="(Task.position, Task.id)", passive_deletes=True)
     owner = relationship("User", back_populates="lists")
 
 
 
 class Task(Base):
     __tablename__ = "tasks"
+    #GET /lists/{list_id}/tasks filters on list_id and pages in list order, by
+    #(position, id); GET /sync reads the tasks of each of the owner's lists changed
+    #after a revision. GET /tasks reads each of the owner's lists, optionally only its
+    #open or completed tasks; on Postgres that index also carries the title, so those
+    #reads never visit the table.
+    __table_args__ = (Index("ix_tasks_list_id_id", "list_id", "id"),
+                      Index("ix_tasks_list_id_revision", "list_id", "revision"),
+                      Index("ix_tasks_list_id_completed_id", "list_id", "completed", "id",
+                            postgresql_include=["title", "position"]),
+                      Index("ix_tasks_list_id_position", "list_id", "position", "id"))
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     title = Column(String, nullable=False)
     completed = Column(Boolean, default=False)
 
-    list_id = Column(Integer, ForeignKey("lists.id"))
+    list_id = Column(Integer, ForeignKey("lists.id", ondelete="CASCADE"))
+    #as List.revision
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+    #order within the list (see app/positions.py). The "C" collation makes Postgres
+    #compare the keys byte by byte, as Python and SQLite do.
+    position = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=False,
+                      server_default="a0")
 
     list = relationship("List", back_populates="tasks")
 
+
+#A deleted list or task, so GET /sync can tell clients to drop it. Tasks deleted with
+#their list get no tombstone of their own: the list's tombstone covers them.
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    __table_args__ = (Index("ix_tombstones_owner_id_revision", "owner_id", "revision"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    type = Column(String, nullable=False)  # "list" or "task"
+    object_id = Column(Integer, nullable=False)
+    list_id = Column(Integer)  # the list of a deleted task
+    revision = Column(Integer, nullable=False)
+
+
+#Full-text search over task titles and list names (GET /search, app/search.py).
+#The search structures are dialect specific, so they are not columns of the models
+#above; these DDL hooks add them whenever create_all() makes the tables (the alembic
+#migration adds them to existing databases).
+#Postgres: a generated tsvector column with a GIN index on each table.
+#SQLite: an FTS5 index per table, kept in sync by triggers.
+SEARCH_CONFIG = "english"  # Postgres text search configuration
+
+def search_ddl(table: str, column: str):
+    postgres = [
+        f"ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+        f"(to_tsvector('{SEARCH_CONFIG}', coalesce({column}, ''))) STORED",
+        f"CREATE INDEX ix_{table}_search_vector ON {table} USING gin (search_vector)",
+    ]
+    sqlite = [
+        f"CREATE VIRTUAL TABLE search_{table} USING fts5({column}, content='{table}', content_rowid='id', "
+        f"tokenize='porter unicode61')",
+        f"CREATE TRIGGER search_{table}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO search_{table}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER search_{table}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO search_{table}(search_{table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER search_{table}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+        f"INSERT INTO search_{table}(search_{table}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO search_{table}(rowid, {column}) VALUES (new.id, new.{column}); END",
+    ]
+    return postgres, sqlite
+
+for model, column in ((Task, "title"), (List, "name")):
+    postgres, sqlite = search_ddl(model.__tablename__, column)
+    for statement in postgres:
+        event.listen(model.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+    for statement in sqlite:
+        event.listen(model.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    event.listen(model.__table__, "before_drop", DDL(
+        f"DROP TABLE IF EXISTS search_{model.__tablename__}").execute_if(dialect="sqlite"))
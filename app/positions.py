@@ -0,0 +1,266 @@
+#Task order within a list (tasks.position).
+#A position is a string key and tasks are ordered by (position, id): moving a task
+#only gives it a new key between its new neighbours' keys, so a move is a single-row
+#UPDATE however long the list is. Keys are the "fractional indexing" kind: an integer
+#part whose first character gives its length ("a0", "a1", ... "az", "b00", ...), so
+#appending grows keys only logarithmically, then an optional fraction in base 62
+#("a0V" sits between "a0" and "a1"). Keys compare as plain bytes, which is why the
+#column has the "C" collation on Postgres.
+#Moving tasks into the same gap again and again makes keys longer. A move whose key
+#is longer than POSITION_MAX_LENGTH queues its list for a rebalance, which gives
+#every task of the list a short key again in the background (same order).
+#Equal keys (rows from before this column, which all start at FIRST_KEY) are fine for
+#ordering, as the id breaks the tie; a move between two equal keys renumbers the
+#list first, in the move's transaction.
+
+import asyncio
+import logging
+import os
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import database, events, metrics, models, versions
+
+logger = logging.getLogger("app")
+
+POSITION_MAX_LENGTH = int(os.environ.get("POSITION_MAX_LENGTH", "24"))
+#seconds between a long key and the rebalance, so several moves share one
+POSITION_REBALANCE_DELAY = float(os.environ.get("POSITION_REBALANCE_DELAY", "5"))
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+FIRST_KEY = "a0"
+SMALLEST_INTEGER = "A" + "0" * 26
+
+
+#Key arithmetic
+
+#Length of the integer part that starts with 'head': "a" 2 ... "z" 27 for the
+#non-negative integers, "Z" 2 ... "A" 27 for the negative ones
+def integer_length(head: str) -> int:
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    raise ValueError(f"Invalid position head: {head!r}")
+
+def split_key(key: str):
+    length = integer_length(key[0])
+    if length > len(key) or key == SMALLEST_INTEGER or key[length:].endswith("0"):
+        raise ValueError(f"Invalid position: {key!r}")
+    return key[:length], key[length:]
+
+#The next / previous integer part, or None past the largest / smallest one
+def increment_integer(integer: str):
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        digit = DIGITS.index(digits[i]) + 1
+        if digit < len(DIGITS):
+            digits[i] = DIGITS[digit]
+            return head + "".join(digits)
+        digits[i] = DIGITS[0]
+    if head == "Z":
+        return "a" + DIGITS[0]
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    if head > "a":
+        digits.append(DIGITS[0])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+def decrement_integer(integer: str):
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        digit = DIGITS.index(digits[i]) - 1
+        if digit >= 0:
+            digits[i] = DIGITS[digit]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+    if head == "a":
+        return "Z" + DIGITS[-1]
+    if head == "A":
+        return None
+    head = chr(ord(head) - 1)
+    if head < "Z":
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+#A fraction strictly between fractions a and b (b None: up to 1), without a trailing "0"
+def midpoint(a: str, b):
+    if b is not None:
+        common = 0
+        while (a[common] if common < len(a) else DIGITS[0]) == b[common]:
+            common += 1
+        if common:
+            return b[:common] + midpoint(a[common:], b[common:])
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else len(DIGITS)
+    if digit_b - digit_a > 1:
+        return DIGITS[round((digit_a + digit_b) / 2)]
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + midpoint(a[1:], None)
+
+#A key between a and b (None: the start / end of the list). a must sort before b.
+def key_between(a, b) -> str:
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f"{a!r} is not before {b!r}")
+    if a is None and b is None:
+        return FIRST_KEY
+    if a is None:
+        integer, fraction = split_key(b)
+        if integer == SMALLEST_INTEGER:
+            return integer + midpoint("", fraction)
+        if fraction:
+            return integer
+        before = decrement_integer(integer)
+        if before is None:
+            raise ValueError("No position left before " + b)
+        return before
+    integer, fraction = split_key(a)
+    if b is None:
+        after = increment_integer(integer)
+        return integer + midpoint(fraction, None) if after is None else after
+    integer_b, fraction_b = split_key(b)
+    if integer == integer_b:
+        return integer + midpoint(fraction, fraction_b)
+    after = increment_integer(integer)
+    if after is None:
+        raise ValueError("No position left after " + a)
+    return after if after < b else integer + midpoint(fraction, None)
+
+#n keys in order after 'last' (None: for an empty list), for tasks appended together
+def keys_after(last, n: int) -> list:
+    keys = []
+    for _ in range(n):
+        last = key_between(last, None)
+        keys.append(last)
+    return keys
+
+
+#Reading neighbours
+
+#The last key of a list, for appending (None when the list is empty)
+def last_position_query(list_id: int):
+    return select(models.Task.position).filter(models.Task.list_id == list_id).order_by(
+        models.Task.position.desc(), models.Task.id.desc()).limit(1)
+
+
+#Rebalance
+#Renumber runs inside a write's transaction: every task of the list gets a fresh key
+#in its current order (and the write's revision, so GET /sync hands out the new keys).
+tasks_table = models.Task.__table__
+
+renumber_statement = update(tasks_table).where(tasks_table.c.id == bindparam("b_id")).values(
+    position=bindparam("b_position"), revision=bindparam("b_revision"))
+
+def task_ids_query(list_id: int):
+    return select(models.Task.id).filter(models.Task.list_id == list_id).order_by(
+        models.Task.position, models.Task.id)
+
+def renumber_params(task_ids: list, revision: int):
+    return [{"b_id": task_id, "b_position": position, "b_revision": revision}
+            for task_id, position in zip(task_ids, keys_after(None, len(task_ids)))]
+
+def renumber(db: Session, list_id: int, revision: int):
+    params = renumber_params(db.scalars(task_ids_query(list_id)).all(), revision)
+    if params:
+        db.execute(renumber_statement, params)
+
+async def renumber_async(db: AsyncSession, list_id: int, revision: int):
+    params = renumber_params((await db.scalars(task_ids_query(list_id))).all(), revision)
+    if params:
+        await db.execute(renumber_statement, params)
+
+#A rebalance on its own: bumping the list first takes its row lock, so a move or
+#append into the list waits for the new keys instead of mixing old and new ones.
+#Clients are told with one tasks.reordered event; the order itself is unchanged.
+def rebalance(db: Session, list_id: int):
+    owner = versions.bump(db, list_ids=[list_id])
+    if owner is None:
+        return db.rollback()  # the list is gone
+    renumber(db, list_id, owner.lists_version)
+    events.add(db, owner, "tasks.reordered", {"list_id": list_id})
+    db.commit()
+
+async def rebalance_async(db: AsyncSession, list_id: int):
+    owner = await versions.bump_async(db, list_ids=[list_id])
+    if owner is None:
+        return await db.rollback()
+    await renumber_async(db, list_id, owner.lists_version)
+    events.add(db, owner, "tasks.reordered", {"list_id": list_id})
+    await db.commit()
+
+
+#Lists waiting for a rebalance, per server process. A queued list is lost if the
+#process stops first; the next long key queues it again.
+class Rebalancer:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.pending = set()
+        self.wakeup = None
+        self.task = None
+        self.rebalanced = 0
+        self.failed = 0
+
+    def request(self, list_id: int):
+        self.pending.add(list_id)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        if self.pending:
+            self.wakeup.set()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.delay)
+            self.wakeup.clear()
+            while self.pending:
+                await self.rebalance(self.pending.pop())
+
+    async def rebalance(self, list_id: int):
+        try:
+            if database.ASYNC_MODE:
+                async with database.AsyncSessionLocal() as db:
+                    await rebalance_async(db, list_id)
+            else:
+                def rebalance_in_thread():
+                    with database.SessionLocal() as db:
+                        rebalance(db, list_id)
+                await run_in_threadpool(rebalance_in_thread)
+            self.rebalanced += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("positions: rebalancing list %s failed", list_id)
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending), "rebalanced": self.rebalanced, "failed": self.failed}
+
+
+rebalancer = Rebalancer(POSITION_REBALANCE_DELAY)
+
+metrics.collectors.append(lambda: metrics.stats_lines("position_rebalance", rebalancer.stats()))
+
+#Queue the list when a key came out long
+def check_length(list_id: int, position: str):
+    if len(position) > POSITION_MAX_LENGTH:
+        rebalancer.request(list_id)
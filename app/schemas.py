@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional
 
 #Users
 class UserBase(BaseModel):
@@ -44,10 +44,30 @@ class TaskCreate(BaseModel):
 
 class Task(TaskBase):
     list_id: int
+    position: str  # the task's order key in its list, see app/positions.py
 
     class Config:
         orm_mode = True
 
+#Move a task of the list: it goes right after after_id, or to the top when after_id
+#is null
+class TaskMove(BaseModel):
+    task_id: int
+    after_id: Optional[int] = None
+
+#Bulk change of the current user's tasks. Pick tasks by id and/or by list, optionally
+#narrowed to completed / open ones, e.g. "clear completed" on list 3:
+#{"action": "delete", "list_id": 3, "completed": true}
+class TaskBulkChange(BaseModel):
+    action: Literal["complete", "uncomplete", "delete"]
+    task_ids: Optional[list[int]] = None
+    list_id: Optional[int] = None
+    completed: Optional[bool] = None
+
+
+class TaskBulkResult(BaseModel):
+    affected: int
+
 #Lists
 class ListBase(BaseModel):
     id: int
@@ -63,4 +83,92 @@ class List(ListBase):
     owner: User               # add the owner
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+#GET /lists/summary: a list with its task counts, without the tasks
+class ListSummary(ListBase):
+    task_count: int
+    completed_count: int
+
+
+#GET /lists: 'tasks' and 'owner' are only present when asked for with ?include=
+class ListRead(ListBase):
+    tasks: Optional[list[Task]] = None
+    owner: Optional[User] = None
+
+    class Config:
+        from_attributes = True
+
+
+#POST /import: the NDJSON lines GET /export writes. 'id' / 'list_id' are the ids of the
+#exported data; they only link tasks to lists and the imported rows get new ids.
+class ImportList(BaseModel):
+    type: Literal["list"]
+    id: Optional[int] = None
+    name: str
+
+
+class ImportTask(BaseModel):
+    type: Literal["task"]
+    title: str
+    completed: bool = False
+    list_id: int
+
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportResult(BaseModel):
+    lists: int
+    tasks: int
+    error_count: int
+    errors: list[ImportLineError]  # the first IMPORT_MAX_ERRORS of them
+
+
+#GET /search: a matching task (text = title) or list (text = name, completed = None)
+class SearchResult(BaseModel):
+    type: Literal["task", "list"]
+    id: int
+    list_id: int
+    text: str
+    completed: Optional[bool] = None
+
+
+#GET /events (app/events.py). data holds the list / task, or for bulk changes the
+#list_id and the ids of its changed tasks.
+class Event(BaseModel):
+    type: str
+    version: int
+    data: dict
+
+
+#Long-poll answer: pass 'version' as ?since= on the next call. reset = events were
+#missed, refetch the lists before carrying on.
+class EventsPoll(BaseModel):
+    events: list[Event]
+    version: int
+    reset: bool
+
+
+#GET /sync (app/sync.py): a list or task changed after ?since= (name / title,
+#completed and position set), or deleted (deleted = True, only the ids). list_id of a list is its id.
+class SyncChange(BaseModel):
+    type: Literal["list", "task"]
+    id: int
+    revision: int
+    deleted: bool
+    list_id: Optional[int] = None
+    name: Optional[str] = None
+    title: Optional[str] = None
+    completed: Optional[bool] = None
+    position: Optional[str] = None
+
+
+#Follow 'cursor' (?cursor=) while it is set; then keep 'revision' for the next ?since=
+class SyncPage(BaseModel):
+    changes: list[SyncChange]
+    revision: int
+    cursor: Optional[str] = None
@@ -0,0 +1,108 @@
+#Full-text search over the current user's task titles and list names (GET /search).
+#Matches come from the search indexes set up in app/models.py: the GIN-indexed
+#search_vector columns on Postgres, the FTS5 tables on SQLite. Tasks and lists are
+#ranked together (ts_rank / bm25), best first, and paged with skip / limit.
+#On Postgres each search runs under SEARCH_TIMEOUT_MS; a search that takes longer is
+#cancelled by the server and answered with 503 rather than holding a connection.
+
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import database, log, models
+
+SEARCH_TIMEOUT_MS = int(os.environ.get("SEARCH_TIMEOUT_MS", "2000"))
+
+POSTGRES_SEARCH = text(f"""
+WITH search AS (SELECT websearch_to_tsquery('{models.SEARCH_CONFIG}', :q) AS query)
+SELECT type, id, list_id, text, completed FROM (
+    SELECT 'task' AS type, tasks.id, tasks.list_id, tasks.title AS text, tasks.completed,
+           ts_rank(tasks.search_vector, search.query) AS rank
+    FROM search, tasks JOIN lists ON lists.id = tasks.list_id
+    WHERE lists.owner_id = :user_id AND tasks.search_vector @@ search.query
+    UNION ALL
+    SELECT 'list', lists.id, lists.id, lists.name, NULL,
+           ts_rank(lists.search_vector, search.query)
+    FROM search, lists
+    WHERE lists.owner_id = :user_id AND lists.search_vector @@ search.query
+) results
+ORDER BY rank DESC, type, id
+LIMIT :limit OFFSET :skip
+""")
+
+#FTS5's hidden 'rank' column is the bm25 score, lower is better
+SQLITE_SEARCH = text("""
+SELECT type, id, list_id, text, completed FROM (
+    SELECT 'task' AS type, tasks.id AS id, tasks.list_id AS list_id, tasks.title AS text,
+           tasks.completed AS completed, search_tasks.rank AS rank
+    FROM search_tasks JOIN tasks ON tasks.id = search_tasks.rowid JOIN lists ON lists.id = tasks.list_id
+    WHERE search_tasks MATCH :q AND lists.owner_id = :user_id
+    UNION ALL
+    SELECT 'list', lists.id, lists.id, lists.name, NULL, search_lists.rank
+    FROM search_lists JOIN lists ON lists.id = search_lists.rowid
+    WHERE search_lists MATCH :q AND lists.owner_id = :user_id
+)
+ORDER BY rank, type, id
+LIMIT :limit OFFSET :skip
+""")
+
+#SQL for the primary's dialect (replicas run the same database)
+DIALECT = database.engine.dialect.name
+
+
+#Statements to run and their parameters, or None when q has nothing to search for.
+#On SQLite every word of q is quoted, so FTS5 query syntax typed by a user cannot
+#cause an error, and prefix matched ("gro" finds "groceries").
+def search_statements(user_id: int, q: str, skip: int, limit: int):
+    params = {"user_id": user_id, "skip": skip, "limit": limit}
+    if DIALECT == "postgresql":
+        if not q.strip():
+            return None
+        timeout = text(f"SET LOCAL statement_timeout = {int(SEARCH_TIMEOUT_MS)}")
+        return [timeout], POSTGRES_SEARCH, {**params, "q": q}
+    if DIALECT == "sqlite":
+        words = ['"' + word.replace('"', '""') + '"*' for word in q.split()]
+        if not words:
+            return None
+        return [], SQLITE_SEARCH, {**params, "q": " ".join(words)}
+    raise HTTPException(status_code=501, detail="Search is not available on this database")
+
+
+def timed_out(exc: DBAPIError) -> bool:
+    return "statement timeout" in str(exc.orig)
+
+
+def search(db: Session, user_id: int, q: str, skip: int = 0, limit: int = 20):
+    statements = search_statements(user_id, q, skip, limit)
+    if statements is None:
+        return []
+    setup, query, params = statements
+    try:
+        for statement in setup:
+            db.execute(statement)
+        results = [row._asdict() for row in db.execute(query, params)]
+    except DBAPIError as exc:
+        if timed_out(exc):
+            raise HTTPException(status_code=503, detail="Search took too long, try a more specific query")
+        raise
+    log.debug_rows("search.search", results, user_id=user_id, skip=skip, limit=limit)
+    return results
+
+
+async def search_async(db: AsyncSession, user_id: int, q: str, skip: int = 0, limit: int = 20):
+    statements = search_statements(user_id, q, skip, limit)
+    if statements is None:
+        return []
+    setup, query, params = statements
+    try:
+        for statement in setup:
+            await db.execute(statement)
+        return [row._asdict() for row in await db.execute(query, params)]
+    except DBAPIError as exc:
+        if timed_out(exc):
+            raise HTTPException(status_code=503, detail="Search took too long, try a more specific query")
+        raise
@@ -0,0 +1,225 @@
+#Production entry point: runs the app in several uvicorn worker processes that share
+#one listening socket.
+#
+#   pipenv run python -m app.serve                   # one worker per CPU core
+#   pipenv run python -m app.serve --workers 4 --port 8000
+#   pipenv run python -m app.serve --check-startup   # time a cold start, fail over budget
+#
+#Settings come from the environment and .env like everywhere else; DATABASE_URL and
+#JWT_SECRET_KEY must be set (checked before any worker starts). Each worker runs the
+#lifespan hook in main.py, which warms the connection pool, the bcrypt process pool
+#and the JWT backend before the worker takes connections.
+#
+#Signals to this process:
+#- SIGHUP: graceful reload. Workers are replaced one at a time: a new worker is
+#  started (importing the current code), and once it is serving the old one is sent
+#  SIGTERM and finishes its open requests. The socket stays open throughout.
+#- SIGINT / SIGTERM: graceful stop. Every worker finishes its open requests, for at
+#  most --graceful-timeout seconds.
+#A worker that dies is replaced.
+#Workers share the database, but not their in-process caches. Cached responses are
+#keyed by version counters kept in the database, so they are never stale. A disabled
+#or deleted user can still be served by another worker for up to AUTH_USER_CACHE_TTL
+#seconds (app/deps.py).
+
+import argparse
+import functools
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import uvicorn
+from dotenv import load_dotenv
+from uvicorn._subprocess import get_subprocess, spawn
+
+from app import env
+
+logger = logging.getLogger("uvicorn.error")
+
+#longest wait for a new worker to start serving during a reload
+WORKER_START_TIMEOUT = float(os.environ.get("WORKER_START_TIMEOUT", "60"))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the to-do API with several worker processes")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+                        help="worker processes (default: WEB_CONCURRENCY or the number of CPU cores)")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "info"))
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.environ.get("GRACEFUL_TIMEOUT", "30")),
+                        help="seconds a stopping worker gets to finish its open requests")
+    parser.add_argument("--check-startup", action="store_true",
+                        help="import main and warm up in a fresh process, print the times and exit; "
+                             "exit code 1 when over IMPORT_BUDGET_SECONDS / STARTUP_BUDGET_SECONDS")
+    return parser.parse_args(argv)
+
+
+#Runs in each worker process. 'ready' is set once the worker is serving (lifespan
+#startup done and the socket handed to the event loop).
+class Worker(uvicorn.Server):
+    def __init__(self, config, ready=None):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.started and self.ready is not None:
+            self.ready.set()
+
+    #Open event streams (GET /events) never finish on their own, so uvicorn would wait
+    #for them until --graceful-timeout. End them as soon as the worker is told to stop.
+    def handle_exit(self, sig, frame):
+        super().handle_exit(sig, frame)
+        from app import events
+        if events.broker.loop is not None:
+            events.broker.loop.call_soon_threadsafe(events.broker.close_streams)
+
+def run_worker(config, ready, sockets):
+    #SIGHUP is for the supervisor; a terminal hangup must not kill the workers one by one
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    Worker(config, ready).run(sockets=sockets)
+
+
+class Supervisor:
+    def __init__(self, config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.sockets = [config.bind_socket()]
+        self.processes = []  # (process, ready event)
+        self.should_exit = False
+        self.should_reload = False
+
+    def spawn(self):
+        ready = spawn.Event()
+        process = get_subprocess(self.config, target=functools.partial(run_worker, self.config, ready),
+                                 sockets=self.sockets)
+        process.start()
+        return process, ready
+
+    def stop(self, process):
+        if process.is_alive():
+            process.terminate()  # SIGTERM: uvicorn's graceful shutdown
+        process.join(self.config.timeout_graceful_shutdown + 5)
+        if process.is_alive():
+            logger.warning("Worker %s did not stop in time, killing it", process.pid)
+            process.kill()
+            process.join()
+
+    def handle_exit(self, sig, frame):
+        self.should_exit = True
+
+    def handle_reload(self, sig, frame):
+        self.should_reload = True
+
+    def wait_ready(self, process, ready) -> bool:
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while time.monotonic() < deadline and not self.should_exit:
+            if ready.wait(0.5):
+                return True
+            if not process.is_alive():
+                return False
+        return False
+
+    def reload(self):
+        logger.info("Reloading %s workers", len(self.processes))
+        for i, (old, _) in enumerate(list(self.processes)):
+            process, ready = self.spawn()
+            if not self.wait_ready(process, ready):
+                #keep the old worker serving rather than leave the slot empty
+                logger.error("New worker %s did not start, reload stopped", process.pid)
+                self.stop(process)
+                return
+            self.processes[i] = (process, ready)
+            self.stop(old)
+        logger.info("Reload done")
+
+    def replace_dead(self):
+        for i, (process, _) in enumerate(self.processes):
+            if not process.is_alive():
+                logger.warning("Worker %s exited with code %s, starting a new one", process.pid, process.exitcode)
+                self.processes[i] = self.spawn()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.handle_exit)
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.handle_reload)
+        logger.info("Starting %s workers on %s:%s (parent pid %s)", self.workers, self.config.host,
+                    self.config.port, os.getpid())
+        self.processes = [self.spawn() for _ in range(self.workers)]
+        while not self.should_exit:
+            if self.should_reload:
+                self.should_reload = False
+                self.reload()
+            else:
+                self.replace_dead()
+            time.sleep(0.5)
+        logger.info("Stopping %s workers", len(self.processes))
+        for process, _ in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.processes:
+            self.stop(process)
+        for sock in self.sockets:
+            sock.close()
+
+
+#Cold start check, run in a fresh interpreter so nothing is imported already
+PROBE = """
+import asyncio, time
+started = time.perf_counter()
+import main
+from app import warmup
+
+async def start_and_stop():
+    async with main.lifespan(main.app):
+        pass
+
+asyncio.run(start_and_stop())
+timings = main.app.state.warm_up
+print(f"import main (module body)  {timings['import']:.3f}s")
+print(f"import main (interpreter)  {time.perf_counter() - started - timings['warm_up']:.3f}s")
+for name in warmup.STEPS:
+    print(f"warm-up {name:18} {timings[name]:.3f}s")
+print(f"total                      {timings['total']:.3f}s")
+problems = warmup.over_budget(timings)
+for problem in problems:
+    print(problem)
+raise SystemExit(1 if problems else 0)
+"""
+
+def check_startup() -> int:
+    return subprocess.run([sys.executable, "-c", PROBE]).returncode
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    args = parse_args(argv)
+    missing = env.missing()
+    if missing:
+        print(f"Missing settings: {', '.join(missing)}. Set them in the environment or in a .env file.",
+              file=sys.stderr)
+        return 2
+    #The bcrypt pool (app/hashing.py) defaults to half the cores per process; split
+    #that between the workers instead of starting it in every one of them.
+    os.environ.setdefault("HASH_POOL_SIZE", str(max(1, (os.cpu_count() or 2) // (2 * max(1, args.workers)))))
+    if args.check_startup:
+        return check_startup()
+
+    config = uvicorn.Config("main:app", host=args.host, port=args.port, log_level=args.log_level,
+                            workers=args.workers, timeout_graceful_shutdown=args.graceful_timeout)
+    if args.workers <= 1:
+        Worker(config).run()
+    else:
+        Supervisor(config, args.workers).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#Delta sync for offline clients (GET /sync).
+#Every list and task row carries a revision: the owner's lists_version of the write
+#that last changed it (app/versions.py bumps that counter once per write, under the
+#owner row's lock, so a user's writes get revisions in commit order). Deletes leave a
+#tombstone with the revision of the delete. A client that has synced up to revision
+#R asks for ?since=R and gets only what changed after it: changed lists and tasks,
+#and the ids of deleted ones.
+#Pages are ordered by (revision, kind, id) and each covers a fixed range of
+#revisions, (since, revision at the first page], so rows written during a paged sync
+#wait for the next sync instead of shifting the pages. Apply the changes in the order
+#given, then keep 'revision' for the next ?since=.
+
+import base64
+import json
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import Boolean, String, case, cast, insert, literal_column, null, select, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, versions
+
+#largest ?limit= of GET /sync
+SYNC_MAX_LIMIT = int(os.environ.get("SYNC_MAX_LIMIT", "1000"))
+
+lists_table = models.List.__table__
+tasks_table = models.Task.__table__
+tombstones_table = models.Tombstone.__table__
+
+#kind orders the rows of one revision: lists before their tasks, deletes last
+LIST, TASK, DELETED_LIST, DELETED_TASK = 0, 1, 2, 3
+
+
+#Tombstones, written in the delete's transaction. rows: dicts with "id" (and
+#"list_id" for tasks) of the deleted rows.
+def tombstone_values(owner, type: str, rows: list):
+    return [{"owner_id": owner.id, "type": type, "object_id": row["id"],
+             "list_id": row.get("list_id") if type == "task" else None, "revision": owner.lists_version}
+            for row in rows]
+
+def add_tombstones(db: Session, owner, type: str, rows: list):
+    if owner is not None and rows:
+        db.execute(insert(tombstones_table), tombstone_values(owner, type, rows))
+
+async def add_tombstones_async(db: AsyncSession, owner, type: str, rows: list):
+    if owner is not None and rows:
+        await db.execute(insert(tombstones_table), tombstone_values(owner, type, rows))
+
+
+#Cursor for the next page: [user id, last revision of the range, key of the last row]
+def encode_cursor(user_id: int, upto: int, key) -> str:
+    raw = json.dumps([user_id, upto, *key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, user_id: int):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if len(values) != 5 or not all(isinstance(value, int) for value in values):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if values[0] != user_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[1], tuple(values[2:])
+
+
+#The owner's rows changed in revisions (after[0], upto], after the row key 'after'.
+#Each part reads an (owner / list, revision) index range; the row key filter outside
+#the UNION only trims the revision the previous page stopped in.
+def changes_query(user_id: int, upto: int, after: tuple, limit: int):
+    since = after[0]
+    no_text, no_completed = cast(null(), String), cast(null(), Boolean)
+    lists_part = select(
+        literal_column(str(LIST)).label("kind"), literal_column("'list'").label("type"), lists_table.c.id,
+        lists_table.c.revision, lists_table.c.id.label("list_id"), lists_table.c.name.label("text"),
+        no_completed.label("completed"), no_text.label("position")).where(
+        lists_table.c.owner_id == user_id, lists_table.c.revision >= since, lists_table.c.revision <= upto)
+    tasks_part = select(
+        literal_column(str(TASK)), literal_column("'task'"), tasks_table.c.id, tasks_table.c.revision,
+        tasks_table.c.list_id, tasks_table.c.title, tasks_table.c.completed, tasks_table.c.position).select_from(
+        tasks_table.join(lists_table, lists_table.c.id == tasks_table.c.list_id)).where(
+        lists_table.c.owner_id == user_id, tasks_table.c.revision >= since, tasks_table.c.revision <= upto)
+    deleted_part = select(
+        case((tombstones_table.c.type == "list", literal_column(str(DELETED_LIST))),
+             else_=literal_column(str(DELETED_TASK))), tombstones_table.c.type,
+        tombstones_table.c.object_id, tombstones_table.c.revision, tombstones_table.c.list_id, no_text,
+        no_completed, no_text).where(
+        tombstones_table.c.owner_id == user_id, tombstones_table.c.revision >= since,
+        tombstones_table.c.revision <= upto)
+    changes = union_all(lists_part, tasks_part, deleted_part).subquery()
+    key = (changes.c.revision, changes.c.kind, changes.c.id)
+    return select(changes).where(tuple_(*key) > tuple_(*after)).order_by(*key).limit(limit)
+
+
+#The range and starting key of a sync: a new one from 'since', or a continued one
+#from the cursor of the previous page. current = the owner's lists_version now.
+def sync_range(user_id: int, since: int, cursor, current):
+    if cursor:
+        return decode_cursor(cursor, user_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if since > current:
+        raise HTTPException(status_code=409, detail="since is ahead of the server, sync again from 0")
+    if since == 0:
+        #a full sync; writes start at revision 1, 0 is left on rows from before revisions
+        return current, (0, LIST - 1, 0)
+    return current, (since, DELETED_TASK + 1, 0)  # past every row of revision 'since'
+
+def changes_page(user_id: int, upto: int, rows: list, limit: int) -> dict:
+    changes = []
+    for row in rows:
+        change = {"type": row.type, "id": row.id, "revision": row.revision, "deleted": row.kind >= DELETED_LIST,
+                  "list_id": row.list_id}
+        if row.kind == LIST:
+            change["name"] = row.text
+        elif row.kind == TASK:
+            change.update(title=row.text, completed=row.completed, position=row.position)
+        changes.append(change)
+    cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        cursor = encode_cursor(user_id, upto, (last.revision, last.kind, last.id))
+    return {"changes": changes, "revision": upto, "cursor": cursor}
+
+
+def get_changes(db: Session, user_id: int, since: int = 0, cursor: str = None, limit: int = 500):
+    current = None if cursor else versions.get_owner_version(db, user_id)
+    upto, after = sync_range(user_id, since, cursor, current)
+    rows = db.execute(changes_query(user_id, upto, after, limit)).all()
+    return changes_page(user_id, upto, rows, limit)
+
+async def get_changes_async(db: AsyncSession, user_id: int, since: int = 0, cursor: str = None, limit: int = 500):
+    current = None if cursor else await versions.get_owner_version_async(db, user_id)
+    upto, after = sync_range(user_id, since, cursor, current)
+    rows = (await db.execute(changes_query(user_id, upto, after, limit))).all()
+    return changes_page(user_id, upto, rows, limit)
@@ -1,36 +1,533 @@
 # app/tasks.py
 
+import os
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import counts, events, lists, log, models, pagination, positions, schemas, sync, versions
+
+# largest number of tasks accepted by one POST /lists/{list_id}/tasks:batch
+TASK_BATCH_MAX_SIZE = int(os.environ.get("TASK_BATCH_MAX_SIZE", "500"))
+# largest ?limit= of GET /tasks
+TASK_QUERY_MAX_LIMIT = int(os.environ.get("TASK_QUERY_MAX_LIMIT", "500"))
+
+# columns handed back by INSERT/DELETE ... RETURNING for a schemas.Task
+# (defined in app/lists.py, whose fast path reads tasks too)
+task_columns = lists.task_columns
+
+# query for one page of a list's tasks, in list order: by (position, id), see
+# app/positions.py. after, the (position, id) of the previous page's last task,
+# pages by keyset on ix_tasks_list_id_position instead of skipping rows
+def tasks_query(list_id: int, skip: int = 0, limit: int = 20, after: tuple = None):
+    query = select(models.Task).filter_by(list_id=list_id)
+    if after is not None:
+        query = query.filter(tuple_(models.Task.position, models.Task.id) > tuple_(*after))
+    else:
+        query = query.offset(skip)
+    return query.order_by(models.Task.position, models.Task.id).limit(limit)
+
+# cursors of GET /lists/{list_id}/tasks. Rows are ORM objects or, on the
+# serialization fast path, dicts.
+def list_cursor_key(list_id: int, cursor: str):
+    return pagination.decode_sort_cursor(cursor, list_id, "position", (str, int))
+
+def list_cursor(list_id: int, rows, limit: int):
+    if limit <= 0 or len(rows) < limit:
+        return None
+    last = rows[-1]
+    key = (last["position"], last["id"]) if isinstance(last, dict) else (last.position, last.id)
+    return pagination.encode_sort_cursor(list_id, "position", key)
+
 
 # get tasks for a specific list
-def get_tasks(db: Session, list_id: int, skip: int = 0, limit: int = 20):
-    tasks = db.query(models.Task).filter_by(list_id=list_id).offset(skip).limit(limit).all() 
-    print(tasks)
+def get_tasks(db: Session, list_id: int, skip: int = 0, limit: int = 20, after: tuple = None):
+    tasks = db.scalars(tasks_query(list_id, skip=skip, limit=limit, after=after)).all()
+    log.debug_rows("tasks.get_tasks", tasks, list_id=list_id, skip=skip, limit=limit, after=after)
     return tasks
 
+# fast path (FAST_SERIALIZATION=1): the same page as plain dicts with the fields of
+# schemas.Task, without ORM objects
+def get_task_dicts(db: Session, list_id: int, skip: int = 0, limit: int = 20, after: tuple = None):
+    query = tasks_query(list_id, skip=skip, limit=limit, after=after).with_only_columns(*task_columns)
+    return [row._asdict() for row in db.execute(query)]
+
+
+# tasks of all the user's lists (GET /tasks): one join from the owner's lists to their
+# tasks, so the owner check is part of the query. Each list's tasks are read from
+# ix_tasks_list_id_completed_id, which holds every column returned (on Postgres) and
+# the completed filter. Pages are keyset on the sort key, which ends in the task id
+# so it is unique. sort: a key of TASK_SORTS, with "-" in front for descending;
+# "position" is list by list, each in list order.
+TASK_SORTS = {"id": ("id",), "title": ("title", "id"), "list_id": ("list_id", "id"),
+              "position": ("list_id", "position", "id")}
+
+def check_sort(sort: str):
+    if sort.lstrip("-") not in TASK_SORTS or sort.startswith("--"):
+        names = ", ".join(f"{name}, -{name}" for name in TASK_SORTS)
+        raise HTTPException(status_code=400, detail="sort must be one of: " + names)
+    return TASK_SORTS[sort.lstrip("-")], sort.startswith("-")
+
+# the sort key to start after, from the cursor of the previous page
+def sort_cursor_key(user_id: int, sort: str, cursor: str):
+    names, _ = check_sort(sort)
+    types = [str if name in ("title", "position") else int for name in names]
+    return pagination.decode_sort_cursor(cursor, user_id, sort, types)
+
+def user_tasks_query(user_id: int, completed: bool = None, list_ids=None, title_prefix: str = None,
+                     sort: str = "id", after: tuple = None, limit: int = 20):
+    names, descending = check_sort(sort)
+    query = select(*task_columns).join(models.List, models.List.id == models.Task.list_id).filter(
+        models.List.owner_id == user_id)
+    if list_ids:
+        query = query.filter(models.Task.list_id.in_(list_ids))
+    if completed is not None:
+        query = query.filter(models.Task.completed == completed)
+    if title_prefix:
+        # LIKE 'prefix%', with any % or _ in the prefix matched as themselves
+        query = query.filter(models.Task.title.startswith(title_prefix, autoescape=True))
+    key = [getattr(models.Task, name) for name in names]
+    if after is not None:
+        query = query.filter(tuple_(*key) < tuple_(*after) if descending else tuple_(*key) > tuple_(*after))
+    return query.order_by(*(column.desc() if descending else column for column in key)).limit(limit)
+
+# cursor for the page after 'rows', or None when it was the last one
+def user_tasks_cursor(user_id: int, sort: str, rows: list, limit: int):
+    if len(rows) < limit:
+        return None
+    names, _ = check_sort(sort)
+    return pagination.encode_sort_cursor(user_id, sort, [rows[-1][name] for name in names])
+
+def get_user_tasks(db: Session, user_id: int, **filters):
+    tasks = [row._asdict() for row in db.execute(user_tasks_query(user_id, **filters))]
+    log.debug_rows("tasks.get_user_tasks", tasks, user_id=user_id, **filters)
+    return tasks
+
+
+# the owner's bumped version, which is also the revision of the rows the write
+# changes (app/sync.py); no owner means no such list
+def check_owner(owner):
+    if owner is None:
+        raise HTTPException(status_code=404, detail="List not found")
+    return owner
+
+
+# create task on a list, at the end of it. INSERT ... RETURNING hands back the new
+# row, id included, so nothing is read again after the commit.
+# Every write to a list's tasks bumps the list first, which locks its row: writers
+# that append to the same list read its last position one after the other.
+def create_task_statement(list_id: int, task: schemas.TaskCreate, revision: int, position: str):
+    return insert(models.Task).values(**task.dict(), list_id=list_id, revision=revision,
+                                      position=position).returning(*task_columns)
 
-# create task on a list
 def create_task(db: Session, list_id: int, task: schemas.TaskCreate):
-    db_task = models.Task(**task.dict(), list_id=list_id)
-    db.add(db_task)
+    owner = check_owner(versions.bump(db, list_ids=[list_id]))
+    position = positions.key_between(db.scalar(positions.last_position_query(list_id)), None)
+    created = db.execute(create_task_statement(list_id, task, owner.lists_version, position)).one()._asdict()
+    counts.adjust(db, {list_id: (1, 0)})  # new tasks start open
+    events.add(db, owner, "task.created", created)
+    db.commit()
+    return created
+
+
+# group commit (TASK_GROUP_COMMIT_MS, see app/group_commit.py): the create_task calls
+# of one window as a single transaction. items are (list_id, TaskCreate); the result
+# has, in the same order, the created task or the HTTPException for that call.
+# The lists are locked first, in id order: that tells which of them exist and their
+# owners, which are locked next (again in id order) and bumped once each.
+def grouped_lock_query(items: list):
+    return versions.lock_lists_query(models.List.id.in_({list_id for list_id, _ in items}))
+
+def grouped_owners_statement(list_owners: dict):
+    return versions.owners_bump_statement(models.User.id.in_(set(list_owners.values())))
+
+# rows to insert, and the results with None where a row will be created.
+# last_positions: list id -> its last position, advanced as rows are added.
+def grouped_values(items: list, list_owners: dict, owners: dict, last_positions: dict):
+    values, results = [], []
+    for list_id, task in items:
+        if list_id not in list_owners:
+            results.append(HTTPException(status_code=404, detail="List not found"))
+            continue
+        owner = owners[list_owners[list_id]]
+        last_positions[list_id] = positions.key_between(last_positions[list_id], None)
+        values.append({**task.dict(), "list_id": list_id, "revision": owner.lists_version,
+                       "position": last_positions[list_id]})
+        results.append(None)
+    return values, results
+
+def grouped_results(db, results: list, created: list, list_owners: dict, owners: dict):
+    created = iter(created)
+    results = [next(created) if result is None else result for result in results]
+    deltas = {}
+    for task in results:
+        if isinstance(task, dict):
+            tasks, completed = deltas.get(task["list_id"], (0, 0))
+            deltas[task["list_id"]] = (tasks + 1, completed)  # new tasks start open
+            events.add(db, owners[list_owners[task["list_id"]]], "task.created", task)
+    return results, deltas
+
+def create_tasks_grouped(db: Session, items: list):
+    list_owners = dict(db.execute(grouped_lock_query(items)).all())
+    owners = {}
+    if list_owners:
+        db.execute(versions.lists_bump_statement(list_owners))
+        db.execute(versions.lock_owners_query(set(list_owners.values())))
+        owners = {owner.id: owner for owner in db.execute(grouped_owners_statement(list_owners))}
+    last_positions = {list_id: db.scalar(positions.last_position_query(list_id)) for list_id in list_owners}
+    values, results = grouped_values(items, list_owners, owners, last_positions)
+    created = []
+    if values:
+        statement = insert(models.Task).returning(*task_columns, sort_by_parameter_order=True)
+        created = [row._asdict() for row in db.execute(statement, values)]
+    results, deltas = grouped_results(db, results, created, list_owners, owners)
+    counts.adjust(db, deltas)
     db.commit()
-    db.refresh(db_task)
-    return db_task
+    return results
+
+
+# create many tasks on a list: one multi-row INSERT ... RETURNING in one transaction,
+# so either every task is created or none is. Rows come back in request order.
+def create_tasks_query(list_id: int, tasks: list):
+    if len(tasks) > TASK_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"At most {TASK_BATCH_MAX_SIZE} tasks per batch")
+    values = [{**task.dict(), "list_id": list_id} for task in tasks]  # revision is added once known
+    statement = insert(models.Task).returning(*task_columns, sort_by_parameter_order=True)
+    return statement, values
+
+
+# change in the list's counts for the created rows
+def created_counts(list_id: int, created: list):
+    return {list_id: (len(created), sum(bool(task["completed"]) for task in created))}
+
+def created_events(db, owner, created: list):
+    for task in created:
+        events.add(db, owner, "task.created", task)
+
+def create_tasks(db: Session, user_id: int, list_id: int, tasks: list):
+    statement, values = create_tasks_query(list_id, tasks)
+    if not lists.owns_list(db, user_id=user_id, list_id=list_id):
+        raise HTTPException(status_code=404, detail="List not found")
+    if not values:
+        return []
+    try:
+        owner = versions.bump(db, user_id=user_id, list_ids=[list_id])
+        keys = positions.keys_after(db.scalar(positions.last_position_query(list_id)), len(values))
+        values = [{**row, "revision": owner.lists_version, "position": key} for row, key in zip(values, keys)]
+        # plain rows rather than ORM objects, so commit() does not expire them
+        created = [row._asdict() for row in db.execute(statement, values)]
+        counts.adjust(db, created_counts(list_id, created))
+        created_events(db, owner, created)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return created
 
 
 # get one task by its id
 def get_task(db: Session, task_id: int):
     task = db.query(models.Task).filter(models.Task.id == task_id).first()
-    print(task)
+    log.debug_rows("tasks.get_task", task, task_id=task_id)
+    return task
+
+# delete task: a single DELETE ... RETURNING instead of loading the row first. The
+# list (and its owner) is bumped before, as in every write; when there is no such
+# task the bump is rolled back.
+def delete_task_query(list_id: int, task_id: int):
+    return delete(models.Task).where(models.Task.list_id == list_id,
+                                     models.Task.id == task_id).returning(*task_columns)
+
+def check_deleted(task):
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
     return task
 
-# delete task
 def delete_task(db: Session, list_id: int, task_id: int):
-    task = db.query(models.Task).filter(models.List.id ==
-                                        list_id, models.Task.id == task_id).first()
-    
-    db.delete(task)
+    try:
+        owner = versions.bump(db, list_ids=[list_id])
+        task = check_deleted(owner and db.execute(delete_task_query(list_id, task_id)).first())
+        counts.adjust(db, {list_id: (-1, -1 if task.completed else 0)})
+        sync.add_tombstones(db, owner, "task", [task._asdict()])
+        events.add(db, owner, "task.deleted", task._asdict())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return task._asdict()
+
+
+# move a task within its list: it gets a position between its new neighbours', so the
+# only row written is its own (app/positions.py). The list is bumped before the
+# neighbours are read, which makes appends, moves and rebalances of the list wait
+# for each other.
+def check_move(move: schemas.TaskMove):
+    if move.after_id == move.task_id:
+        raise HTTPException(status_code=422, detail="after_id must be another task")
+
+def after_task_query(list_id: int, after_id: int):
+    return select(models.Task.position, models.Task.id).filter(models.Task.list_id == list_id,
+                                                                models.Task.id == after_id)
+
+# the position of the first task after 'after' (the top of the list when None),
+# leaving out the task being moved
+def next_position_query(list_id: int, task_id: int, after=None):
+    query = select(models.Task.position).filter(models.Task.list_id == list_id, models.Task.id != task_id)
+    if after is not None:
+        query = query.filter(tuple_(models.Task.position, models.Task.id) > tuple_(*after))
+    return query.order_by(models.Task.position, models.Task.id).limit(1)
+
+def move_statement(list_id: int, task_id: int, position: str, revision: int):
+    return update(models.Task).where(models.Task.list_id == list_id, models.Task.id == task_id).values(
+        position=position, revision=revision).returning(*task_columns).execution_options(synchronize_session=False)
+
+def check_after(after):
+    if after is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return after
+
+def check_moved(moved):
+    if moved is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return moved._asdict()
+
+# (position before, position after) the task's new place
+def neighbours(db: Session, list_id: int, move: schemas.TaskMove):
+    if move.after_id is None:
+        return None, db.scalar(next_position_query(list_id, move.task_id))
+    after = check_after(db.execute(after_task_query(list_id, move.after_id)).first())
+    return after.position, db.scalar(next_position_query(list_id, move.task_id, tuple(after)))
+
+def move_task(db: Session, user_id: int, list_id: int, move: schemas.TaskMove):
+    check_move(move)
+    if not lists.owns_list(db, user_id=user_id, list_id=list_id):
+        raise HTTPException(status_code=404, detail="List not found")
+    try:
+        owner = check_owner(versions.bump(db, list_ids=[list_id]))
+        before, after = neighbours(db, list_id, move)
+        if before is not None and before == after:
+            # no key fits between equal ones: give the whole list fresh keys first
+            positions.renumber(db, list_id, owner.lists_version)
+            events.add(db, owner, "tasks.reordered", {"list_id": list_id})
+            before, after = neighbours(db, list_id, move)
+        position = positions.key_between(before, after)
+        moved = check_moved(db.execute(move_statement(list_id, move.task_id, position, owner.lists_version)).first())
+        events.add(db, owner, "task.moved", moved)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    positions.check_length(list_id, position)
+    return moved
+
+
+# complete / uncomplete / delete many tasks of the user's lists in one statement.
+# The lists holding matching tasks are locked first (in id order), then bumped with
+# their owner, and the statement runs on those lists only: the lock order of every
+# write (app/versions.py). With the lists locked no other write can change which of
+# their tasks match, so each locked list has changed rows.
+# Complete / uncomplete only match the tasks they flip, so every returned row moves the
+# list's completed count by one, and deletes return 'completed' with the ids: the
+# counts are adjusted from the returned rows (app/counts.py), not recounted.
+def check_bulk_change(change: schemas.TaskBulkChange):
+    if change.task_ids is None and change.list_id is None:
+        raise HTTPException(status_code=422, detail="Pass task_ids and/or list_id")
+
+def bulk_change_where(change: schemas.TaskBulkChange):
+    where = []
+    if change.task_ids is not None:
+        where.append(models.Task.id.in_(change.task_ids))
+    if change.list_id is not None:
+        where.append(models.Task.list_id == change.list_id)
+    if change.completed is not None:
+        where.append(models.Task.completed == change.completed)
+    if change.action == "complete":
+        where.append(models.Task.completed.isnot(True))
+    elif change.action == "uncomplete":
+        where.append(models.Task.completed.is_(True))
+    return where
+
+def bulk_lock_query(user_id: int, change: schemas.TaskBulkChange):
+    matching_lists = select(models.Task.list_id).where(*bulk_change_where(change))
+    return versions.lock_lists_query(models.List.owner_id == user_id, models.List.id.in_(matching_lists))
+
+def bulk_change_query(change: schemas.TaskBulkChange, list_ids: list, revision: int):
+    where = [models.Task.list_id.in_(list_ids), *bulk_change_where(change)]
+    if change.action == "delete":
+        statement = delete(models.Task).where(*where)
+    else:
+        statement = update(models.Task).where(*where).values(completed=change.action == "complete",
+                                                             revision=revision)
+    # synchronize_session=False: nothing in this session holds the rows
+    return statement.returning(models.Task.id, models.Task.list_id, models.Task.completed).execution_options(
+        synchronize_session=False)
+
+# {list_id: (change in tasks, change in completed tasks)} for counts.adjust()
+def bulk_counts(change: schemas.TaskBulkChange, changed: list):
+    deltas = {}
+    for row in changed:
+        tasks, completed = deltas.get(row.list_id, (0, 0))
+        if change.action == "delete":
+            deltas[row.list_id] = (tasks - 1, completed - bool(row.completed))
+        else:
+            deltas[row.list_id] = (tasks, completed + (1 if change.action == "complete" else -1))
+    return deltas
+
+# one tasks.updated / tasks.deleted event per list, with up to events.BULK_EVENT_IDS
+# task ids each
+def bulk_events(db, owner, change: schemas.TaskBulkChange, changed: list):
+    ids_by_list = {}
+    for row in changed:
+        ids_by_list.setdefault(row.list_id, []).append(row.id)
+    for list_id, ids in ids_by_list.items():
+        for start in range(0, len(ids), events.BULK_EVENT_IDS):
+            data = {"list_id": list_id, "ids": ids[start:start + events.BULK_EVENT_IDS]}
+            if change.action == "delete":
+                events.add(db, owner, "tasks.deleted", data)
+            else:
+                events.add(db, owner, "tasks.updated", {**data, "completed": change.action == "complete"})
+
+def bulk_tombstones(change: schemas.TaskBulkChange, changed: list):
+    return [row._asdict() for row in changed] if change.action == "delete" else []
+
+def bulk_change_tasks(db: Session, user_id: int, change: schemas.TaskBulkChange):
+    check_bulk_change(change)
+    list_ids = db.scalars(bulk_lock_query(user_id, change)).all()
+    if not list_ids:
+        db.rollback()  # nothing to change: no new version
+        return {"affected": 0}
+    owner = versions.bump(db, user_id=user_id, list_ids=list_ids)
+    changed = db.execute(bulk_change_query(change, list_ids, owner.lists_version)).all()
+    counts.adjust(db, bulk_counts(change, changed))
+    sync.add_tombstones(db, owner, "task", bulk_tombstones(change, changed))
+    bulk_events(db, owner, change, changed)
     db.commit()
-    return task
-    
\ No newline at end of file
+    return {"affected": len(changed)}
+
+
+# async versions of the functions above, used with an AsyncSession (DATABASE_ASYNC=1)
+async def get_tasks_async(db: AsyncSession, list_id: int, skip: int = 0, limit: int = 20, after: tuple = None):
+    result = await db.scalars(tasks_query(list_id, skip=skip, limit=limit, after=after))
+    return result.all()
+
+
+async def get_task_dicts_async(db: AsyncSession, list_id: int, skip: int = 0, limit: int = 20, after: tuple = None):
+    query = tasks_query(list_id, skip=skip, limit=limit, after=after).with_only_columns(*task_columns)
+    return [row._asdict() for row in await db.execute(query)]
+
+
+async def get_user_tasks_async(db: AsyncSession, user_id: int, **filters):
+    return [row._asdict() for row in await db.execute(user_tasks_query(user_id, **filters))]
+
+
+async def create_task_async(db: AsyncSession, list_id: int, task: schemas.TaskCreate):
+    owner = check_owner(await versions.bump_async(db, list_ids=[list_id]))
+    position = positions.key_between(await db.scalar(positions.last_position_query(list_id)), None)
+    created = (await db.execute(create_task_statement(list_id, task, owner.lists_version, position))).one()._asdict()
+    await counts.adjust_async(db, {list_id: (1, 0)})
+    events.add(db, owner, "task.created", created)
+    await db.commit()
+    return created
+
+
+async def create_tasks_grouped_async(db: AsyncSession, items: list):
+    list_owners = dict((await db.execute(grouped_lock_query(items))).all())
+    owners = {}
+    if list_owners:
+        await db.execute(versions.lists_bump_statement(list_owners))
+        await db.execute(versions.lock_owners_query(set(list_owners.values())))
+        owners = {owner.id: owner for owner in await db.execute(grouped_owners_statement(list_owners))}
+    last_positions = {list_id: await db.scalar(positions.last_position_query(list_id)) for list_id in list_owners}
+    values, results = grouped_values(items, list_owners, owners, last_positions)
+    created = []
+    if values:
+        statement = insert(models.Task).returning(*task_columns, sort_by_parameter_order=True)
+        created = [row._asdict() for row in await db.execute(statement, values)]
+    results, deltas = grouped_results(db, results, created, list_owners, owners)
+    await counts.adjust_async(db, deltas)
+    await db.commit()
+    return results
+
+
+async def create_tasks_async(db: AsyncSession, user_id: int, list_id: int, tasks: list):
+    statement, values = create_tasks_query(list_id, tasks)
+    if not await lists.owns_list_async(db, user_id=user_id, list_id=list_id):
+        raise HTTPException(status_code=404, detail="List not found")
+    if not values:
+        return []
+    try:
+        owner = await versions.bump_async(db, user_id=user_id, list_ids=[list_id])
+        keys = positions.keys_after(await db.scalar(positions.last_position_query(list_id)), len(values))
+        values = [{**row, "revision": owner.lists_version, "position": key} for row, key in zip(values, keys)]
+        created = [row._asdict() for row in await db.execute(statement, values)]
+        await counts.adjust_async(db, created_counts(list_id, created))
+        created_events(db, owner, created)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return created
+
+
+async def get_task_async(db: AsyncSession, task_id: int):
+    result = await db.scalars(select(models.Task).filter(models.Task.id == task_id))
+    return result.first()
+
+
+async def delete_task_async(db: AsyncSession, list_id: int, task_id: int):
+    try:
+        owner = await versions.bump_async(db, list_ids=[list_id])
+        task = check_deleted(owner and (await db.execute(delete_task_query(list_id, task_id))).first())
+        await counts.adjust_async(db, {list_id: (-1, -1 if task.completed else 0)})
+        await sync.add_tombstones_async(db, owner, "task", [task._asdict()])
+        events.add(db, owner, "task.deleted", task._asdict())
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return task._asdict()
+
+
+async def neighbours_async(db: AsyncSession, list_id: int, move: schemas.TaskMove):
+    if move.after_id is None:
+        return None, await db.scalar(next_position_query(list_id, move.task_id))
+    after = check_after((await db.execute(after_task_query(list_id, move.after_id))).first())
+    return after.position, await db.scalar(next_position_query(list_id, move.task_id, tuple(after)))
+
+
+async def move_task_async(db: AsyncSession, user_id: int, list_id: int, move: schemas.TaskMove):
+    check_move(move)
+    if not await lists.owns_list_async(db, user_id=user_id, list_id=list_id):
+        raise HTTPException(status_code=404, detail="List not found")
+    try:
+        owner = check_owner(await versions.bump_async(db, list_ids=[list_id]))
+        before, after = await neighbours_async(db, list_id, move)
+        if before is not None and before == after:
+            await positions.renumber_async(db, list_id, owner.lists_version)
+            events.add(db, owner, "tasks.reordered", {"list_id": list_id})
+            before, after = await neighbours_async(db, list_id, move)
+        position = positions.key_between(before, after)
+        statement = move_statement(list_id, move.task_id, position, owner.lists_version)
+        moved = check_moved((await db.execute(statement)).first())
+        events.add(db, owner, "task.moved", moved)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    positions.check_length(list_id, position)
+    return moved
+
+
+async def bulk_change_tasks_async(db: AsyncSession, user_id: int, change: schemas.TaskBulkChange):
+    check_bulk_change(change)
+    list_ids = (await db.scalars(bulk_lock_query(user_id, change))).all()
+    if not list_ids:
+        await db.rollback()
+        return {"affected": 0}
+    owner = await versions.bump_async(db, user_id=user_id, list_ids=list_ids)
+    changed = (await db.execute(bulk_change_query(change, list_ids, owner.lists_version))).all()
+    await counts.adjust_async(db, bulk_counts(change, changed))
+    await sync.add_tombstones_async(db, owner, "task", bulk_tombstones(change, changed))
+    bulk_events(db, owner, change, changed)
+    await db.commit()
+    return {"affected": len(changed)}
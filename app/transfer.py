@@ -0,0 +1,267 @@
+#Export a user's data as NDJSON (one JSON object per line):
+#  {"type": "list", "id": 1, "name": "groceries"}
+#  {"type": "task", "id": 7, "title": "milk", "completed": false, "list_id": 1}
+#Every list line comes before the lines of its tasks, which are in list order.
+#POST /import reads the same format back, see the second half of this file.
+
+import json
+import os
+import zlib
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import counts, database, events, models, positions, schemas, versions
+
+#rows fetched from the cursor per chunk of output
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+
+
+#All lists of the user with their tasks, as one ordered LEFT JOIN. A list without
+#tasks comes back as a single row with task columns set to NULL.
+def export_query(user_id: int):
+    return select(models.List.id, models.List.name, models.Task.id, models.Task.title,
+                  models.Task.completed).outerjoin(models.Task, models.Task.list_id == models.List.id).filter(
+        models.List.owner_id == user_id).order_by(models.List.id, models.Task.position, models.Task.id)
+
+
+#NDJSON text for one batch of joined rows. last_list_id carries over between
+#batches, so a list that spans two batches is written once.
+def export_chunk(rows, last_list_id):
+    lines = []
+    for list_id, name, task_id, title, completed in rows:
+        if list_id != last_list_id:
+            lines.append(json.dumps({"type": "list", "id": list_id, "name": name}))
+            last_list_id = list_id
+        if task_id is not None:
+            lines.append(json.dumps({"type": "task", "id": task_id, "title": title,
+                                     "completed": completed, "list_id": list_id}))
+    return "".join(line + "\n" for line in lines), last_list_id
+
+
+#The generators below are the body of a StreamingResponse, which runs after the
+#route's session dependency has closed, so they use a connection of their own.
+#yield_per reads through a server-side cursor (where the driver has one)
+#EXPORT_BATCH_SIZE rows at a time, so memory use does not grow with the data.
+def export_user(user_id: int):
+    last_list_id = None
+    with database.engine.connect() as conn:
+        result = conn.execution_options(yield_per=EXPORT_BATCH_SIZE).execute(export_query(user_id))
+        for rows in result.partitions():
+            chunk, last_list_id = export_chunk(rows, last_list_id)
+            yield chunk
+
+
+async def export_user_async(user_id: int):
+    last_list_id = None
+    async with database.async_engine.connect() as conn:
+        result = await conn.stream(export_query(user_id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            chunk, last_list_id = export_chunk(rows, last_list_id)
+            yield chunk
+
+
+#Import
+#The request body is read chunk by chunk as it arrives (gzip is detected and inflated
+#on the fly) and split into lines. Valid lines are queued and written with one
+#multi-row INSERT per IMPORT_BATCH_SIZE rows; all of them in a single transaction
+#committed at the end. Invalid lines are skipped and reported with their line number.
+#Only the map from exported list ids to new ones grows with the upload, tasks do not.
+#The owner is bumped once, before the first rows are written, and every row is
+#inserted with the new version as its revision (app/sync.py), so nothing is written
+#twice. The bump holds the owner row until the commit: the user's other writes wait
+#for the import, as they would for any write of theirs.
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "100"))
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+#Decompressed body chunks. A gzip body is inflated at most IMPORT_MAX_LINE_BYTES at
+#a time, so a small compressed chunk cannot blow up into a huge buffer. It may hold
+#several gzip members one after the other (cat a.gz b.gz, RFC 1952): the bytes after
+#the end of one member start the next, and zero padding between them is skipped as
+#gzip itself does.
+async def body_chunks(chunks):
+    head = b""  # the first bytes, until there are enough to check for gzip
+    decided = False
+    inflater = None
+    async for chunk in chunks:
+        if not decided:
+            head += chunk
+            if len(head) < len(GZIP_MAGIC):
+                continue
+            chunk, decided = head, True
+            if chunk.startswith(GZIP_MAGIC):
+                inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if inflater is None:
+            yield chunk
+            continue
+        try:
+            while chunk:
+                if inflater.eof:
+                    chunk = chunk.lstrip(b"\x00")
+                    if not chunk:
+                        break
+                    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                yield inflater.decompress(chunk, IMPORT_MAX_LINE_BYTES)
+                chunk = inflater.unused_data if inflater.eof else inflater.unconsumed_tail
+        except zlib.error:
+            raise HTTPException(status_code=400, detail="Invalid gzip body")
+    if inflater is not None:
+        yield inflater.flush()
+        if not inflater.eof:
+            raise HTTPException(status_code=400, detail="Truncated gzip body")
+    elif not decided:
+        yield head  # a body shorter than the gzip magic number
+
+
+#(line number, line) for each non-blank line of the body
+async def body_lines(chunks):
+    buffer = b""
+    number = 0
+    async for chunk in body_chunks(chunks):
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Line {number + 1} is longer than {IMPORT_MAX_LINE_BYTES} bytes")
+    if buffer.strip():
+        yield number + 1, buffer
+
+
+#Batched inserts, sync and async. Lists come back with their new ids, in input order.
+lists_insert = insert(models.List).returning(models.List.id, sort_by_parameter_order=True)
+
+def insert_lists(db: Session, values: list):
+    return db.scalars(lists_insert, values).all()
+
+async def insert_lists_async(db: AsyncSession, values: list):
+    return (await db.scalars(lists_insert, values)).all()
+
+#deltas: the change in each list's task counts (see app/counts.py)
+def insert_tasks(db: Session, values: list, deltas: dict):
+    db.execute(insert(models.Task), values)
+    counts.adjust(db, deltas)
+
+async def insert_tasks_async(db: AsyncSession, values: list, deltas: dict):
+    await db.execute(insert(models.Task), values)
+    await counts.adjust_async(db, deltas)
+
+#The end of an import: one lists.imported event with the counts rather than one per
+#row (clients refetch). owner is None when nothing was imported and nothing bumped.
+def commit_import(db: Session, owner, summary: dict):
+    events.add(db, owner, "lists.imported", summary)
+    db.commit()
+
+async def commit_import_async(db: AsyncSession, owner, summary: dict):
+    events.add(db, owner, "lists.imported", summary)
+    await db.commit()
+
+
+class Importer:
+    def __init__(self, db, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.owner = None  # (id, username, lists_version) after the bump, see flush_lists()
+        self.list_ids = {}  # exported list id -> new list id (None until inserted)
+        self.last_positions = {}  # new list id -> position of its last task; tasks keep the file's order
+        self.pending_lists = []  # (exported id, row values)
+        self.pending_tasks = []  # (exported list id, row values)
+        self.lists = 0
+        self.tasks = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, number: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": number, "error": message})
+
+    async def add(self, number: int, line: bytes):
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return self.error(number, "Invalid JSON")
+        kind = data.get("type") if isinstance(data, dict) else None
+        try:
+            if kind == "list":
+                row = schemas.ImportList.model_validate(data)
+            elif kind == "task":
+                row = schemas.ImportTask.model_validate(data)
+            else:
+                return self.error(number, "type must be list or task")
+        except ValidationError as exc:
+            return self.error(number, "; ".join(
+                f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors()))
+
+        if kind == "list":
+            if row.id is not None:
+                if row.id in self.list_ids:
+                    return self.error(number, f"Duplicate list id {row.id}")
+                self.list_ids[row.id] = None
+            self.pending_lists.append((row.id, {"name": row.name, "owner_id": self.user_id}))
+            if len(self.pending_lists) >= IMPORT_BATCH_SIZE:
+                await self.flush_lists()
+        else:
+            if row.list_id not in self.list_ids:
+                return self.error(number, f"Unknown list_id {row.list_id}, its list line must come first")
+            self.pending_tasks.append((row.list_id, {"title": row.title, "completed": row.completed}))
+            if len(self.pending_tasks) >= IMPORT_BATCH_SIZE:
+                await self.flush_tasks()
+
+    #The first batch bumps the owner; its version is the revision of every row
+    async def flush_lists(self):
+        if not self.pending_lists:
+            return
+        if self.owner is None:
+            self.owner = await database.run_crud(versions.bump, versions.bump_async, self.db, user_id=self.user_id)
+        revision = self.owner.lists_version
+        new_ids = await database.run_crud(insert_lists, insert_lists_async, self.db,
+                                          values=[{**values, "revision": revision} for _, values in self.pending_lists])
+        for (exported_id, _), new_id in zip(self.pending_lists, new_ids):
+            if exported_id is not None:
+                self.list_ids[exported_id] = new_id
+        self.lists += len(self.pending_lists)
+        self.pending_lists = []
+
+    async def flush_tasks(self):
+        if not self.pending_tasks:
+            return
+        await self.flush_lists()  # the tasks' lists need their new ids first
+        values = [{**values, "list_id": self.list_ids[list_id], "revision": self.owner.lists_version}
+                  for list_id, values in self.pending_tasks]
+        for row in values:
+            row["position"] = positions.key_between(self.last_positions.get(row["list_id"]), None)
+            self.last_positions[row["list_id"]] = row["position"]
+        deltas = {}
+        for row in values:
+            tasks, completed = deltas.get(row["list_id"], (0, 0))
+            deltas[row["list_id"]] = (tasks + 1, completed + row["completed"])
+        await database.run_crud(insert_tasks, insert_tasks_async, self.db, values=values, deltas=deltas)
+        self.tasks += len(self.pending_tasks)
+        self.pending_tasks = []
+
+    def result(self):
+        return {"lists": self.lists, "tasks": self.tasks,
+                "error_count": self.error_count, "errors": self.errors}
+
+
+#Any exception (a database error, a 413 for an overlong line) leaves the transaction
+#uncommitted, so the session rolls it back and nothing is imported.
+async def import_user(db, user_id: int, chunks):
+    importer = Importer(db, user_id)
+    async for number, line in body_lines(chunks):
+        await importer.add(number, line)
+    await importer.flush_tasks()
+    await importer.flush_lists()
+    await database.run_crud(commit_import, commit_import_async, db, owner=importer.owner,
+                            summary={"lists": importer.lists, "tasks": importer.tasks})
+    return importer.result()
@@ -1,40 +1,106 @@
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from . import models, schemas
-from app import auth 
+from . import hashing, models, schemas
+from app import auth
+from app.database import run_crud
 from fastapi import HTTPException
- 
-#Storing passwords securely - hash them using bcrypt
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def get_hashed_password(password: str) -> str:
-    return password_context.hash(password)
+#Storing passwords securely - hash them using bcrypt. The hashing itself runs on the
+#process pool in app/hashing.py; the functions here only do the database part.
 
-def verify_password(password: str, hashed_pass: str) -> bool:
-    return password_context.verify(password, hashed_pass)
 
+# INSERT ... RETURNING hands back the new id with the insert itself, so there is no
+# SELECT after the commit to read it
+def create_user_statement(user: schemas.UserCreate, hashed_password: str):
+    return insert(models.User).values(username=user.username, password=hashed_password).returning(
+        models.User.id, models.User.username)
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_hashed_password(user.password)
-    db_user = models.User(username=user.username, password=hashed_password)
-    
-    db.add(db_user)
+
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    try:
+        db_user = db.execute(create_user_statement(user, hashed_password)).one()._asdict()
+        db.commit()
+    except IntegrityError:
+        # users.username is unique
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Username already registered")
+    return db_user
+
+
+# id, username and hash of the user logging in. The session is closed straight after,
+# so its connection is back in the pool while the hash is checked; a later statement
+# on the session starts a new transaction.
+def login_query(username: str):
+    return select(models.User.id, models.User.username, models.User.password).where(
+        models.User.username == username)
+
+
+def get_login(db: Session, username: str):
+    row = db.execute(login_query(username)).first()
+    db.close()
+    return row
+
+
+# store a hash re-made with the current bcrypt cost
+def update_password(db: Session, user_id: int, hashed_password: str):
+    db.execute(update(models.User).where(models.User.id == user_id).values(password=hashed_password))
     db.commit()
-    db.refresh(db_user)
+
+
+def get_user(db: Session, user_id: int):
+    return db.query(models.User).filter(models.User.id == user_id).first()
+
+
+# async versions for an AsyncSession (DATABASE_ASYNC=1)
+async def create_user_async(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
+    try:
+        db_user = (await db.execute(create_user_statement(user, hashed_password))).one()._asdict()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Username already registered")
     return db_user
 
 
-def login_user(db: Session, user: schemas.UserCredentials):
-    db_user = db.query(models.User).filter(
-        models.User.username == user.username).first()
+async def get_login_async(db: AsyncSession, username: str):
+    row = (await db.execute(login_query(username))).first()
+    await db.close()
+    return row
+
+
+async def update_password_async(db: AsyncSession, user_id: int, hashed_password: str):
+    await db.execute(update(models.User).where(models.User.id == user_id).values(password=hashed_password))
+    await db.commit()
+
+
+async def get_user_async(db: AsyncSession, user_id: int):
+    result = await db.scalars(select(models.User).filter(models.User.id == user_id))
+    return result.first()
+
+
+# Sign up and login, used by the routes in both modes. Hashing awaits the process
+# pool, and only the database calls go through run_crud. No connection is held while
+# a hash is waited on: a queue of logins would otherwise empty the pool for CRUD.
+async def sign_up_user(db, user: schemas.UserCreate):
+    hashed_password = await hashing.hash_password(user.password)
+    return await run_crud(create_user, create_user_async, db, user=user, hashed_password=hashed_password)
+
+
+async def login_user(db, user: schemas.UserCredentials):
+    db_user = await run_crud(get_login, get_login_async, db, username=user.username)
 
     user_password_error = "Incorrect username or password"
 
     if db_user is None:
         raise HTTPException(status_code=404, detail=user_password_error)
-    if not verify_password(user.password, db_user.password):
+    valid, new_hash = await hashing.verify_password(user.password, db_user.password)
+    if not valid:
         raise HTTPException(status_code=401, detail=user_password_error)
+    if new_hash is not None:
+        # BCRYPT_ROUNDS changed since this password was hashed (in a new transaction)
+        await run_crud(update_password, update_password_async, db, user_id=db_user.id, hashed_password=new_hash)
     return {
-        "access_token": auth.create_access_token(f"{db_user.id}:{db_user.username}"), 
+        "access_token": auth.create_access_token(f"{db_user.id}:{db_user.username}"),
         "token_type": "bearer"}
-
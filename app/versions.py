@@ -0,0 +1,141 @@
+#Version counters for conditional GET (ETag / If-None-Match) and the response cache.
+#- users.lists_version changes whenever anything GET /lists shows for that owner
+#  changes: their lists, or the tasks on those lists.
+#- lists.tasks_version changes whenever the tasks of that list change.
+#Writes bump the counters in the same transaction as the change itself, so the
+#counters live in the database and stay right with several server processes.
+#A read first fetches the one counter it needs (a primary key lookup), which is
+#enough to answer If-None-Match with 304 without querying the task table.
+#Each write bumps the owner's counter exactly once, so its new value numbers the
+#owner's changes one by one; app/events.py uses it as the event id.
+#Lock order: every write locks the list rows it changes first (lowest id first),
+#then the owner row, and only then touches task rows. bump() with list_ids follows
+#it; a write on several lists takes their locks up front with lock_lists_query().
+#Two writes on the same rows then wait for each other instead of deadlocking.
+
+import hashlib
+import os
+
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import metrics, models
+from .cache import TTLCache
+
+#Serialised response bodies keyed by (route, scope id, version, query params).
+#A write changes the version, so old entries are never served again - they just age
+#out of the LRU. RESPONSE_CACHE_SIZE=0 turns the cache off (ETags still work).
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+metrics.collectors.append(lambda: metrics.stats_lines("response_cache", response_cache.stats()))
+
+
+def lists_bump_statement(list_ids):
+    return update(models.List).where(models.List.id.in_(list_ids)).values(
+        tasks_version=models.List.tasks_version + 1)
+
+#Statements bumping the counters touched by a write: (lists statement, owner
+#statement), either None when there is nothing to bump. Pass the owner when it is
+#known; otherwise it is looked up from the lists.
+def bump_statements(user_id: int = None, list_ids=()):
+    lists_statement = None
+    list_ids = list(list_ids)
+    if list_ids:
+        lists_statement = lists_bump_statement(list_ids)
+    if user_id is not None:
+        owners = models.User.id == user_id
+    elif list_ids:
+        owners = models.User.id.in_(select(models.List.owner_id).filter(models.List.id.in_(list_ids)))
+    else:
+        return lists_statement, None
+    return lists_statement, owners_bump_statement(owners)
+
+#RETURNING the owners' rows as they are after the bump
+def owners_bump_statement(owners):
+    return update(models.User).where(owners).values(lists_version=models.User.lists_version + 1).returning(
+        models.User.id, models.User.username, models.User.lists_version)
+
+#Run inside the write's transaction, before its commit. Returns the owner's
+#(id, username, lists_version) after the bump, or None when no owner counter was bumped.
+def bump(db: Session, user_id: int = None, list_ids=()):
+    lists_statement, owner_statement = bump_statements(user_id, list_ids)
+    if lists_statement is not None:
+        db.execute(lists_statement)
+    if owner_statement is not None:
+        return db.execute(owner_statement).first()
+    return None
+
+async def bump_async(db: AsyncSession, user_id: int = None, list_ids=()):
+    lists_statement, owner_statement = bump_statements(user_id, list_ids)
+    if lists_statement is not None:
+        await db.execute(lists_statement)
+    if owner_statement is not None:
+        return (await db.execute(owner_statement)).first()
+    return None
+
+
+#(id, owner_id) of the lists matching 'where', locked in id order (FOR UPDATE; SQLite
+#has no row locks and takes the database write lock with the first write anyway)
+def lock_lists_query(*where):
+    return select(models.List.id, models.List.owner_id).where(*where).order_by(
+        models.List.id).with_for_update()
+
+#The same for owners, for a write that bumps several of them. FOR NO KEY UPDATE, the
+#lock of the bump's own UPDATE: it does not wait for writes that only insert rows
+#referring to the owner (a new list).
+def lock_owners_query(owner_ids):
+    return select(models.User.id).where(models.User.id.in_(owner_ids)).order_by(
+        models.User.id).with_for_update(key_share=True)
+
+#Current counters; None when the user / list does not exist
+def owner_version_query(user_id: int):
+    return select(models.User.lists_version).filter(models.User.id == user_id)
+
+def list_version_query(list_id: int):
+    return select(models.List.tasks_version).filter(models.List.id == list_id)
+
+def get_owner_version(db: Session, user_id: int):
+    return db.scalar(owner_version_query(user_id))
+
+def get_list_version(db: Session, list_id: int):
+    return db.scalar(list_version_query(list_id))
+
+async def get_owner_version_async(db: AsyncSession, user_id: int):
+    return await db.scalar(owner_version_query(user_id))
+
+async def get_list_version_async(db: AsyncSession, list_id: int):
+    return await db.scalar(list_version_query(list_id))
+
+
+#Weak ETag for a cache key; the key holds the version and every query param, so
+#another page or shape of the same data gets another tag
+def make_etag(key: tuple) -> str:
+    return 'W/"' + hashlib.sha1(repr(key).encode()).hexdigest()[:20] + '"'
+
+#If-None-Match holds "*" or a comma separated list of tags; W/ prefixes compare weakly
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+#Conditional GET for a JSON route. 'key' identifies the response (see above) and
+#build() makes it when it is not cached: it returns the body bytes and any extra
+#headers (the X-Next-Cursor of a page), which are cached along with the body.
+async def cached_json(request: Request, key: tuple, build) -> Response:
+    etag = make_etag(key)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = response_cache.get(key) if RESPONSE_CACHE_SIZE else None
+    if cached is None:
+        cached = await build()
+        if RESPONSE_CACHE_SIZE:
+            response_cache.set(key, cached)
+    body, headers = cached
+    return Response(body, media_type="application/json", headers={**headers, "ETag": etag})
@@ -0,0 +1,106 @@
+#Warm-up run by the lifespan hook in main.py before a worker accepts connections:
+#- opens DB_POOL_PREWARM connections (default: DB_POOL_SIZE) on the primary and on
+#  each replica and runs "SELECT 1" on them, so they wait in the pool;
+#- starts the bcrypt process pool (app/hashing.py), which otherwise starts on the
+#  first sign up or login, each of its processes importing passlib and bcrypt;
+#- signs and checks one JWT, loading the jose / cryptography backends.
+#A warm-up step that fails is logged and the worker starts anyway: a database that is
+#down at startup should give errors on requests, not a worker that keeps restarting.
+#The times are logged, with a warning when importing main takes longer than
+#IMPORT_BUDGET_SECONDS or the whole start (import + warm-up) longer than
+#STARTUP_BUDGET_SECONDS. 'python -m app.serve --check-startup' fails on the same budgets.
+
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from jose import jwt
+from sqlalchemy import text
+
+from . import auth, database, hashing
+
+logger = logging.getLogger("uvicorn.error")
+
+DB_POOL_PREWARM = int(os.environ.get("DB_POOL_PREWARM", str(database.POOL_OPTIONS["pool_size"])))
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", "3.0"))
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", "6.0"))
+
+
+def engines():
+    return [database.async_engine if database.ASYNC_MODE else database.engine] + database.replica_engines
+
+
+#Check out 'count' connections at once, so the pool opens that many, then return them
+def warm_engine(engine, count: int):
+    connections = []
+    try:
+        for _ in range(count):
+            conn = engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+
+async def warm_engine_async(engine, count: int):
+    connections = []
+    try:
+        for _ in range(count):
+            conn = await engine.connect()
+            connections.append(conn)
+            await conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            await conn.close()
+
+
+async def warm_database():
+    count = min(DB_POOL_PREWARM, database.POOL_OPTIONS["pool_size"])
+    for engine in engines():
+        if database.ASYNC_MODE:
+            await warm_engine_async(engine, count)
+        else:
+            await asyncio.to_thread(warm_engine, engine, count)
+
+
+async def warm_hashing():
+    await hashing.pool.warm()
+
+
+async def warm_jwt():
+    token = auth.create_access_token("warm-up")
+    jwt.decode(token, auth.JWT_SECRET_KEY, algorithms=[auth.ALGORITHM])
+
+
+STEPS = {"database": warm_database, "hashing": warm_hashing, "jwt": warm_jwt}
+
+
+#Runs every step and returns {step: seconds}, with "import" and "total" added
+async def warm_up(import_seconds: Optional[float] = None) -> dict:
+    timings = {}
+    for name, step in STEPS.items():
+        started = time.perf_counter()
+        try:
+            await step()
+        except Exception:
+            logger.exception("Warm-up step %s failed", name)
+        timings[name] = time.perf_counter() - started
+    timings["warm_up"] = sum(timings.values())
+    if import_seconds is not None:
+        timings["import"] = import_seconds
+        timings["total"] = import_seconds + timings["warm_up"]
+    logger.info("Warm-up done: %s", ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items()))
+    for problem in over_budget(timings):
+        logger.warning(problem)
+    return timings
+
+
+def over_budget(timings: dict) -> list:
+    problems = []
+    if timings.get("import", 0) > IMPORT_BUDGET_SECONDS:
+        problems.append(f"Importing main took {timings['import']:.3f}s, over IMPORT_BUDGET_SECONDS={IMPORT_BUDGET_SECONDS}")
+    if timings.get("total", 0) > STARTUP_BUDGET_SECONDS:
+        problems.append(f"Startup took {timings['total']:.3f}s, over STARTUP_BUDGET_SECONDS={STARTUP_BUDGET_SECONDS}")
+    return problems
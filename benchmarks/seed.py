@@ -0,0 +1,66 @@
+#Seed a benchmark database with users / lists / tasks.
+#Rows are written with multi-row Core INSERTs. Every user gets the same password
+#hash, made once, so seeding does not spend minutes in bcrypt.
+
+from dataclasses import dataclass, field
+
+from sqlalchemy import func, insert, select
+
+from app import counts, database, models, positions
+from app.hashing import password_context
+
+CHUNK = 5000
+
+
+@dataclass
+class Dataset:
+    #user id -> username
+    users: dict = field(default_factory=dict)
+    #user id -> [list id, ...]
+    lists: dict = field(default_factory=dict)
+    #list id -> (first task id, last task id); seeded tasks of a list have consecutive ids
+    task_ids: dict = field(default_factory=dict)
+    #position of the i-th seeded task of every list
+    positions: list = field(default_factory=list)
+
+
+def insert_chunked(conn, table, rows):
+    for start in range(0, len(rows), CHUNK):
+        conn.execute(insert(table), rows[start:start + CHUNK])
+
+
+def seed(users: int, lists_per_user: int, tasks_per_list: int, password: str) -> Dataset:
+    database.Base.metadata.create_all(database.engine)
+    hashed_password = password_context.hash(password)
+    dataset = Dataset()
+    with database.engine.begin() as conn:
+        run = conn.scalar(select(func.count(models.User.id)))  # keeps usernames unique across runs
+        insert_chunked(conn, models.User, [
+            {"username": f"bench-{run}-{i}", "password": hashed_password, "disabled": False}
+            for i in range(users)])
+        dataset.users = dict(conn.execute(select(models.User.id, models.User.username).filter(
+            models.User.username.like(f"bench-{run}-%"))).all())
+
+        for user_id in dataset.users:
+            conn.execute(insert(models.List), [
+                {"name": f"list {i}", "owner_id": user_id} for i in range(lists_per_user)])
+        for list_id, owner_id in conn.execute(select(models.List.id, models.List.owner_id).filter(
+                models.List.owner_id.in_(list(dataset.users))).order_by(models.List.id)):
+            dataset.lists.setdefault(owner_id, []).append(list_id)
+
+        all_lists = [list_id for list_ids in dataset.lists.values() for list_id in list_ids]
+        keys = dataset.positions = positions.keys_after(None, tasks_per_list)  # the same in every list
+        for list_id in all_lists:
+            #one list at a time, so each list's tasks get consecutive ids
+            insert_chunked(conn, models.Task, [
+                {"title": f"task {i}", "completed": i % 3 == 0, "list_id": list_id, "position": keys[i]}
+                for i in range(tasks_per_list)])
+        for start in range(0, len(all_lists), CHUNK):
+            #the Core INSERTs above bypass the count upkeep in app/tasks.py
+            conn.execute(counts.recount_statement(all_lists[start:start + CHUNK]))
+        if tasks_per_list:
+            for list_id, first, last in conn.execute(select(
+                    models.Task.list_id, func.min(models.Task.id), func.max(models.Task.id)).filter(
+                    models.Task.list_id.in_(all_lists)).group_by(models.Task.list_id)):
+                dataset.task_ids[list_id] = (first, last)
+    return dataset
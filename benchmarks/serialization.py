@@ -0,0 +1,108 @@
+#Compare the two ways GET /lists and GET /lists/{list_id}/tasks build their JSON:
+#- default: ORM objects -> Pydantic response schemas -> JSON
+#- fast path (FAST_SERIALIZATION=1): column tuples -> dicts -> orjson
+#For every route shape it first checks both give byte-identical bodies, then times
+#query + serialisation of the same pages with each path.
+#
+#   pipenv run python -m benchmarks.serialization
+#   pipenv run python -m benchmarks.serialization --lists-per-user 50 --tasks-per-list 200 --repeat 100
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#names with characters an encoder may escape differently
+AWKWARD_NAMES = ['quote " backslash \\ slash /', "control \x01\x1f\t\n", "unicode é ☃ 😀  "]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the serialization fast path against the default one")
+    parser.add_argument("--database-url", help="default: a new SQLite file in a temp dir")
+    parser.add_argument("--lists-per-user", type=int, default=20)
+    parser.add_argument("--tasks-per-list", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20, help="page size, as ?limit=")
+    parser.add_argument("--repeat", type=int, default=200, help="timed runs per shape and path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    database_url = args.database_url or "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="todo-bench-"), "bench.db")
+    #app modules read these at import time
+    os.environ.update(DATABASE_URL=database_url, DATABASE_ASYNC="0")
+    sys.path.insert(0, ROOT)
+
+    import orjson
+    from pydantic import TypeAdapter
+    from sqlalchemy import insert
+
+    from app import database, lists, models, schemas, tasks
+    from benchmarks.seed import seed
+
+    dataset = seed(1, args.lists_per_user, args.tasks_per_list, "bench-password")
+    [user_id] = dataset.users
+    list_id = dataset.lists[user_id][0]
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Task), [{"title": name, "completed": False, "list_id": list_id}
+                                           for name in AWKWARD_NAMES])
+        conn.execute(insert(models.List), [{"name": name, "owner_id": user_id} for name in AWKWARD_NAMES])
+
+    lists_adapter = TypeAdapter(List[schemas.ListRead])
+    tasks_adapter = TypeAdapter(List[schemas.Task])
+
+    #(name, default path, fast path); each returns the response body
+    def lists_shape(include, tasks_limit=None):
+        def default(db):
+            results = lists.get_lists(db, user_id=user_id, limit=args.limit, include=include, tasks_limit=tasks_limit)
+            return lists_adapter.dump_json(lists.shape_lists(results, include), exclude_unset=True)
+
+        def fast(db):
+            return orjson.dumps(lists.get_list_dicts(db, user_id=user_id, limit=args.limit,
+                                                     include=include, tasks_limit=tasks_limit))
+        return default, fast
+
+    def tasks_shape():
+        def default(db):
+            results = tasks.get_tasks(db, list_id=list_id, limit=args.limit)
+            return tasks_adapter.dump_json(tasks_adapter.validate_python(results, from_attributes=True))
+
+        def fast(db):
+            return orjson.dumps(tasks.get_task_dicts(db, list_id=list_id, limit=args.limit))
+        return default, fast
+
+    shapes = {
+        "GET /lists": lists_shape(lists.LIST_INCLUDES),
+        "GET /lists?include=": lists_shape(()),
+        "GET /lists?include=owner": lists_shape(("owner",)),
+        "GET /lists?tasks_limit=3": lists_shape(lists.LIST_INCLUDES, tasks_limit=3),
+        "GET /lists/{id}/tasks": tasks_shape(),
+    }
+
+    print(f"{'route':28} {'default ms':>11} {'fast ms':>9} {'speedup':>8}")
+    failed = False
+    for name, (default, fast) in shapes.items():
+        with database.SessionLocal() as db:
+            if default(db) != fast(db):
+                print(f"{name:28} bodies differ")
+                failed = True
+                continue
+        timings = []
+        for build in (default, fast):
+            with database.SessionLocal() as db:
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    build(db)
+                    db.expunge_all()  # no identity map reuse between runs
+                timings.append((time.perf_counter() - started) / args.repeat * 1000)
+        print(f"{name:28} {timings[0]:>11.2f} {timings[1]:>9.2f} {timings[0] / timings[1]:>7.1f}x")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
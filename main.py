@@ -3,26 +3,55 @@
 #for database interactions, Pydantic for data validation, and FastAPI 
 #for building a modern web API. 
 
+import os
+import time
+from contextlib import asynccontextmanager
+
+#how long importing this module takes, checked by app/warmup.py
+IMPORT_STARTED = time.perf_counter()
+
+from dotenv import load_dotenv
+
+#take environment variables from .env, before the app modules below read them
+load_dotenv()
+
 #Import necessary modules / classes from FastAPI
-from typing import List, Annotated
-from fastapi import Depends, FastAPI, HTTPException
+from typing import List, Annotated, Optional
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+import orjson
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordBearer
 #Import modules from local 'app' package.
-from app import lists, models, database, schemas, tasks, users
-from app.deps import get_current_user, UserBase
+from app import admission, env, events, group_commit, lists, positions, models, database, hashing, metrics, pagination, schemas, search, sync, tasks, transfer, users, versions, warmup
+from app.deps import get_current_user, get_read_session, get_session, rate_limit_key, run_crud, UserBase
 #Had to add above line to define get_current_user + UserBase on line 120
 
 
-from dotenv import load_dotenv
-
-load_dotenv()  # take environment variables from .env.
+#Startup and shutdown (app/warmup.py). Uvicorn only starts accepting connections
+#once warm-up is done, so the first requests of a new worker do not pay for opening
+#database connections or starting the bcrypt process pool.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.warm_up = await warmup.warm_up(import_seconds=IMPORT_SECONDS)
+    await events.broker.start()
+    await positions.rebalancer.start()
+    yield
+    await positions.rebalancer.stop()
+    if group_commit.task_creates is not None:
+        await group_commit.task_creates.stop()  # write the tasks still queued
+    await events.broker.stop()
+    #Stop the bcrypt process pool (app/hashing.py) and close pooled async connections
+    #(primary and replicas)
+    hashing.pool.shutdown()
+    await database.dispose_async_engines()
 
 
 #Create an instance of the FastAPI class, which represents the main application.
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -32,6 +61,54 @@ reuseable_oauth = OAuth2PasswordBearer(
 )
 
 
+#Admission control (app/admission.py): per-route concurrency limits with a short wait
+#queue, so a slow database gives fast 503s instead of requests piling up on the pool,
+#and an optional per-user rate limit (429). Limits are per server process.
+#Routes that need a database connection for their whole run are sized to the pool;
+#routes left out (login/sign up are limited by the bcrypt pool) are not limited.
+DB_SLOTS = database.POOL_OPTIONS["pool_size"] + database.POOL_OPTIONS["max_overflow"]
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "2"))
+
+def db_route_limit(share: float = 1.0, queue_factor: int = 4):
+    concurrency = max(1, int(DB_SLOTS * share))
+    return admission.RouteLimit(concurrency=concurrency, queue=concurrency * queue_factor,
+                                timeout=ADMISSION_QUEUE_TIMEOUT)
+
+ADMISSION_LIMITS = {
+    "GET /lists": db_route_limit(),
+    "GET /lists/summary": db_route_limit(),
+    "GET /lists/{list_id}/tasks": db_route_limit(),
+    "GET /tasks": db_route_limit(),
+    "POST /lists": db_route_limit(0.5),
+    "DELETE /lists": db_route_limit(0.5),
+    "DELETE /lists:batch": db_route_limit(0.25),
+    "POST /lists/{list_id}/tasks": db_route_limit(0.5),
+    "POST /lists/{list_id}/tasks:batch": db_route_limit(0.25),
+    "DELETE /lists/{list_id}/tasks": db_route_limit(0.5),
+    "POST /lists/{list_id}/tasks:move": db_route_limit(0.5),
+    "POST /tasks:bulk": db_route_limit(0.25),
+    "GET /search": db_route_limit(0.5),
+    "GET /sync": db_route_limit(0.5),
+    #these hold a connection for the whole upload / download
+    "GET /export": db_route_limit(0.2, queue_factor=1),
+    "POST /import": db_route_limit(0.2, queue_factor=1),
+    #open event streams / long-polls; they hold no database connection while open
+    "GET /events": admission.RouteLimit(concurrency=int(os.environ.get("EVENTS_MAX_STREAMS", "1000"))),
+}
+
+#RATE_LIMIT_PER_SECOND=0 (the default) turns the per-user rate limit off
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", "0"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "20"))
+
+app.add_middleware(
+    admission.AdmissionMiddleware,
+    router=app.router,
+    limits=ADMISSION_LIMITS,
+    rate_limit=admission.RateLimit(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST) if RATE_LIMIT_PER_SECOND > 0 else None,
+    user_key=rate_limit_key,
+    exempt={"GET /metrics", "GET /health"},
+)
+
 
 #Configure Cross-Origin Resource Sharing (CORS) middleware to allow requests from 
 #any origin ("*"). CORS headers are added to responses to handle cross-origin requests.
@@ -43,60 +120,55 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag"]
 )
 
+#Per-route latency and per-request SQL statement / db time histograms (app/metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
+
+#the bcrypt pool is not imported by app/metrics.py (it also loads in the pool processes)
+metrics.collectors.append(lambda: metrics.stats_lines("hash_pool", hashing.pool.stats()) +
+                          hashing.pool.latency.render())
+
+#Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+#Health check with the state of each connection pool (app/database.py)
+@app.get("/health", include_in_schema=False)
+def health():
+    return {"status": "ok", "pools": database.pool_stats()}
+
 #Dependency
-#Define a function (get_db) to obtain a database session (SessionLocal) using 
-#FastAPI's dependency injection. The session is yielded for use in route functions, 
-#and it's ensured to be closed after use.
-
-def get_db():
-    db = database.SessionLocal()
-    #Begins by creating a new DB session ('db') using 
-    #'SessionLocal' method from the database module. This session represents a connection 
-    #to the database.
-    try:
-        yield db
-    #This try block contains a 'yield' statement. It provides the db session to 
-    #the route function that depends on this get_db function which allows the route function
-    #to use the session for db operations.
-    finally:
-        db.close()
-    #This finally block ensures that the database session is closed.
-        
-#Purpose of 'get_db' function:
-    #Dependency for Route Functions - When a route function depends on get_db, FastAPI will 
-    #automatically provide it with a database session.
-    #Database Session Management - ensure that each route function gets its own isolated 
-    #session. This helps manage transactions and prevent unintended side effects between different 
-    #parts of your application.
-    #Resource Cleanup: finally block ensures that the database session is properly closed, even if an error occurs.       
+#The session dependencies (get_db / get_async_db / get_session) and run_crud live in
+#app/deps.py, so get_current_user shares the same per-request session as the route.
 
 
 #Users
 #Sign up users
 @app.post("/users", response_model=schemas.UserBase)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    return users.create_user(db, user=user)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_session)):
+    return await users.sign_up_user(db, user=user)
 
 #login users
 @app.post("/users/login", response_model=schemas.Token)
-def login_user(user: schemas.UserCredentials, db: Session = Depends(get_db)):
-    return users.login_user(db, user=user)
+async def login_user(user: schemas.UserCredentials, db: Session = Depends(get_session)):
+    return await users.login_user(db, user=user)
 
 #on the api, it asks for the access_key
 # only that server / api that gave that key should be able to see (this is the JWT token)
 
 @app.post("/docslogin", response_model=schemas.Token) #?schemas.Token?
-def login_with_form_data(
+async def login_with_form_data(
     user: OAuth2PasswordRequestForm = Depends(), #dependency injection - automatically provides required dependencies to function.
     #declares a parameter 'user' of type OAuth2PasswordRequestForm.
     #OAuth2PasswordRequestForm is a Pydantic model provided by FastAPI 
     #specifically designed for handling OAuth2 password grant type requests.
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
-    return users.login_user(db, user=user)
+    return await users.login_user(db, user=user)
 
 #LISTS  
 #Get all lists
@@ -111,51 +183,283 @@ def login_with_form_data(
 #     return results
 
 #Access Control. Control their access to only their own lists.
-@app.get("/lists", response_model=List[schemas.List])
-def read_lists(
-        skip: int = 0, limit: int = 20,
+#Paging: pass the X-Next-Cursor header of the previous page as 'cursor' (skip is
+#then ignored). skip/limit on their own still work as before.
+#Shape: 'include' picks which of tasks/owner are returned (default both, pass
+#include= for names only) and 'tasks_limit' caps the tasks returned per list.
+#Caching: responses carry an ETag. Send it back as If-None-Match to get a 304 when
+#nothing changed; unchanged pages are also served from app/versions.py's cache.
+#Serialization fast path: with FAST_SERIALIZATION=1 the GET routes read plain columns
+#into dicts (lists.get_list_dicts / tasks.get_task_dicts) and encode them with orjson
+#instead of loading ORM objects and validating them into the response schemas. The
+#JSON is byte for byte the same (benchmarks/serialization.py checks and times both).
+FAST_SERIALIZATION = env.flag("FAST_SERIALIZATION")
+
+lists_adapter = TypeAdapter(List[schemas.ListRead])
+
+@app.get("/lists", response_model=List[schemas.ListRead], response_model_exclude_unset=True)
+async def read_lists(
+        request: Request,
+        skip: int = 0, limit: int = 20, cursor: Optional[str] = None,
+        include: str = ",".join(lists.LIST_INCLUDES), tasks_limit: Optional[int] = None,
         user: UserBase = Depends(get_current_user), # inject the current_user
-        db: Session = Depends(get_db)):
-    results = lists.get_lists(db, user_id=user.id, skip=skip, limit=limit) # pass in the user_id
-    if results is None:
-        raise HTTPException(status_code=404, detail="No lists found")
-    return results
-
-
+        db: Session = Depends(get_read_session)):
+    include = tuple(field for field in include.split(",") if field)
+    if any(field not in lists.LIST_INCLUDES for field in include):
+        raise HTTPException(status_code=400, detail="include must be a subset of: " + ",".join(lists.LIST_INCLUDES))
+    after_id = pagination.decode_cursor(cursor, user.id) if cursor else None
+
+    async def build():
+        if FAST_SERIALIZATION:
+            crud = (lists.get_list_dicts, lists.get_list_dicts_async)
+        else:
+            crud = (lists.get_lists, lists.get_lists_async)
+        results = await run_crud(*crud, db,
+                                 user_id=user.id, skip=skip, limit=limit, after_id=after_id, # pass in the user_id
+                                 include=include, tasks_limit=tasks_limit)
+        if results is None:
+            raise HTTPException(status_code=404, detail="No lists found")
+        next_cursor = pagination.next_cursor(user.id, results, limit)
+        headers = {pagination.NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        if FAST_SERIALIZATION:
+            return orjson.dumps(results), headers
+        return lists_adapter.dump_json(lists.shape_lists(results, include), exclude_unset=True), headers
+
+    # read the version before the lists: a write in between makes the body newer than
+    # its key says, never older, so a client may get a change early but never miss one
+    version = await run_crud(versions.get_owner_version, versions.get_owner_version_async, db, user_id=user.id)
+    key = ("lists", user.id, version, skip, limit, after_id, include, tasks_limit)
+    return await versions.cached_json(request, key, build)
+
+
+
+
+#List summaries: each list with its task_count / completed_count, read from the list
+#row itself. Paging and ETags as for GET /lists.
+@app.get("/lists/summary", response_model=List[schemas.ListSummary])
+async def read_list_summaries(
+        request: Request,
+        skip: int = 0, limit: int = 20, cursor: Optional[str] = None,
+        user: UserBase = Depends(get_current_user),
+        db: Session = Depends(get_read_session)):
+    after_id = pagination.decode_cursor(cursor, user.id) if cursor else None
+
+    async def build():
+        results = await run_crud(lists.get_list_summaries, lists.get_list_summaries_async, db,
+                                 user_id=user.id, skip=skip, limit=limit, after_id=after_id)
+        next_cursor = pagination.next_cursor(user.id, results, limit)
+        headers = {pagination.NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        return orjson.dumps(results), headers
+
+    version = await run_crud(versions.get_owner_version, versions.get_owner_version_async, db, user_id=user.id)
+    key = ("summary", user.id, version, skip, limit, after_id)
+    return await versions.cached_json(request, key, build)
 
 
 #Create list
 @app.post("/lists", response_model=schemas.List)
-def create_list(
+async def create_list(
     list: schemas.ListCreate, 
     user: UserBase = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
     ):
-    return lists.create_list(db, user_id=user.id, list=list)
+    return await run_crud(lists.create_list, lists.create_list_async, db, user_id=user.id, list=list)
 
 
-#Delete list
-@app.delete("/lists", response_model=schemas.List)
-def delete_lists(list_id: int, db: Session = Depends(get_db)):
-    return lists.delete_list(db, list_id=list_id)
+#Delete list (its tasks are deleted with it). Returns the deleted list's id and name.
+@app.delete("/lists", response_model=schemas.ListBase)
+async def delete_lists(
+    list_id: int,
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    return await run_crud(lists.delete_list, lists.delete_list_async, db, user_id=user.id, list_id=list_id)
+
+#Delete many lists at once: DELETE /lists:batch?list_id=1&list_id=2 (all or nothing,
+#at most lists.LIST_BATCH_MAX_SIZE)
+@app.delete("/lists:batch", response_model=List[schemas.ListBase])
+async def delete_many_lists(
+    list_id: List[int] = Query(),
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    return await run_crud(lists.delete_lists, lists.delete_lists_async, db, user_id=user.id, list_ids=list_id)
 
 
 #TASKS 
 
-#Get tasks from a list
-@app.get("/lists/{list_id}/tasks", response_model=List[schemas.Task])
-def read_list_tasks(list_id: int, skip: int = 0, limit: int = 20, db: Session = Depends(get_db)):
-    results = tasks.get_tasks(db, list_id=list_id, skip=skip, limit=limit)
-    if results is None:
-        raise HTTPException(status_code=404, detail="No tasks found")
-    return results
+#Get tasks from a list, in list order (ETag / If-None-Match and caching as for GET /lists)
+tasks_adapter = TypeAdapter(List[schemas.Task])
 
-#Create task
+@app.get("/lists/{list_id}/tasks", response_model=List[schemas.Task])
+async def read_list_tasks(
+        list_id: int, request: Request,
+        skip: int = 0, limit: int = 20, cursor: Optional[str] = None,
+        db: Session = Depends(get_read_session)):
+    after = tasks.list_cursor_key(list_id, cursor) if cursor else None
+
+    async def build():
+        if FAST_SERIALIZATION:
+            crud = (tasks.get_task_dicts, tasks.get_task_dicts_async)
+        else:
+            crud = (tasks.get_tasks, tasks.get_tasks_async)
+        results = await run_crud(*crud, db, list_id=list_id, skip=skip, limit=limit, after=after)
+        if results is None:
+            raise HTTPException(status_code=404, detail="No tasks found")
+        next_cursor = tasks.list_cursor(list_id, results, limit)
+        headers = {pagination.NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        if FAST_SERIALIZATION:
+            return orjson.dumps(results), headers
+        return tasks_adapter.dump_json(tasks_adapter.validate_python(results, from_attributes=True)), headers
+
+    version = await run_crud(versions.get_list_version, versions.get_list_version_async, db, list_id=list_id)
+    if version is None:
+        # no such list: nothing to version, answer as before
+        body, headers = await build()
+        return Response(body, media_type="application/json", headers=headers)
+    key = ("tasks", list_id, version, skip, limit, after)
+    return await versions.cached_json(request, key, build)
+
+#Create task (with TASK_GROUP_COMMIT_MS set, in a transaction shared with concurrent
+#calls, see app/group_commit.py)
 @app.post("/lists/{list_id}/tasks", response_model=schemas.Task)
-def create_list_task(list_id: int, task: schemas.TaskCreate, db: Session = Depends(get_db)):
-    return tasks.create_task(db, list_id=list_id, task=task)
+async def create_list_task(list_id: int, task: schemas.TaskCreate, db: Session = Depends(get_session)):
+    return await group_commit.create_task(db, list_id=list_id, task=task)
+
+#Create many tasks at once (all or nothing, at most tasks.TASK_BATCH_MAX_SIZE)
+@app.post("/lists/{list_id}/tasks:batch", response_model=List[schemas.Task])
+async def create_list_tasks(
+    list_id: int,
+    task_batch: List[schemas.TaskCreate],
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    return await run_crud(tasks.create_tasks, tasks.create_tasks_async, db,
+                          user_id=user.id, list_id=list_id, tasks=task_batch)
 
 #Delete task
-@app.delete("/lists/{list_id}/tasks", response_model=schemas.List)
-def delete_list_task(list_id: int, task_id: int, db: Session = Depends(get_db)):
-    return tasks.delete_task(db, list_id=list_id, task_id=task_id)
\ No newline at end of file
+@app.delete("/lists/{list_id}/tasks", response_model=schemas.Task)
+async def delete_list_task(list_id: int, task_id: int, db: Session = Depends(get_session)):
+    return await run_crud(tasks.delete_task, tasks.delete_task_async, db, list_id=list_id, task_id=task_id)
+
+#Move a task within its list: {"task_id": 7, "after_id": 3} puts task 7 right after
+#task 3, "after_id": null puts it first. Only the moved task's row is written.
+@app.post("/lists/{list_id}/tasks:move", response_model=schemas.Task)
+async def move_list_task(
+    list_id: int,
+    move: schemas.TaskMove,
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    return await run_crud(tasks.move_task, tasks.move_task_async, db, user_id=user.id, list_id=list_id, move=move)
+
+#Tasks of all the user's lists, e.g. every open task: GET /tasks?completed=false.
+#Filters: completed, list_id (repeat for several lists), title_prefix. sort: id,
+#title, list_id or position (list by list, in list order), "-" in front for
+#descending. Paging by cursor (X-Next-Cursor) and ETags as for GET /lists; the
+#cursor is only valid with the same sort.
+@app.get("/tasks", response_model=List[schemas.Task])
+async def read_user_tasks(
+        request: Request,
+        completed: Optional[bool] = None, list_id: Optional[List[int]] = Query(None),
+        title_prefix: Optional[str] = None, sort: str = "id",
+        limit: int = Query(20, ge=1, le=tasks.TASK_QUERY_MAX_LIMIT), cursor: Optional[str] = None,
+        user: UserBase = Depends(get_current_user),
+        db: Session = Depends(get_read_session)):
+    tasks.check_sort(sort)
+    after = tasks.sort_cursor_key(user.id, sort, cursor) if cursor else None
+    filters = {"completed": completed, "list_ids": list_id, "title_prefix": title_prefix,
+               "sort": sort, "after": after, "limit": limit}
+
+    async def build():
+        results = await run_crud(tasks.get_user_tasks, tasks.get_user_tasks_async, db, user_id=user.id, **filters)
+        next_cursor = tasks.user_tasks_cursor(user.id, sort, results, limit)
+        headers = {pagination.NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+        return orjson.dumps(results), headers
+
+    version = await run_crud(versions.get_owner_version, versions.get_owner_version_async, db, user_id=user.id)
+    key = ("user_tasks", user.id, version, completed, tuple(list_id or ()), title_prefix, sort, after, limit)
+    return await versions.cached_json(request, key, build)
+
+#Complete / uncomplete / delete many tasks in one statement, scoped to the user's lists
+@app.post("/tasks:bulk", response_model=schemas.TaskBulkResult)
+async def bulk_change_tasks(
+    change: schemas.TaskBulkChange,
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    return await run_crud(tasks.bulk_change_tasks, tasks.bulk_change_tasks_async, db,
+                          user_id=user.id, change=change)
+
+#EXPORT
+#All of the user's lists and tasks as NDJSON, streamed as it is read (app/transfer.py)
+@app.get("/export")
+async def export_data(user: UserBase = Depends(get_current_user)):
+    if database.ASYNC_MODE:
+        body = transfer.export_user_async(user.id)
+    else:
+        body = transfer.export_user(user.id)
+    return StreamingResponse(body, media_type="application/x-ndjson",
+                             headers={"Content-Disposition": 'attachment; filename="export.ndjson"'})
+
+#IMPORT
+#Lists and tasks in the NDJSON format of GET /export, optionally gzip compressed.
+#The body is parsed as it is received; lines that fail validation are skipped and
+#reported, the rest is inserted in one transaction.
+@app.post("/import", response_model=schemas.ImportResult)
+async def import_data(
+    request: Request,
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    return await transfer.import_user(db, user.id, request.stream())
+
+#SEARCH
+#Full-text search over the user's task titles and list names, best matches first (app/search.py)
+@app.get("/search", response_model=List[schemas.SearchResult])
+async def search_user_data(
+    q: str = Query(min_length=1, max_length=200),
+    skip: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100),
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_read_session)
+    ):
+    return await run_crud(search.search, search.search_async, db, user_id=user.id, q=q, skip=skip, limit=limit)
+
+
+#SYNC
+#Changes to the user's lists and tasks after revision ?since= (0 = everything),
+#including deletes, for clients that keep a local copy (app/sync.py)
+@app.get("/sync", response_model=schemas.SyncPage)
+async def sync_changes(
+    since: int = Query(0, ge=0), cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=sync.SYNC_MAX_LIMIT),
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_read_session)
+    ):
+    return await run_crud(sync.get_changes, sync.get_changes_async, db,
+                          user_id=user.id, since=since, cursor=cursor, limit=limit)
+
+#EVENTS
+#Live changes to the user's lists and tasks (app/events.py), instead of re-polling
+#GET /lists. With "Accept: text/event-stream" the answer is a Server-Sent Events
+#stream (a reconnecting client resumes from its Last-Event-ID); otherwise it is a
+#long-poll: the events after ?since=, waiting up to ?timeout= seconds for one.
+@app.get("/events", response_model=schemas.EventsPoll)
+async def read_events(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0),
+    timeout: float = Query(25, gt=0, le=60),
+    user: UserBase = Depends(get_current_user),
+    db: Session = Depends(get_session)
+    ):
+    current = await run_crud(events.get_version, events.get_version_async, db, user_id=user.id)
+    if "text/event-stream" in request.headers.get("accept", ""):
+        last_event_id = request.headers.get("last-event-id", "")
+        if since is None and last_event_id.isdigit():
+            since = int(last_event_id)
+        return StreamingResponse(events.stream(user.id, since, current), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    return await events.poll(user.id, since, current, timeout)
+
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
@@ -0,0 +1,72 @@
+#Tests run the app in process against a throwaway SQLite database, made with
+#create_all (the Alembic migrations target Postgres). DATABASE_URL may point at
+#another database, and DATABASE_ASYNC=1 runs the same tests on the async sessions.
+#The settings must be in place before the app is imported.
+
+import os
+import tempfile
+import uuid
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.sqlite"))
+os.environ.setdefault("JWT_SECRET_KEY", "test")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+from app import database
+
+
+@pytest.fixture(scope="session")
+def client():
+    database.Base.metadata.create_all(database.engine)
+    with TestClient(main.app) as client:
+        yield client
+
+
+#Authorization headers of a new user
+def sign_up(client):
+    username = "user-" + uuid.uuid4().hex[:12]
+    assert client.post("/users", json={"username": username, "password": "secret"}).status_code == 200
+    token = client.post("/users/login", json={"username": username, "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def user(client):
+    return sign_up(client)
+
+#a second user, for checks that one user cannot reach another's data
+@pytest.fixture
+def other_user(client):
+    return sign_up(client)
+
+
+#make_list(headers, tasks_per_list): a new list of that user with tasks on it, as
+#(list id, task ids)
+@pytest.fixture
+def make_list(client):
+    def make_list(headers, tasks_per_list=3):
+        list_id = client.post("/lists", json={"name": "L"}, headers=headers).json()["id"]
+        batch = [{"title": f"t{i}"} for i in range(tasks_per_list)]
+        created = client.post(f"/lists/{list_id}/tasks:batch", json=batch, headers=headers)
+        return list_id, [task["id"] for task in created.json()]
+    return make_list
+
+
+#The SQL sent to the database while the fixture is active, in order, on one line each
+@pytest.fixture
+def statements():
+    engines = [database.engine]
+    if database.ASYNC_MODE:
+        engines.append(database.async_engine.sync_engine)
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        sent.append(" ".join(statement.split()))
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    yield sent
+    for engine in engines:
+        event.remove(engine, "before_cursor_execute", record)
@@ -0,0 +1,105 @@
+#AdmissionMiddleware around a small app whose /slow route holds its slot until told
+#to finish, so the queue and its limits can be filled on purpose.
+
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from app import admission, metrics
+
+
+#the test apps' middleware registers metric lines; keep them out of the real /metrics
+@pytest.fixture(autouse=True)
+def collectors(monkeypatch):
+    monkeypatch.setattr(metrics, "collectors", list(metrics.collectors))
+
+
+def limited_app(limits, rate_limit=None):
+    release = asyncio.Event()
+
+    async def slow(request):
+        await release.wait()
+        return PlainTextResponse("slow")
+
+    async def fast(request):
+        return PlainTextResponse("fast")
+
+    app = Starlette(routes=[Route("/slow", slow), Route("/fast", fast)])
+    app.add_middleware(admission.AdmissionMiddleware, router=app.router, limits=limits, rate_limit=rate_limit,
+                       user_key=lambda headers: headers.get(b"x-user"), exempt={"GET /fast"} if not rate_limit else ())
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    return client, release
+
+
+def test_full_queue_gets_503():
+    async def run():
+        client, release = limited_app({"GET /slow": admission.RouteLimit(concurrency=1, queue=1, timeout=5)})
+        running = asyncio.ensure_future(client.get("/slow"))
+        queued = asyncio.ensure_future(client.get("/slow"))
+        await asyncio.sleep(0.05)
+        rejected = await client.get("/slow")
+        assert (await client.get("/fast")).status_code == 200  # other routes are not held up
+        release.set()
+        return rejected, await running, await queued
+
+    rejected, running, queued = asyncio.run(run())
+    assert rejected.status_code == 503
+    assert rejected.json() == {"detail": "Server busy, retry later"}
+    assert rejected.headers["retry-after"] == "5"
+    assert running.status_code == queued.status_code == 200
+
+
+def test_queue_wait_times_out_with_503():
+    async def run():
+        client, release = limited_app({"GET /slow": admission.RouteLimit(concurrency=1, queue=1, timeout=0.1)})
+        running = asyncio.ensure_future(client.get("/slow"))
+        await asyncio.sleep(0.05)
+        timed_out = await client.get("/slow")
+        release.set()
+        assert (await running).status_code == 200
+        assert (await client.get("/slow")).status_code == 200  # the slot was given back
+        return timed_out
+
+    timed_out = asyncio.run(run())
+    assert timed_out.status_code == 503
+    assert timed_out.headers["retry-after"] == "1"
+
+
+def test_rate_limit_gets_429_per_user():
+    async def run():
+        client, _ = limited_app({}, rate_limit=admission.RateLimit(rate=0.5, burst=2))
+        first = [(await client.get("/fast", headers={"x-user": "a"})).status_code for _ in range(3)]
+        other = (await client.get("/fast", headers={"x-user": "b"})).status_code
+        return first, other, await client.get("/fast", headers={"x-user": "a"})
+
+    first, other, limited = asyncio.run(run())
+    assert first == [200, 200, 429] and other == 200
+    assert limited.json() == {"detail": "Too many requests"}
+    assert limited.headers["retry-after"] == "2"
+
+
+#The bucket refills at 'rate' tokens per second, up to 'burst'
+def test_token_bucket_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission, "monotonic", lambda: now[0])
+    buckets = admission.TokenBuckets(admission.RateLimit(rate=4, burst=2))
+    buckets.take("a")
+    buckets.take("a")
+    with pytest.raises(admission.Overloaded) as exc:
+        buckets.take("a")
+    assert exc.value.status == 429 and exc.value.retry_after == 0.25
+
+    now[0] += 0.25
+    buckets.take("a")
+    with pytest.raises(admission.Overloaded):
+        buckets.take("a")
+    now[0] += 10  # long idle: back to a full bucket, not more
+    buckets.take("a")
+    buckets.take("a")
+    with pytest.raises(admission.Overloaded):
+        buckets.take("a")
+    assert buckets.limited == 3
@@ -0,0 +1,25 @@
+import time
+
+from sqlalchemy import update
+
+from app import database, deps, models
+
+
+def user_id(headers):
+    return int(deps.decode_token(headers["Authorization"].split()[1]).sub.split(":")[0])
+
+
+#A user disabled outside the ORM (a Core UPDATE, another worker) is refused once the
+#cached copy is older than AUTH_USER_CACHE_TTL
+def test_disabled_user_is_refused_after_the_user_cache_ttl(client, user, monkeypatch):
+    monkeypatch.setattr(deps.user_cache, "ttl", 0.2)
+    deps.user_cache.delete(user_id(user))
+    assert client.get("/lists", headers=user).status_code == 200
+
+    with database.SessionLocal() as db:
+        db.execute(update(models.User).where(models.User.id == user_id(user)).values(disabled=True))
+        db.commit()
+    assert client.get("/lists", headers=user).status_code == 200  # still cached
+    time.sleep(0.3)
+    assert client.get("/lists", headers=user).status_code == 401
+
@@ -0,0 +1,44 @@
+import pytest
+
+from app import counts, tasks
+
+
+def titles(client, headers, list_id):
+    return [task["title"] for task in client.get(f"/lists/{list_id}/tasks?limit=100", headers=headers).json()]
+
+
+def test_batch_creates_tasks_in_order(client, user, make_list):
+    list_id, _ = make_list(user, tasks_per_list=1)
+    response = client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "a"}, {"title": "b"}], headers=user)
+    assert response.status_code == 200
+    assert [task["title"] for task in response.json()] == ["a", "b"]
+    assert titles(client, user, list_id) == ["t0", "a", "b"]
+
+
+def test_batch_size_is_limited(client, user, make_list, monkeypatch):
+    monkeypatch.setattr(tasks, "TASK_BATCH_MAX_SIZE", 3)
+    list_id, _ = make_list(user, tasks_per_list=0)
+    response = client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "x"}] * 4, headers=user)
+    assert response.status_code == 422
+    assert response.json()["detail"] == "At most 3 tasks per batch"
+    assert titles(client, user, list_id) == []
+    assert client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "x"}] * 3, headers=user).status_code == 200
+
+
+#One invalid task, a list of another user, or a failure after the insert: nothing is created
+def test_batch_is_all_or_nothing(client, user, other_user, make_list, monkeypatch):
+    list_id, _ = make_list(user, tasks_per_list=0)
+    response = client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "a"}, {"name": "b"}], headers=user)
+    assert response.status_code == 422
+    assert client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "a"}], headers=other_user).status_code == 404
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("counts")
+    monkeypatch.setattr(counts, "adjust", fail)
+    monkeypatch.setattr(counts, "adjust_async", fail)
+    with pytest.raises(RuntimeError):
+        client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "a"}, {"title": "b"}], headers=user)
+    monkeypatch.undo()
+    assert titles(client, user, list_id) == []
+    summary = next(row for row in client.get("/lists/summary", headers=user).json() if row["id"] == list_id)
+    assert summary["task_count"] == 0
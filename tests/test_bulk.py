@@ -0,0 +1,47 @@
+def summary(client, headers, list_id):
+    return next(row for row in client.get("/lists/summary", headers=headers).json() if row["id"] == list_id)
+
+
+def bulk(client, headers, **change):
+    return client.post("/tasks:bulk", json=change, headers=headers).json()
+
+
+#Another user's task ids and lists are not theirs to change
+def test_bulk_change_is_scoped_to_the_users_lists(client, user, other_user, make_list):
+    list_id, task_ids = make_list(user)
+    assert bulk(client, other_user, action="complete", task_ids=task_ids) == {"affected": 0}
+    assert bulk(client, other_user, action="delete", list_id=list_id) == {"affected": 0}
+    assert summary(client, user, list_id) == {"id": list_id, "name": "L", "task_count": 3, "completed_count": 0}
+
+
+#Only the tasks a change flips count as affected, and the counts follow every change
+def test_bulk_change_keeps_counts(client, user, make_list):
+    list_id, task_ids = make_list(user, tasks_per_list=4)
+    assert bulk(client, user, action="complete", task_ids=task_ids[:2]) == {"affected": 2}
+    assert bulk(client, user, action="complete", list_id=list_id) == {"affected": 2}
+    assert bulk(client, user, action="complete", list_id=list_id) == {"affected": 0}
+    assert summary(client, user, list_id)["completed_count"] == 4
+
+    assert bulk(client, user, action="uncomplete", task_ids=task_ids[:1]) == {"affected": 1}
+    assert bulk(client, user, action="delete", list_id=list_id, completed=True) == {"affected": 3}
+    assert summary(client, user, list_id) == {"id": list_id, "name": "L", "task_count": 1, "completed_count": 0}
+
+
+#The counts are adjusted from the changed rows, not recounted from the whole list
+def test_bulk_change_does_not_recount(client, user, make_list, statements):
+    list_id, _ = make_list(user)
+    statements.clear()
+    assert bulk(client, user, action="delete", list_id=list_id) == {"affected": 3}
+    assert not [statement for statement in statements if "count(tasks.id)" in statement]
+
+
+#A bulk delete leaves a tombstone per task for GET /sync
+def test_bulk_delete_leaves_tombstones(client, user, make_list):
+    list_id, task_ids = make_list(user)
+    since = client.get("/sync?since=0", headers=user).json()["revision"]
+    assert bulk(client, user, action="delete", task_ids=task_ids[:2]) == {"affected": 2}
+
+    page = client.get(f"/sync?since={since}", headers=user).json()
+    assert page["revision"] == since + 1
+    assert sorted((change["id"], change["deleted"], change["list_id"]) for change in page["changes"]) == [
+        (task_ids[0], True, list_id), (task_ids[1], True, list_id)]
@@ -0,0 +1,47 @@
+from app import check_counts, database
+
+
+def counts(client, headers, list_id):
+    row = next(row for row in client.get("/lists/summary", headers=headers).json() if row["id"] == list_id)
+    return row["task_count"], row["completed_count"]
+
+
+#No list's stored counts differ from a count of its tasks
+def assert_consistent():
+    with database.engine.connect() as conn:
+        assert conn.execute(check_counts.mismatch_query()).all() == []
+
+
+def test_summary_counts_follow_writes(client, user, make_list):
+    list_id, task_ids = make_list(user, tasks_per_list=2)
+    assert counts(client, user, list_id) == (2, 0)
+
+    created = client.post(f"/lists/{list_id}/tasks", json={"title": "x"}, headers=user).json()
+    client.post("/tasks:bulk", json={"action": "complete", "task_ids": [created["id"], task_ids[0]]}, headers=user)
+    assert counts(client, user, list_id) == (3, 2)
+
+    #a move changes the order only
+    client.post(f"/lists/{list_id}/tasks:move", json={"task_id": created["id"], "after_id": None}, headers=user)
+    assert counts(client, user, list_id) == (3, 2)
+
+    client.delete(f"/lists/{list_id}/tasks", params={"task_id": created["id"]}, headers=user)
+    assert counts(client, user, list_id) == (2, 1)
+    client.delete(f"/lists/{list_id}/tasks", params={"task_id": task_ids[1]}, headers=user)
+    assert counts(client, user, list_id) == (1, 1)
+    assert_consistent()
+
+
+def test_new_and_imported_lists_have_counts(client, user):
+    list_id = client.post("/lists", json={"name": "empty"}, headers=user).json()["id"]
+    assert counts(client, user, list_id) == (0, 0)
+
+    body = b"".join([b'{"type": "list", "id": 1, "name": "imported"}\n',
+                     b'{"type": "task", "title": "a", "completed": true, "list_id": 1}\n',
+                     b'{"type": "task", "title": "b", "completed": false, "list_id": 1}\n'])
+    client.post("/import", content=body, headers=user)
+    [imported] = [row["id"] for row in client.get("/lists/summary", headers=user).json() if row["name"] == "imported"]
+    assert counts(client, user, imported) == (2, 1)
+
+    client.delete("/lists", params={"list_id": imported}, headers=user)
+    assert [row["id"] for row in client.get("/lists/summary", headers=user).json()] == [list_id]
+    assert_consistent()
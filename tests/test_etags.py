@@ -0,0 +1,38 @@
+def get(client, path, headers, etag=None):
+    return client.get(path, headers={**headers, **({"If-None-Match": etag} if etag else {})})
+
+
+def test_lists_not_modified_until_a_write(client, user, make_list):
+    make_list(user)
+    first = get(client, "/lists", user)
+    etag = first.headers["ETag"]
+    response = get(client, "/lists", user, etag)
+    assert response.status_code == 304
+    assert response.content == b"" and response.headers["ETag"] == etag
+    assert get(client, "/lists", user, f'"other", {etag.removeprefix("W/")}').status_code == 304
+
+    #another page or shape of the same lists is another response
+    assert get(client, "/lists?limit=1", user, etag).status_code == 200
+
+    make_list(user)
+    response = get(client, "/lists", user, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == len(first.json()) + 1
+
+
+#A list's tasks keep their ETag while another list of the same user changes
+def test_tasks_etag_follows_its_own_list(client, user, make_list):
+    list_id, task_ids = make_list(user)
+    other_list_id, _ = make_list(user)
+    path = f"/lists/{list_id}/tasks"
+    etag = get(client, path, user).headers["ETag"]
+
+    client.post(f"/lists/{other_list_id}/tasks", json={"title": "x"}, headers=user)
+    assert get(client, path, user, etag).status_code == 304
+
+    client.delete(f"/lists/{list_id}/tasks", params={"task_id": task_ids[0]}, headers=user)
+    response = get(client, path, user, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [task["id"] for task in response.json()] == task_ids[1:]
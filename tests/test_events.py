@@ -0,0 +1,31 @@
+from app import events
+
+
+def deliver(broker, user_id, version, count):
+    broker.deliver([[user_id, {"type": "task.created", "version": version, "data": {"id": i}}]
+                    for i in range(count)])
+
+
+#A batch create records more events than the buffer keeps, all with one version:
+#resuming from before it must start over rather than get only the last ones
+def test_since_resets_when_a_version_was_partly_evicted():
+    broker = events.Broker()
+    deliver(broker, 1, 1, 1)
+    deliver(broker, 1, 2, events.EVENTS_BUFFER_SIZE + 50)
+    assert broker.since(1, 1, 2) == ([], True)
+    assert broker.since(1, 0, 2) == ([], True)
+    assert broker.since(1, 2, 2) == ([], False)
+
+    deliver(broker, 1, 3, 1)
+    replayed, reset = broker.since(1, 2, 3)
+    assert [item["version"] for item in replayed] == [3] and not reset
+
+
+def test_since_replays_the_buffer():
+    broker = events.Broker()
+    deliver(broker, 1, 1, 2)
+    deliver(broker, 1, 2, 3)
+    replayed, reset = broker.since(1, 0, 2)
+    assert [item["version"] for item in replayed] == [1, 1, 2, 2, 2] and not reset
+    assert broker.since(1, 2, 3) == ([], True)  # version 3 never reached this process
+    assert broker.since(2, 0, 1) == ([], True)  # nothing buffered for the user
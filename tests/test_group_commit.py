@@ -0,0 +1,71 @@
+#Group commit for POST /lists/{list_id}/tasks (app/group_commit.py), with the
+#requests sent from threads so that they arrive within one window.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import counts, group_commit, tasks
+
+
+@pytest.fixture
+def grouped(monkeypatch):
+    def start(window=0.2, max_size=100):
+        creates = group_commit.GroupCommit(tasks.create_tasks_grouped, tasks.create_tasks_grouped_async,
+                                           window=window, max_size=max_size)
+        monkeypatch.setattr(group_commit, "task_creates", creates)
+        return creates
+    return start
+
+
+def post_all(client, headers, requests):
+    def post(request):
+        list_id, title = request
+        return client.post(f"/lists/{list_id}/tasks", json={"title": title}, headers=headers)
+    with ThreadPoolExecutor(len(requests)) as pool:
+        futures = [pool.submit(post, request) for request in requests]
+    return [future.exception() or future.result() for future in futures]
+
+
+def titles(client, headers, list_id):
+    return sorted(task["title"] for task in client.get(f"/lists/{list_id}/tasks?limit=100", headers=headers).json())
+
+
+def test_concurrent_creates_share_a_transaction(client, user, make_list, grouped):
+    creates = grouped()
+    first, _ = make_list(user, tasks_per_list=0)
+    second, _ = make_list(user, tasks_per_list=0)
+    responses = post_all(client, user, [(first, "a"), (second, "b"), (first, "c"), (second, "d")])
+    assert [response.status_code for response in responses] == [200] * 4
+    assert creates.stats() == {"groups": 1, "items": 4, "largest": 4, "failed": 0, "pending": 0}
+    assert [response.json()["list_id"] for response in responses] == [first, second, first, second]
+    assert titles(client, user, first) == ["a", "c"] and titles(client, user, second) == ["b", "d"]
+    summary = {row["id"]: row["task_count"] for row in client.get("/lists/summary", headers=user).json()}
+    assert summary == {first: 2, second: 2}
+
+
+def test_groups_are_capped_at_max_size(client, user, make_list, grouped):
+    creates = grouped(window=0.5, max_size=2)
+    list_id, _ = make_list(user, tasks_per_list=0)
+    responses = post_all(client, user, [(list_id, str(i)) for i in range(5)])
+    assert [response.status_code for response in responses] == [200] * 5
+    assert creates.largest == 2 and creates.groups >= 3
+    assert titles(client, user, list_id) == ["0", "1", "2", "3", "4"]
+
+
+#A missing list fails only its own call; an error of the transaction fails them all
+def test_group_errors(client, user, make_list, grouped, monkeypatch):
+    creates = grouped()
+    list_id, _ = make_list(user, tasks_per_list=0)
+    responses = post_all(client, user, [(list_id, "a"), (10 ** 9, "b"), (list_id, "c")])
+    assert [response.status_code for response in responses] == [200, 404, 200]
+    assert creates.groups == 1 and creates.failed == 0
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("database down")
+    monkeypatch.setattr(counts, "adjust", fail)
+    monkeypatch.setattr(counts, "adjust_async", fail)
+    responses = post_all(client, user, [(list_id, "d"), (list_id, "e")])
+    assert [type(response) for response in responses] == [RuntimeError, RuntimeError]
+    assert creates.groups == 2 and creates.failed == 1
+    assert titles(client, user, list_id) == ["a", "c"]
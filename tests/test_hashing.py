@@ -0,0 +1,44 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+from app import hashing
+
+
+#A pool process that dies breaks its executor: the next call gets a new one
+def test_pool_recovers_from_a_dead_worker():
+    pool = hashing.HashPool(workers=1, queue_size=4)
+
+    async def run():
+        await pool.warm()
+        for pid in list(pool.start()._processes):
+            os.kill(pid, signal.SIGKILL)
+        hashed = await pool.run(hashing._hash, "secret")
+        return await pool.run(hashing._verify_and_update, "secret", hashed)
+
+    try:
+        verified, _ = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert verified
+    assert pool.stats()["restarts"] == 1
+
+
+#A call that raises counts as failed, not completed; both get a latency sample
+def test_pool_counts_failures():
+    pool = hashing.HashPool(workers=1, queue_size=4)
+
+    async def run():
+        await pool.run(hashing._hash, "secret")
+        with pytest.raises(ValueError):
+            await pool.run(hashing._verify_and_update, "secret", "not a bcrypt hash")
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert pool.stats()["completed"] == 1
+    assert pool.stats()["failed"] == 1
+    assert "hash_pool_latency_seconds_count 2" in pool.latency.render()
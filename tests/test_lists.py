@@ -0,0 +1,25 @@
+#GET /lists reads a page in a fixed number of statements whatever the number of
+#lists and tasks on it: the owner's version, the lists (with their owner joined in),
+#and all of the page's tasks in one more query when they are included.
+
+import pytest
+
+import main
+from app import versions
+
+SHAPES = [("", 3), ("?include=", 2), ("?include=owner", 2), ("?include=tasks", 3),
+          ("?tasks_limit=2", 3), ("?include=tasks&tasks_limit=2", 3)]
+
+
+@pytest.mark.parametrize("fast", [False, True], ids=["orm", "fast"])
+@pytest.mark.parametrize("query, expected", SHAPES)
+def test_get_lists_statement_count(client, user, statements, make_list, monkeypatch, query, expected, fast):
+    monkeypatch.setattr(main, "FAST_SERIALIZATION", fast)
+    for lists in (1, 5):
+        while len(client.get("/lists?include=", headers=user).json()) < lists:
+            make_list(user)
+        versions.response_cache.clear()  # the page has to be read, not served from the cache
+        statements.clear()
+        response = client.get("/lists" + query, headers=user)
+        assert response.status_code == 200 and len(response.json()) == lists
+        assert len(statements) == expected, statements
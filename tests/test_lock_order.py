@@ -0,0 +1,114 @@
+#Every write takes its row locks in one order: the lists it changes, then their
+#owner, and only then task rows (app/versions.py). SQLite has no row locks, so the
+#order is checked on the statements sent; FOR UPDATE is left out by SQLite, the
+#locking SELECTs are still there.
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from app import database, schemas, tasks
+
+LOCKS = [
+    ("list", re.compile(r"UPDATE lists |SELECT lists\.id, lists\.owner_id FROM lists ")),
+    ("owner", re.compile(r"UPDATE users |SELECT users\.id FROM users .*ORDER BY users\.id")),
+    ("task", re.compile(r"(INSERT INTO|UPDATE|DELETE FROM) tasks |DELETE FROM lists ")),
+]
+
+def lock_kinds(statements):
+    kinds = []
+    for statement in statements:
+        kinds.extend(kind for kind, pattern in LOCKS if pattern.match(statement))
+    return kinds
+
+def assert_lock_order(statements):
+    kinds = lock_kinds(statements)
+    assert "task" in kinds, statements
+    assert kinds.index("list") < kinds.index("owner") < kinds.index("task"), kinds
+
+
+def test_create_task(client, user, statements, make_list):
+    list_id, _ = make_list(user)
+    statements.clear()
+    assert client.post(f"/lists/{list_id}/tasks", json={"title": "new"}, headers=user).status_code == 200
+    assert_lock_order(statements)
+
+def test_create_tasks(client, user, statements, make_list):
+    list_id, _ = make_list(user)
+    statements.clear()
+    assert client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": "a"}, {"title": "b"}],
+                       headers=user).status_code == 200
+    assert_lock_order(statements)
+
+def test_create_tasks_grouped(client, user, statements, make_list):
+    first, _ = make_list(user)
+    second, _ = make_list(user)
+    statements.clear()
+    items = [(second, schemas.TaskCreate(title="a")), (first, schemas.TaskCreate(title="b"))]
+    with database.SessionLocal() as db:
+        results = tasks.create_tasks_grouped(db, items)
+    assert [task["list_id"] for task in results] == [second, first]
+    assert_lock_order(statements)
+
+def test_move_task(client, user, statements, make_list):
+    list_id, task_ids = make_list(user)
+    statements.clear()
+    move = {"task_id": task_ids[0], "after_id": task_ids[-1]}
+    assert client.post(f"/lists/{list_id}/tasks:move", json=move, headers=user).status_code == 200
+    assert_lock_order(statements)
+
+def test_delete_task(client, user, statements, make_list):
+    list_id, task_ids = make_list(user)
+    statements.clear()
+    assert client.delete(f"/lists/{list_id}/tasks?task_id={task_ids[0]}").status_code == 200
+    assert_lock_order(statements)
+    assert client.delete(f"/lists/{list_id}/tasks?task_id={task_ids[0]}").status_code == 404
+
+def test_bulk_change(client, user, statements, make_list):
+    first, first_ids = make_list(user)
+    second, second_ids = make_list(user)
+    statements.clear()
+    change = {"action": "complete", "task_ids": [first_ids[0], second_ids[0]]}
+    assert client.post("/tasks:bulk", json=change, headers=user).json() == {"affected": 2}
+    assert_lock_order(statements)
+    statements.clear()
+    assert client.post("/tasks:bulk", json={"action": "delete", "list_id": first}, headers=user).json() == {
+        "affected": 3}
+    assert_lock_order(statements)
+
+def test_delete_lists(client, user, statements, make_list):
+    first, _ = make_list(user)
+    second, _ = make_list(user)
+    statements.clear()
+    assert client.delete(f"/lists:batch?list_id={first}&list_id={second}", headers=user).status_code == 200
+    assert_lock_order(statements)
+
+
+#Bulk changes across all of a user's lists while tasks are created and moved on
+#them: every request succeeds and the lists' counts match their tasks afterwards
+def test_concurrent_bulk_change_create_and_move(client, user, make_list):
+    lists = [make_list(user, tasks_per_list=10) for _ in range(3)]
+
+    def bulk_change(i):
+        action = "complete" if i % 2 else "uncomplete"
+        task_ids = [task_ids[i % len(task_ids)] for _, task_ids in lists]
+        return client.post("/tasks:bulk", json={"action": action, "task_ids": task_ids}, headers=user)
+
+    def create(i):
+        list_id, _ = lists[i % len(lists)]
+        return client.post(f"/lists/{list_id}/tasks", json={"title": f"c{i}"}, headers=user)
+
+    def move(i):
+        list_id, task_ids = lists[i % len(lists)]
+        move = {"task_id": task_ids[i % len(task_ids)], "after_id": task_ids[(i + 3) % len(task_ids)]}
+        return client.post(f"/lists/{list_id}/tasks:move", json=move, headers=user)
+
+    calls = [(write, i) for i in range(21) for write in (bulk_change, create, move)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda call: call[0](call[1]), calls))
+    assert [response.status_code for response in responses] == [200] * len(calls)
+
+    all_tasks = client.get("/tasks?limit=500", headers=user).json()
+    for summary in client.get("/lists/summary", headers=user).json():
+        listed = [task for task in all_tasks if task["list_id"] == summary["id"]]
+        assert summary["task_count"] == len(listed) == 10 + 21 // len(lists)
+        assert summary["completed_count"] == sum(task["completed"] for task in listed)
@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app import database, metrics
+
+
+#A failing statement is not counted and leaves nothing on the connection that would
+#skew the timing of the next ones
+def test_request_stats_skip_failed_statements():
+    stats = metrics.RequestStats()
+    token = metrics.request_stats.set(stats)
+    try:
+        with database.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            with pytest.raises(DBAPIError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            conn.rollback()  # Postgres refuses anything else in a failed transaction
+            conn.execute(text("SELECT 2"))
+            assert "query_started" not in conn.info
+    finally:
+        metrics.request_stats.reset(token)
+    assert stats.statements == 2
+    assert 0 < stats.db_time < 1
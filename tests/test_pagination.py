@@ -0,0 +1,46 @@
+import base64
+import json
+
+from app import pagination
+
+
+#Every page, in order, following X-Next-Cursor until there is none
+def pages(client, headers, path, limit):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(path, params=params, headers=headers)
+        assert response.status_code == 200
+        ids.append([row["id"] for row in response.json()])
+        cursor = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return ids
+
+
+def test_list_cursor_round_trip(client, user, make_list):
+    list_ids = [make_list(user, tasks_per_list=0)[0] for _ in range(5)]
+    assert pages(client, user, "/lists?include=", 2) == [list_ids[:2], list_ids[2:4], list_ids[4:]]
+
+
+#A full last page still gets a cursor; the page after it is empty
+def test_task_cursor_round_trip(client, user, make_list):
+    list_id, task_ids = make_list(user, tasks_per_list=4)
+    assert pages(client, user, f"/lists/{list_id}/tasks", 2) == [task_ids[:2], task_ids[2:], []]
+
+
+def test_tampered_cursor_is_rejected(client, user, other_user, make_list):
+    list_id, _ = make_list(user)
+    make_list(user)
+    cursor = client.get("/lists?include=&limit=1", headers=user).headers[pagination.NEXT_CURSOR_HEADER]
+    scope, last_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    forged = pagination.encode_cursor(scope + 1, last_id)
+    for headers, cursor in [(user, "not-a-cursor"), (user, cursor[:-2]), (user, forged), (other_user, cursor)]:
+        response = client.get("/lists", params={"cursor": cursor}, headers=headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+    #a list's cursor is not a task cursor, nor good for another list
+    task_cursor = client.get(f"/lists/{list_id}/tasks?limit=1", headers=user).headers[pagination.NEXT_CURSOR_HEADER]
+    other_list_id, _ = make_list(user)
+    for path, cursor in [(f"/lists/{list_id}/tasks", cursor), (f"/lists/{other_list_id}/tasks", task_cursor)]:
+        assert client.get(path, params={"cursor": cursor}, headers=user).status_code == 400
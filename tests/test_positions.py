@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import update
+
+from app import database, models, positions
+
+
+def order(client, headers, list_id):
+    return [(task["id"], task["position"]) for task in
+            client.get(f"/lists/{list_id}/tasks?limit=100", headers=headers).json()]
+
+
+def move(client, headers, list_id, task_id, after_id):
+    response = client.post(f"/lists/{list_id}/tasks:move", json={"task_id": task_id, "after_id": after_id},
+                           headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+#Keys squeezed into the same gap, at the front and at the end stay in order
+@pytest.mark.parametrize("gap", ["middle", "front", "end"])
+def test_keys_stay_ordered(gap):
+    low, high = positions.keys_after(None, 2)
+    keys = [low, high]
+    for _ in range(500):
+        if gap == "middle":
+            keys.insert(1, positions.key_between(keys[0], keys[1]))
+        elif gap == "front":
+            keys.insert(0, positions.key_between(None, keys[0]))
+        else:
+            keys.append(positions.key_between(keys[-1], None))
+    assert keys == sorted(keys) and len(set(keys)) == len(keys)
+    assert all(positions.split_key(key) for key in keys)
+
+
+#Moves into one spot over and over keep the list in order, and the long keys they make
+#get the list renumbered by the rebalancer, in the same order
+def test_moves_into_one_spot_and_rebalance(client, user, make_list, monkeypatch):
+    monkeypatch.setattr(positions, "POSITION_MAX_LENGTH", 4)
+    rebalancer = positions.Rebalancer(delay=0)
+    monkeypatch.setattr(positions, "rebalancer", rebalancer)
+    list_id, task_ids = make_list(user, tasks_per_list=40)
+    expected = list(task_ids)
+    for _ in range(39):
+        moved = expected.pop()
+        expected.insert(1, moved)  # always right after the first task
+        move(client, user, list_id, moved, expected[0])
+    tasks = order(client, user, list_id)
+    assert [task_id for task_id, _ in tasks] == expected
+    assert max(len(position) for _, position in tasks) > 4
+    assert rebalancer.pending == {list_id}
+
+    since = client.get("/sync?since=0", headers=user).json()["revision"]
+    with database.SessionLocal() as db:
+        positions.rebalance(db, list_id)
+    tasks = order(client, user, list_id)
+    assert [task_id for task_id, _ in tasks] == expected
+    assert [position for _, position in tasks] == positions.keys_after(None, 40)
+    #GET /sync hands out the new keys
+    changes = client.get(f"/sync?since={since}", headers=user).json()["changes"]
+    assert sorted((change["id"], change["position"]) for change in changes) == sorted(tasks)
+
+
+#Rows that share a key (from before positions existed) are renumbered by the first
+#move between two of them
+def test_move_between_equal_keys(client, user, make_list):
+    list_id, task_ids = make_list(user, tasks_per_list=3)
+    with database.engine.begin() as conn:
+        conn.execute(update(models.Task).where(models.Task.list_id == list_id).values(position=positions.FIRST_KEY))
+    move(client, user, list_id, task_ids[2], task_ids[0])
+    tasks = order(client, user, list_id)
+    assert [task_id for task_id, _ in tasks] == [task_ids[0], task_ids[2], task_ids[1]]
+    assert len({position for _, position in tasks}) == 3
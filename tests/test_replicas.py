@@ -0,0 +1,49 @@
+import itertools
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import database, versions
+
+
+#An empty database standing in for a replica, and the SQL sent to it
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    url = "sqlite:///" + str(tmp_path / "replica.sqlite")
+    database.Base.metadata.create_all(create_engine(url))
+    if database.ASYNC_MODE:
+        engine = database.configure_sqlite(create_async_engine(database.get_async_url(url)))
+        sync_engine = engine.sync_engine
+    else:
+        engine = sync_engine = database.configure_sqlite(create_engine(url))
+    monkeypatch.setattr(database, "replica_engines", [engine])
+    monkeypatch.setattr(database, "_next_replica", itertools.cycle([engine]))
+    versions.response_cache.clear()
+    sent = []
+    event.listen(sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: sent.append(statement))
+    yield sent
+    sync_engine.dispose()
+
+
+def test_reads_go_to_the_replica(client, user, make_list, replica):
+    list_id, _ = make_list(user)
+    assert replica == []  # the writes went to the primary
+    assert client.get("/lists", headers=user).json() == []  # the replica has not caught up
+    assert client.get("/lists/summary", headers=user).json() == []
+    assert client.get(f"/lists/{list_id}/tasks", headers=user).json() == []
+    assert len(replica) >= 3
+
+    #a client that must see its own write asks for the primary
+    replica.clear()
+    lists = client.get("/lists", headers={**user, database.READ_PRIMARY_HEADER: "1"}).json()
+    assert [row["id"] for row in lists] == [list_id]
+    assert replica == []
+
+
+def test_writes_go_to_the_primary(client, user, make_list, replica):
+    list_id, task_ids = make_list(user)
+    client.post(f"/lists/{list_id}/tasks", json={"title": "x"}, headers=user)
+    client.post("/tasks:bulk", json={"action": "complete", "task_ids": task_ids}, headers=user)
+    client.delete("/lists", params={"list_id": list_id}, headers=user)
+    assert replica == []
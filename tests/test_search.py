@@ -0,0 +1,50 @@
+from sqlalchemy import update
+
+from app import database, models
+
+
+def search(client, headers, q):
+    response = client.get("/search", params={"q": q}, headers=headers)
+    assert response.status_code == 200
+    return [(row["type"], row["text"]) for row in response.json()]
+
+
+def new_list(client, headers, name, titles):
+    list_id = client.post("/lists", json={"name": name}, headers=headers).json()["id"]
+    created = client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": title} for title in titles], headers=headers)
+    return list_id, [task["id"] for task in created.json()]
+
+
+def test_search_finds_tasks_and_lists(client, user):
+    new_list(client, user, "pantry", ["buy kohlrabi", "wash dishes"])
+    assert search(client, user, "kohlrabi") == [("task", "buy kohlrabi")]
+    assert search(client, user, "pantry") == [("list", "pantry")]
+
+
+#Another user's matching tasks and lists are not in the results
+def test_search_is_scoped_to_the_users_lists(client, user, other_user):
+    new_list(client, other_user, "rutabaga", ["rutabaga soup"])
+    assert search(client, user, "rutabaga") == []
+    assert sorted(search(client, other_user, "rutabaga")) == [("list", "rutabaga"), ("task", "rutabaga soup")]
+
+
+#Best match first: a title with the word three times beats one with it once
+def test_search_ranks_results(client, user):
+    new_list(client, user, "L", ["parsnip and carrot", "parsnip parsnip parsnip"])
+    assert search(client, user, "parsnip") == [("task", "parsnip parsnip parsnip"), ("task", "parsnip and carrot")]
+
+
+#The index follows title changes and deletes, and a list's tasks go with the list
+def test_search_index_follows_writes(client, user):
+    list_id, task_ids = new_list(client, user, "celeriac", ["celeriac mash", "roast celeriac"])
+    with database.engine.begin() as conn:  # no API renames a task; the index is kept by the database
+        conn.execute(update(models.Task).where(models.Task.id == task_ids[0]).values(title="fennel mash"))
+    assert sorted(search(client, user, "celeriac")) == [("list", "celeriac"), ("task", "roast celeriac")]
+    assert search(client, user, "fennel") == [("task", "fennel mash")]
+
+    assert client.delete(f"/lists/{list_id}/tasks", params={"task_id": task_ids[1]}, headers=user).status_code == 200
+    assert search(client, user, "celeriac") == [("list", "celeriac")]
+
+    assert client.delete("/lists", params={"list_id": list_id}, headers=user).status_code == 200
+    assert search(client, user, "celeriac") == []
+    assert search(client, user, "fennel") == []
@@ -0,0 +1,50 @@
+#The serialization fast path (FAST_SERIALIZATION) must give byte-identical bodies and
+#the same cursors as the default ORM + Pydantic path, for every shape of the reads.
+
+import pytest
+
+import main
+from app import pagination, versions
+
+#names with characters an encoder may escape differently
+AWKWARD_NAMES = ['quote " backslash \\ slash /', "control \x01\x1f\t\n", "unicode é ☃ 😀  "]
+
+LIST_QUERIES = ["", "?include=", "?include=owner", "?include=tasks", "?tasks_limit=2",
+                "?include=tasks&tasks_limit=2", "?limit=2", "?limit=0"]
+
+
+def both_paths(client, headers, path, monkeypatch):
+    responses = []
+    for fast in (False, True):
+        monkeypatch.setattr(main, "FAST_SERIALIZATION", fast)
+        versions.response_cache.clear()
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200
+        responses.append((response.content, response.headers.get(pagination.NEXT_CURSOR_HEADER)))
+    return responses
+
+
+@pytest.fixture
+def awkward_user(client, user, make_list):
+    for name in AWKWARD_NAMES:
+        list_id = client.post("/lists", json={"name": name}, headers=user).json()["id"]
+        client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": title} for title in AWKWARD_NAMES], headers=user)
+    make_list(user, tasks_per_list=0)
+    client.post("/tasks:bulk", json={"action": "complete", "list_id": list_id}, headers=user)
+    return user, list_id
+
+
+@pytest.mark.parametrize("query", LIST_QUERIES)
+def test_lists_fast_path_is_byte_identical(client, awkward_user, monkeypatch, query):
+    user, _ = awkward_user
+    default, fast = both_paths(client, user, "/lists" + query, monkeypatch)
+    assert default == fast
+
+
+def test_tasks_fast_path_is_byte_identical(client, awkward_user, monkeypatch):
+    user, list_id = awkward_user
+    default, fast = both_paths(client, user, f"/lists/{list_id}/tasks?limit=2", monkeypatch)
+    assert default == fast
+    assert default[1] is not None
+    default, fast = both_paths(client, user, f"/lists/{list_id}/tasks?limit=2&cursor={default[1]}", monkeypatch)
+    assert default == fast
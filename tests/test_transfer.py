@@ -0,0 +1,92 @@
+import gzip
+import json
+
+from app import transfer
+
+
+def ndjson(*rows):
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+BODY = ndjson({"type": "list", "id": 1, "name": "imported"},
+              {"type": "task", "title": "a", "completed": False, "list_id": 1},
+              {"type": "task", "title": "b", "completed": True, "list_id": 1})
+
+
+def test_import_gets_the_revision_of_its_commit(client, user):
+    before = client.get("/sync?since=0", headers=user).json()["revision"]
+    response = client.post("/import", content=gzip.compress(BODY), headers=user)
+    assert response.json() == {"lists": 1, "tasks": 2, "error_count": 0, "errors": []}
+
+    page = client.get(f"/sync?since={before}", headers=user).json()
+    assert page["revision"] == before + 1
+    assert sorted(change["type"] for change in page["changes"]) == ["list", "task", "task"]
+    assert {change["revision"] for change in page["changes"]} == {before + 1}
+
+
+#Rows are written once, with their revision: the owner is bumped first, and only once
+def test_import_writes_rows_once(client, user, statements):
+    assert client.post("/import", content=BODY, headers=user).json()["tasks"] == 2
+    writes = [" ".join(statement.split()[:3]) for statement in statements
+              if statement.startswith(("INSERT", "UPDATE", "DELETE"))]
+    assert writes[0] == "UPDATE users SET"
+    assert writes.count("UPDATE users SET") == 1
+    assert "UPDATE tasks SET" not in writes
+
+
+def test_truncated_gzip_is_rejected(client, user):
+    body = gzip.compress(BODY)
+    response = client.post("/import", content=body[:-8], headers=user)  # without the gzip trailer
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Truncated gzip body"
+    assert client.get("/lists?include=", headers=user).json() == []
+
+
+#cat a.gz b.gz: every member is imported, not only the first
+def test_multi_member_gzip_is_imported_whole(client, user):
+    second = ndjson({"type": "list", "id": 2, "name": "second"},
+                    {"type": "task", "title": "c", "completed": False, "list_id": 2})
+    body = gzip.compress(BODY) + gzip.compress(second) + b"\0" * 4
+    response = client.post("/import", content=body, headers=user)
+    assert response.json() == {"lists": 2, "tasks": 3, "error_count": 0, "errors": []}
+    assert [row["name"] for row in client.get("/lists?include=", headers=user).json()] == ["imported", "second"]
+
+    response = client.post("/import", content=gzip.compress(BODY) + b"not gzip", headers=user)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid gzip body"
+
+
+def export(client, headers):
+    response = client.get("/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.text == "" or response.text.endswith("\n")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+#Each list line comes before its tasks, in list order; a list without tasks is there
+#too. A small batch size makes lists span batches.
+def test_export_shape(client, user, make_list, monkeypatch):
+    monkeypatch.setattr(transfer, "EXPORT_BATCH_SIZE", 2)
+    list_id, task_ids = make_list(user)
+    empty_id, _ = make_list(user, tasks_per_list=0)
+    client.post(f"/lists/{list_id}/tasks:move", json={"task_id": task_ids[2], "after_id": None}, headers=user)
+    assert export(client, user) == [
+        {"type": "list", "id": list_id, "name": "L"},
+        *[{"type": "task", "id": task_id, "title": f"t{i}", "completed": False, "list_id": list_id}
+          for i, task_id in [(2, task_ids[2]), (0, task_ids[0]), (1, task_ids[1])]],
+        {"type": "list", "id": empty_id, "name": "L"},
+    ]
+
+
+#There is no way to ask for another user's export: it is always the caller's data
+def test_export_is_the_callers_only(client, user, other_user, make_list):
+    make_list(other_user)
+    assert client.get("/export").status_code == 401
+    assert export(client, user) == []
+    assert client.get("/export?user_id=1", headers=user).text == ""
+
+    #what one user exports, another imports as their own
+    body = client.get("/export", headers=other_user).content
+    assert client.post("/import", content=body, headers=user).json()["tasks"] == 3
+    assert [row["type"] for row in export(client, user)] == ["list", "task", "task", "task"]
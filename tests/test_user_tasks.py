@@ -0,0 +1,85 @@
+import pytest
+
+from app import pagination
+
+
+def get_tasks(client, headers, **params):
+    response = client.get("/tasks", params={"limit": 100, **params}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+#Every page of a query, following X-Next-Cursor
+def all_pages(client, headers, **params):
+    rows, cursor = [], None
+    while True:
+        response = client.get("/tasks", params={**params, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert response.status_code == 200, response.text
+        rows += response.json()
+        cursor = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return rows
+
+
+#two lists of the user's and one of another user, all with matching titles
+@pytest.fixture
+def user_tasks(client, user, other_user):
+    list_ids = []
+    for titles in (["pear", "50% off", "apple"], ["500 g", "banana"]):
+        list_id = client.post("/lists", json={"name": "L"}, headers=user).json()["id"]
+        client.post(f"/lists/{list_id}/tasks:batch", json=[{"title": title} for title in titles], headers=user)
+        list_ids.append(list_id)
+    other_list_id = client.post("/lists", json={"name": "L"}, headers=other_user).json()["id"]
+    client.post(f"/lists/{other_list_id}/tasks:batch", json=[{"title": "pear"}], headers=other_user)
+    tasks = get_tasks(client, user)
+    by_title = {task["title"]: task["id"] for task in tasks}
+    client.post("/tasks:bulk", json={"action": "complete", "task_ids": [by_title["pear"], by_title["banana"]]},
+                headers=user)
+    return list_ids, other_list_id, by_title
+
+
+def titles(rows):
+    return [row["title"] for row in rows]
+
+
+def test_tasks_are_scoped_to_the_callers_lists(client, user, user_tasks):
+    list_ids, other_list_id, _ = user_tasks
+    assert sorted(titles(get_tasks(client, user))) == ["50% off", "500 g", "apple", "banana", "pear"]
+    assert {row["list_id"] for row in get_tasks(client, user)} == set(list_ids)
+    assert get_tasks(client, user, list_id=other_list_id) == []
+
+
+def test_task_filters(client, user, user_tasks):
+    list_ids, _, _ = user_tasks
+    assert titles(get_tasks(client, user, completed="true")) == ["pear", "banana"]
+    assert titles(get_tasks(client, user, completed="false", sort="title")) == ["50% off", "500 g", "apple"]
+    assert titles(get_tasks(client, user, list_id=list_ids[1])) == ["500 g", "banana"]
+    assert len(get_tasks(client, user, list_id=list_ids)) == 5
+    assert titles(get_tasks(client, user, title_prefix="50%")) == ["50% off"]  # % is not a wildcard
+    assert titles(get_tasks(client, user, title_prefix="50", sort="title")) == ["50% off", "500 g"]
+
+
+def test_task_sorts(client, user, user_tasks):
+    list_ids, _, by_title = user_tasks
+    assert titles(get_tasks(client, user, sort="title")) == ["50% off", "500 g", "apple", "banana", "pear"]
+    assert titles(get_tasks(client, user, sort="-title")) == ["pear", "banana", "apple", "500 g", "50% off"]
+    assert titles(get_tasks(client, user, sort="-id")) == ["banana", "500 g", "apple", "50% off", "pear"]
+    client.post(f"/lists/{list_ids[0]}/tasks:move", json={"task_id": by_title["apple"], "after_id": None}, headers=user)
+    assert titles(get_tasks(client, user, sort="position")) == ["apple", "pear", "50% off", "500 g", "banana"]
+    assert titles(get_tasks(client, user, sort="-position")) == ["banana", "500 g", "50% off", "pear", "apple"]
+
+
+#Keyset pages of two add up to the whole result, for every sort
+@pytest.mark.parametrize("sort", ["id", "-id", "title", "-title", "list_id", "-list_id", "position", "-position"])
+def test_task_pages(client, user, user_tasks, sort):
+    assert all_pages(client, user, sort=sort, limit=2) == get_tasks(client, user, sort=sort)
+    assert all_pages(client, user, sort=sort, limit=2, completed="false") == get_tasks(client, user, sort=sort,
+                                                                                       completed="false")
+
+
+def test_bad_sort_or_cursor_is_rejected(client, user, other_user, user_tasks):
+    assert client.get("/tasks?sort=owner", headers=user).status_code == 400
+    assert client.get("/tasks?sort=--id", headers=user).status_code == 400
+    cursor = client.get("/tasks?sort=title&limit=1", headers=user).headers[pagination.NEXT_CURSOR_HEADER]
+    assert client.get("/tasks", params={"sort": "id", "cursor": cursor}, headers=user).status_code == 400
+    assert client.get("/tasks", params={"sort": "title", "cursor": cursor}, headers=other_user).status_code == 400
@@ -0,0 +1,48 @@
+import uuid
+
+from sqlalchemy import select, update
+
+from app import database, hashing, models
+
+
+def sign_up(client):
+    username = "user-" + uuid.uuid4().hex[:12]
+    assert client.post("/users", json={"username": username, "password": "secret"}).status_code == 200
+    return username
+
+
+def checked_out():
+    engine = database.async_engine.sync_engine if database.ASYNC_MODE else database.engine
+    return engine.pool.checkedout()
+
+
+#A login waiting on bcrypt holds no pooled connection
+def test_login_releases_connection_before_hashing(client, monkeypatch):
+    username = sign_up(client)
+    during_hash = []
+    verify_password = hashing.verify_password
+
+    async def verify_and_count(password, hashed_pass):
+        during_hash.append(checked_out())
+        return await verify_password(password, hashed_pass)
+    monkeypatch.setattr(hashing, "verify_password", verify_and_count)
+
+    response = client.post("/users/login", json={"username": username, "password": "secret"})
+    assert response.status_code == 200
+    assert during_hash == [0]
+    assert client.post("/users/login", json={"username": username, "password": "wrong"}).status_code == 401
+
+
+#A hash made with another cost is replaced by one with BCRYPT_ROUNDS on login
+def test_login_rehashes_outdated_password(client):
+    username = sign_up(client)
+    with database.SessionLocal() as db:
+        db.execute(update(models.User).where(models.User.username == username).values(
+            password=hashing.password_context.hash("secret", rounds=5)))
+        db.commit()
+
+    assert client.post("/users/login", json={"username": username, "password": "secret"}).status_code == 200
+    with database.SessionLocal() as db:
+        stored = db.scalar(select(models.User.password).where(models.User.username == username))
+    assert stored.startswith(f"$2b${hashing.BCRYPT_ROUNDS:02d}$")
+    assert hashing.password_context.verify("secret", stored)